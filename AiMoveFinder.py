@@ -1,5 +1,14 @@
-from keras.models import Sequential, load_model, model_from_json
+import time
 import numpy as np
+import NumpyModel
+from ChessEngine import PIECE_SQUARE_VALUES
+from EndgameTables import EndgameTables
+from EvalCache import EvalCache, model_fingerprint
+from OpeningBook import OpeningBook
+from ScoreScale import centipawns_to_score, score_to_centipawns
+from SearchStats import SearchStats, TIMED_METHODS
+from TranspositionTable import TranspositionTable
+
 
 class AiMoveFinder:
     # one-hot-encoded pieces
@@ -20,62 +29,413 @@ class AiMoveFinder:
     }
 
     DEPTH = 2
+    MAX_DEPTH = 64  # deepest iteration of iterative deepening
+
+    # piece values for MVV-LVA capture ordering
+    __piece_values = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 10, '-': 0}
 
-    def __init__(self):
-        self.model = self.__load_keras_model('chess', 'mse', 'adam')
+    # backend 'numpy' runs the network with NumpyModel, 'keras' loads it with keras (imported only then).
+    # precision: kernels of the numpy network in float32, float16 or int8 (NumpyModel.PRECISIONS).
+    # model: network shared with other searches, any object with NumpyModel's predict (e.g. GameServer's batcher)
+    # eval_cache: path of an EvalCache file that keeps network scores between games, processes and restarts.
+    # book: path of an OpeningBook, positions in the book are played from it without a search.
+    # endgame_tables: directory of EndgameTables, positions they cover get their exact score instead of a search.
+    # stats: collect a SearchStats of every search in self.stats, stats_sample_interval also profiles the search
+    # futility_margin: centipawns, leaves whose static evaluation is further than this outside the alpha beta window
+    # keep the static score instead of a network call. None evaluates every leaf with the network
+    def __init__(self, batch_leaves=True, tt_size=2 ** 20, backend='numpy', eval_cache=None, book=None,
+                 book_seed=None, endgame_tables=None, stats=False, stats_sample_interval=None, futility_margin=300,
+                 precision='float32', model=None):
+        if model is not None:
+            self.model = model
+        elif backend == 'keras':
+            if precision != 'float32':
+                raise ValueError('the keras backend only runs float32')
+            self.model = self.__load_keras_model('chess', 'mse', 'adam')
+        else:
+            self.model = NumpyModel.load_model('models/chess_best_model', precision=precision)
+        self.eval_cache = None
+        if eval_cache is not None:
+            self.eval_cache = EvalCache(eval_cache, model_id=model_fingerprint('models/chess_best_model', precision))
+        self.book = OpeningBook(book, book_seed) if book is not None else None
+        self.endgame_tables = EndgameTables(endgame_tables) if endgame_tables is not None else None
+        # score all children of a frontier node with one predict call instead of one call per leaf
+        self.batch_leaves = batch_leaves
+        # search results by position, kept between moves of a game
+        self.transposition_table = TranspositionTable(tt_size)
+        # reused input buffer for batched predict calls, grown when a node has more children
+        self.batch_buffer = np.empty((64, 8, 8, 12), dtype=np.float32)
+        # move ordering: two quiet moves per ply that caused a cutoff, cutoff counts of quiet moves
+        self.killers = [[None, None] for i in range(self.MAX_DEPTH + 1)]
+        self.history = {}
+        self.futility_margin = futility_margin
+        # state of the running search
+        self.next_move = None
+        self.root_depth = self.DEPTH
+        self.pv_move = None
+        self.completed_depth = 0
+        self.best_score = None
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+        self.aborted = False
+        # set by stop() from another thread, cleared by the owner of the search before it starts one
+        self.stop_requested = False
+        # optional event with the same meaning, set from another process (ParallelSearch workers)
+        self.stop_event = None
+        # called with the searched GameState after every completed iteration, e.g. to report progress
+        self.on_iteration = None
+        # statistics of the last search, None when they are not collected
+        self.collect_stats = stats
+        self.stats_sample_interval = stats_sample_interval
+        self.stats = None
 
     def __load_keras_model(self, dataset, loss, optimizer):
-        json_file = open('models/' + dataset + '_best_model' + '.json', 'r')
-        loaded_model_json = json_file.read()
-        json_file.close()
-        model = model_from_json(loaded_model_json)
-        model.compile(optimizer=optimizer, loss=loss, metrics=None)
-        model.load_weights('models/' + dataset + '_best_model' + '.h5')
-        return model
+        return NumpyModel.load_keras_model('models/' + dataset + '_best_model', loss, optimizer)
+
+    # weighted random book move, also resets the search results: a book move has no score or depth
+    def get_book_move(self, gs, valid_moves):
+        if self.book is None:
+            return None
+        move = self.book.choose_move(gs, valid_moves)
+        if move is not None:
+            self.next_move = move
+            self.best_score = None
+            self.completed_depth = 0
+            self.nodes = 0
+        return move
 
     def find_best_move_minmax(self, gs, valid_moves):
-        global next_move
-        next_move = None
-        alpha = 0
-        beta = 1
-        self.__find_move_min_max(gs, valid_moves, alpha, beta, self.DEPTH, gs.white_to_move)
-        return next_move
-
-    # plus alpha beta pruning
+        book_move = self.get_book_move(gs, valid_moves)
+        if book_move is not None:
+            return book_move
+        self.__begin_stats(gs)
+        try:
+            self.__start_search(None, None)
+            self.best_score = self.__search_root(gs, valid_moves, self.DEPTH)
+            self.completed_depth = self.DEPTH
+        finally:
+            self.__end_stats()
+        return self.next_move
+
+    # iterative deepening: searches depth 1, 2, ... until the time (seconds) or node budget is used up
+    # and returns the best move of the deepest completed iteration
+    def find_best_move_iterative(self, gs, valid_moves, time_limit=None, node_limit=None, max_depth=None):
+        self.__begin_stats(gs)
+        try:
+            return self.__iterative_deepening(gs, valid_moves, time_limit, node_limit, max_depth)
+        finally:
+            self.__end_stats()
+
+    # find_best_move_iterative that also returns the SearchStats of the search, collected even when not enabled
+    def find_best_move_with_stats(self, gs, valid_moves, time_limit=None, node_limit=None, max_depth=None):
+        collect_stats = self.collect_stats
+        self.collect_stats = True
+        try:
+            move = self.find_best_move_iterative(gs, valid_moves, time_limit, node_limit, max_depth)
+        finally:
+            self.collect_stats = collect_stats
+        return move, self.stats
+
+    def __iterative_deepening(self, gs, valid_moves, time_limit, node_limit, max_depth):
+        if max_depth is None:
+            max_depth = self.MAX_DEPTH if time_limit is not None or node_limit is not None else self.DEPTH
+        max_depth = min(max_depth, self.MAX_DEPTH)
+        book_move = self.get_book_move(gs, valid_moves)
+        if book_move is not None:
+            return book_move
+        self.__start_search(time_limit, node_limit)
+        start = time.perf_counter()
+        best_move = valid_moves[0] if len(valid_moves) > 0 else None
+        self.completed_depth = 0
+        for depth in range(1, max_depth + 1):
+            # best move of the last iteration is searched first
+            score = self.__search_root(gs, valid_moves, depth, best_move)
+            if self.aborted:
+                break
+            if self.next_move is not None:
+                best_move = self.next_move
+            self.completed_depth = depth
+            self.best_score = score
+            if self.stats is not None:
+                self.stats.iterations.append({'depth': depth, 'nodes': self.nodes, 'score': float(score),
+                                              'seconds': time.perf_counter() - start})
+            if self.on_iteration is not None:
+                self.on_iteration(gs)
+            if len(valid_moves) <= 1:
+                break  # only one move, no need to search deeper
+        self.next_move = best_move
+        return best_move
+
+    # score of the current position searched to depth inside the window alpha, beta,
+    # None when the budget ran out first
+    # killers, history and table age are kept, so sibling positions of one root share them
+    def search_position(self, gs, depth, alpha=0, beta=1, time_limit=None, node_limit=None):
+        self.__begin_stats(gs)
+        try:
+            self.__start_search(time_limit, node_limit, new_root=False)
+            self.root_depth = depth + 1  # searched position is one ply below the root
+            self.pv_move = None
+            score = self.__find_move_min_max(gs, gs.get_valid_moves(), alpha, beta, depth, gs.white_to_move)
+        finally:
+            self.__end_stats()
+        return None if self.aborted else score
+
+    # new statistics for a search of gs when they are collected, with the move generator and the model timed
+    def __begin_stats(self, gs):
+        if not self.collect_stats:
+            self.stats = None
+            return
+        self.stats = SearchStats(self.stats_sample_interval)
+        self.stats.instrument(gs, TIMED_METHODS['gs'], 'gs')
+        # model, cache and tables may be shared with other searches (GameServer), only this search's calls are timed
+        for name in ('model', 'eval_cache', 'endgame_tables'):
+            if getattr(self, name) is not None:
+                self.stats.instrument_attribute(self, name, TIMED_METHODS[name], name)
+        self.stats.start()
+
+    def __end_stats(self):
+        if self.stats is not None:
+            self.stats.stop()
+
+    def __start_search(self, time_limit, node_limit, new_root=True):
+        self.nodes = 0
+        self.node_limit = node_limit
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.aborted = False
+        if not new_root:
+            return
+        self.transposition_table.new_search()
+        self.killers = [[None, None] for i in range(self.MAX_DEPTH + 1)]
+        # keep history between searches, but let older cutoffs count less
+        self.history = {key: value // 2 for key, value in self.history.items() if value > 1}
+
+    def __search_root(self, gs, valid_moves, depth, pv_move=None):
+        self.next_move = None
+        self.root_depth = depth
+        self.pv_move = pv_move
+        return self.__find_move_min_max(gs, valid_moves, 0, 1, depth, gs.white_to_move)
+
+    # ends the running search, it returns the best move of the last completed iteration
+    def stop(self):
+        self.stop_requested = True
+
+    # true when the budget is used up, the running iteration is then thrown away
+    def __out_of_budget(self):
+        if self.stop_requested or (self.stop_event is not None and self.stop_event.is_set()):
+            self.aborted = True
+        elif self.node_limit is not None and self.nodes >= self.node_limit:
+            self.aborted = True
+        elif self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.aborted = True
+        return self.aborted
+
+    # plus alpha beta pruning and transposition table
     def __find_move_min_max(self, gs, valid_moves, alpha, beta, depth, white_to_move):
-        global next_move
+        self.nodes += 1
+        if self.__out_of_budget():
+            return 0
+        stats = self.stats
+        if stats is not None:
+            stats.observe('nodes', self.root_depth - depth)
+        if self.endgame_tables is not None and depth < self.root_depth:
+            score = self.endgame_tables.probe_score(gs)
+            if score is not None:
+                if stats is not None:
+                    stats.count('table_hits')
+                return score
+        tt = self.transposition_table
+        key = gs.zobrist_key
+        entry = tt.probe(key)
+        if stats is not None:
+            stats.count('tt_probes')
+            stats.count('tt_hits', entry is not None)
         if depth == 0:
-            return self.predict_score(gs.board)
+            if entry is not None and entry[1] == 0:
+                return entry[3]
+            window = self.__futility_window(alpha, beta)
+            if window is not None and not window[0] <= gs.static_eval <= window[1]:
+                if stats is not None:
+                    stats.count('futility_pruned')
+                return centipawns_to_score(gs.static_eval)
+            if stats is not None:
+                stats.count('leaf_evaluations')
+            score = self.predict_position(gs)
+            tt.store(key, 0, TranspositionTable.EXACT, score, None)
+            return score
+        is_root = depth == self.root_depth
+        ply = self.root_depth - depth
+        hash_move = None
+        if entry is not None:
+            hash_move = entry[4]
+            # stored result is deep enough, root still searches to pick its move
+            if entry[1] >= depth and not is_root:
+                bound, score = entry[2], entry[3]
+                if bound == TranspositionTable.EXACT or (bound == TranspositionTable.LOWER_BOUND and score >= beta) \
+                        or (bound == TranspositionTable.UPPER_BOUND and score <= alpha):
+                    if stats is not None:
+                        stats.count('tt_cutoffs')
+                    return score
+        if is_root and self.pv_move is not None:
+            hash_move = self.pv_move
+        # frontier node: children are leaves, so score them all at once
+        leaf_scores = None
+        if depth == 1 and self.batch_leaves:
+            if valid_moves is None:
+                valid_moves = gs.get_valid_moves()
+            valid_moves = self.__order_moves(valid_moves, hash_move, ply, white_to_move)
+            leaf_scores = self.predict_children(gs, valid_moves, alpha, beta)
+        elif valid_moves is not None:
+            valid_moves = self.__order_moves(valid_moves, hash_move, ply, white_to_move)
+        else:
+            # moves are generated stage by stage as the loop asks for them, a cutoff skips the rest
+            valid_moves = self.__staged_moves(gs, hash_move, ply, white_to_move)
+        if stats is not None:
+            stats.observe('interior', ply)
+        alpha_orig = alpha
+        beta_orig = beta
+        best_move = None
+        cutoff = False
+        i = -1
         if white_to_move:
             max_score = 0
-            for move in valid_moves:
-                gs.make_move(move)
-                next_moves = gs.get_valid_moves()
-                score = self.__find_move_min_max(gs, next_moves, alpha, beta, depth - 1, not white_to_move)
+            for i, move in enumerate(valid_moves):
+                if leaf_scores is not None:
+                    score = leaf_scores[i]
+                else:
+                    gs.make_move(move)
+                    score = self.__find_move_min_max(gs, None, alpha, beta, depth - 1, not white_to_move)
+                    gs.undo_move()
+                    if self.aborted:
+                        return 0
                 if score > max_score:
                     max_score = score
+                    best_move = move
                     alpha = max(alpha, score)
-                    if depth == self.DEPTH:
-                        next_move = move
-                gs.undo_move()
+                    if is_root:
+                        self.next_move = move
                 if beta <= alpha:
+                    cutoff = True
                     break
-            return max_score
+            best_score = max_score
         else:
             min_score = 1
-            for move in valid_moves:
-                gs.make_move(move)
-                next_moves = gs.get_valid_moves()
-                score = self.__find_move_min_max(gs, next_moves, alpha, beta, depth - 1, not white_to_move)
+            for i, move in enumerate(valid_moves):
+                if leaf_scores is not None:
+                    score = leaf_scores[i]
+                else:
+                    gs.make_move(move)
+                    score = self.__find_move_min_max(gs, None, alpha, beta, depth - 1, not white_to_move)
+                    gs.undo_move()
+                    if self.aborted:
+                        return 1
                 if score < min_score:
                     min_score = score
+                    best_move = move
                     beta = min(beta, score)
-                    if depth == self.DEPTH:
-                        next_move = move
-                gs.undo_move()
+                    if is_root:
+                        self.next_move = move
                 if beta <= alpha:
+                    cutoff = True
                     break
-            return min_score
+            best_score = min_score
+        if i < 0:  # no legal move: checkmate loses for the side to move, stalemate is a draw
+            best_score = (0 if white_to_move else 1) if gs.in_check() else 0.5
+        if stats is not None:
+            stats.observe('moves', ply, i + 1)  # moves searched, the rest of a cut node is never generated
+        if cutoff and best_move is not None and best_move.piece_captured == '--':  # None: window empty on entry
+            self.__store_killer(best_move, ply, depth)
+        if cutoff and stats is not None:
+            stats.observe('cutoffs', ply)
+            stats.observe('cutoff_move', i)  # index of the move that cut off, 0 is the first
+        if best_score <= alpha_orig:
+            bound = TranspositionTable.UPPER_BOUND
+        elif best_score >= beta_orig:
+            bound = TranspositionTable.LOWER_BOUND
+        else:
+            bound = TranspositionTable.EXACT
+        tt.store(key, depth, bound, best_score, best_move)
+        return best_score
+
+    # quiet move that caused a cutoff: remember it for sibling nodes and count it in the history
+    def __store_killer(self, move, ply, depth):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        history_key = (move.piece_moved, move.move_id)
+        self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+
+    # static evaluations in centipawns outside which a leaf is not worth a network call, None without pruning
+    def __futility_window(self, alpha, beta):
+        if self.futility_margin is None:
+            return None
+        return score_to_centipawns(alpha) - self.futility_margin, score_to_centipawns(beta) + self.futility_margin
+
+    # sort keys of the move ordering: captures and promotions by MVV-LVA, quiet moves by history,
+    # ties broken by the piece-square gain of the move
+    def __ordering_keys(self, white_to_move):
+        values = self.__piece_values
+        history = self.history
+        sign = 1 if white_to_move else -1
+
+        def gain(move):
+            square_values = PIECE_SQUARE_VALUES[move.piece_moved]
+            return sign * (square_values[move.end_row][move.end_col] - square_values[move.start_row][move.start_col])
+
+        def capture_key(move):
+            return -(values[move.piece_captured[1]] * 100 - values[move.piece_moved[1]] +
+                     move.is_pawn_promotion * 50), -gain(move)
+
+        def quiet_key(move):
+            return -min(history.get((move.piece_moved, move.move_id), 0), 1999999), -gain(move)
+        return capture_key, quiet_key
+
+    # hash move first, then captures, killer moves and quiet moves
+    def __order_moves(self, valid_moves, hash_move, ply, white_to_move=True):
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+        capture_key, quiet_key = self.__ordering_keys(white_to_move)
+        first, captures, quiets = [], [], []
+        killer_moves = [None, None]
+        for move in valid_moves:
+            if hash_move is not None and move == hash_move:
+                first.append(move)
+            elif move.piece_captured != '--' or move.is_pawn_promotion:
+                captures.append(move)
+            elif move == killers[0]:
+                killer_moves[0] = move
+            elif move == killers[1]:
+                killer_moves[1] = move
+            else:
+                quiets.append(move)
+        captures.sort(key=capture_key)
+        quiets.sort(key=quiet_key)
+        return first + captures + [move for move in killer_moves if move is not None] + quiets
+
+    # the same order from GameState's staged generator, moves are only generated when the search reaches them
+    def __staged_moves(self, gs, hash_move, ply, white_to_move):
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+        capture_key, quiet_key = self.__ordering_keys(white_to_move)
+        return gs.get_staged_moves(hash_move, killers, capture_key, quiet_key)
+
+    # best line found by the last search, read from the transposition table
+    def get_principal_variation(self, gs, max_length=None):
+        line = []
+        seen = set()
+        max_length = max_length or max(self.completed_depth, 1)
+        while len(line) < max_length:
+            entry = self.transposition_table.probe(gs.zobrist_key)
+            if entry is None or entry[4] is None or gs.zobrist_key in seen:
+                break
+            seen.add(gs.zobrist_key)
+            move = next((valid for valid in gs.get_valid_moves() if valid == entry[4]), None)
+            if move is None:
+                break
+            line.append(move)
+            gs.make_move(move)
+        for i in range(len(line)):
+            gs.undo_move()
+        return line
 
     # calculates score of board based on player with an advantage: [0, 1]
     def predict_score(self, board):
@@ -84,6 +444,77 @@ class AiMoveFinder:
         value = self.model.predict(translated.reshape(1, 8, 8, 12))
         return value
 
+    # score of the current position, uses the encoding GameState keeps up to date when it tracks one
+    def predict_position(self, gs):
+        if self.eval_cache is not None:
+            score = self.eval_cache.lookup(gs.zobrist_key)
+            if score is not None:
+                return score
+        if gs.one_hot is None:
+            score = self.predict_score(gs.board)[0][0]
+        else:
+            score = self.predict_batch(gs.one_hot[np.newaxis])[0]
+        if self.eval_cache is not None:
+            self.eval_cache.store(gs.zobrist_key, score)
+        return score
+
+    # scores the position after each move with a single batched predict call, positions in the endgame tables,
+    # the transposition table or the evaluation cache are not sent to the model. with the alpha beta window of the
+    # node, children whose static evaluation is far outside it keep the static score
+    def predict_children(self, gs, moves, alpha=None, beta=None):
+        tt = self.transposition_table
+        tables = self.endgame_tables
+        window = self.__futility_window(alpha, beta) if alpha is not None and beta is not None else None
+        pruned = 0
+        self.nodes += len(moves)
+        scores = [None] * len(moves)
+        missing = []
+        keys = []
+        if len(moves) > len(self.batch_buffer):
+            self.batch_buffer = np.empty((len(moves), 8, 8, 12), dtype=np.float32)
+        batch = self.batch_buffer
+        for i, move in enumerate(moves):
+            gs.make_move(move)
+            table_score = tables.probe_score(gs) if tables is not None else None
+            entry = tt.probe(gs.zobrist_key) if table_score is None else None
+            if table_score is not None:
+                scores[i] = table_score
+            elif entry is not None and entry[1] == 0:
+                scores[i] = entry[3]
+            elif window is not None and not window[0] <= gs.static_eval <= window[1]:
+                scores[i] = centipawns_to_score(gs.static_eval)
+                pruned += 1
+            else:
+                if gs.one_hot is not None:
+                    batch[len(missing)] = gs.one_hot
+                else:
+                    batch[len(missing)] = self.__translate_to_one_hot(gs.board)
+                missing.append(i)
+                keys.append(gs.zobrist_key)
+            gs.undo_move()
+        if len(missing) > 0 and self.eval_cache is not None:
+            values = self.eval_cache.lookup_many(keys)
+            uncached = np.isnan(values)
+            if uncached.any():
+                values[uncached] = self.predict_batch(batch[:len(missing)][uncached])
+                self.eval_cache.store_many(np.array(keys, dtype=np.uint64)[uncached], values[uncached])
+        elif len(missing) > 0:
+            values = self.predict_batch(batch[:len(missing)])
+        if self.stats is not None:
+            self.stats.count('leaf_batches')
+            self.stats.count('leaf_children', len(moves))
+            self.stats.count('futility_pruned', pruned)
+        if len(missing) > 0:
+            for i, key, score in zip(missing, keys, values):
+                scores[i] = score
+                tt.store(key, 0, TranspositionTable.EXACT, score, None)
+        return scores
+
+    # calculates scores for a batch of one hot encoded boards: shape (n, 8, 8, 12)
+    def predict_batch(self, batch):
+        values = self.model.predict(batch, batch_size=len(batch))
+        return values[:, 0]
+
     def __translate_to_one_hot(self, board):
         one_hot_encoded = []
         for row in board:
@@ -0,0 +1,383 @@
+"""
+    Bitboard backend for GameState. Keeps one 64-bit integer per piece next to the 2d-list board and generates
+    legal moves with precomputed attack tables instead of probing make_move/undo_move.
+    Square index: row * 8 + col, so bit 0 is a8 and bit 63 is h1.
+"""
+from ChessEngine import GameState, Move, CASTLE_WKS, CASTLE_BKS, CASTLE_WQS, CASTLE_BQS
+
+FULL = (1 << 64) - 1
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+SQUARES = [(sq // 8, sq % 8) for sq in range(64)]
+
+
+def _on_board(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+
+def _step_attacks(steps):
+    table = []
+    for r, c in SQUARES:
+        bits = 0
+        for dr, dc in steps:
+            if _on_board(r + dr, c + dc):
+                bits |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bits)
+    return table
+
+
+def _ray_mask(sq, directions):
+    r, c = SQUARES[sq]
+    bits = 0
+    for dr, dc in directions:
+        i = 1
+        while _on_board(r + dr * i, c + dc * i):
+            bits |= 1 << ((r + dr * i) * 8 + c + dc * i)
+            i += 1
+    return bits
+
+
+KNIGHT_ATTACKS = _step_attacks(((2, 1), (-2, 1), (-2, -1), (2, -1), (1, 2), (-1, 2), (-1, -2), (1, -2)))
+KING_ATTACKS = _step_attacks(((-1, -1), (-1, 1), (1, -1), (1, 1), (0, 1), (1, 0), (-1, 0), (0, -1)))
+# squares a pawn on sq attacks: white pawns move up the board (row - 1)
+PAWN_ATTACKS = {'w': _step_attacks(((-1, -1), (-1, 1))), 'b': _step_attacks(((1, -1), (1, 1)))}
+
+# line masks for hyperbola quintessence, without the square itself
+FILE_MASKS = [_ray_mask(sq, ((1, 0), (-1, 0))) for sq in range(64)]
+DIAGONAL_MASKS = [_ray_mask(sq, ((1, 1), (-1, -1))) for sq in range(64)]
+ANTI_DIAGONAL_MASKS = [_ray_mask(sq, ((1, -1), (-1, 1))) for sq in range(64)]
+
+
+def _rank_attacks(col, occupancy):
+    bits = 0
+    for d in (1, -1):
+        c = col + d
+        while 0 <= c < 8:
+            bits |= 1 << c
+            if occupancy & (1 << c):
+                break
+            c += d
+    return bits
+
+
+# attacks along a rank, by column of the slider and the 8 bit occupancy of its row
+RANK_ATTACKS = [[_rank_attacks(col, occupancy) for occupancy in range(256)] for col in range(8)]
+
+
+# squares strictly between two squares on a common line, and the whole line through them
+def _between_and_line_tables():
+    between = [[0] * 64 for sq in range(64)]
+    line = [[0] * 64 for sq in range(64)]
+    directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+    for a in range(64):
+        r, c = SQUARES[a]
+        for dr, dc in directions:
+            full_line = _ray_mask(a, ((dr, dc), (-dr, -dc))) | (1 << a)
+            bits = 0
+            i = 1
+            while _on_board(r + dr * i, c + dc * i):
+                b = (r + dr * i) * 8 + c + dc * i
+                between[a][b] = bits
+                line[a][b] = full_line
+                bits |= 1 << b
+                i += 1
+    return between, line
+
+
+BETWEEN, LINE = _between_and_line_tables()
+
+
+# mirror the board vertically, reverses the bit order of file and diagonal masks
+def _flip(bits):
+    return int.from_bytes(bits.to_bytes(8, 'little'), 'big')
+
+
+def _line_attacks(occupied, mask, bit):
+    o = occupied & mask
+    forward = (o - 2 * bit) & FULL
+    reverse = _flip((_flip(o) - 2 * _flip(bit)) & FULL)
+    return (forward ^ reverse) & mask
+
+
+def rook_attacks(sq, occupied):
+    row = sq & 56
+    rank = RANK_ATTACKS[sq & 7][(occupied >> row) & 255] << row
+    return rank | _line_attacks(occupied, FILE_MASKS[sq], 1 << sq)
+
+
+def bishop_attacks(sq, occupied):
+    bit = 1 << sq
+    return _line_attacks(occupied, DIAGONAL_MASKS[sq], bit) | _line_attacks(occupied, ANTI_DIAGONAL_MASKS[sq], bit)
+
+
+# indexes of set bits, lowest first
+def _squares(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class BitboardGameState(GameState):
+    def __init__(self, track_one_hot=False, bitboards=True):
+        super().__init__(track_one_hot)
+        self.reset_bitboards()
+
+    # build bitboards from the 2d-list board, needed after the board is set up without make_move
+    def reset_bitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupied = {'w': 0, 'b': 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.bitboards[piece] |= 1 << (r * 8 + c)
+                    self.occupied[piece[0]] |= 1 << (r * 8 + c)
+
+    def set_position(self, board, white_to_move, castle_rights, en_passant_possible):
+        super().set_position(board, white_to_move, castle_rights, en_passant_possible)
+        self.reset_bitboards()
+
+    # xor the bits move changes: applied after make_move and again after undo_move, which flips them back
+    def __toggle_bitboards(self, move):
+        bb = self.bitboards
+        occupied = self.occupied
+        code = move.code
+        start = 1 << (code & 63)
+        end = 1 << (code >> 6 & 63)
+        moved = move.piece_moved
+        color = moved[0]
+        if move.is_pawn_promotion:
+            bb[moved] ^= start
+            bb[color + 'Q'] ^= end
+        else:
+            bb[moved] ^= start | end
+        occupied[color] ^= start | end
+        captured = move.piece_captured
+        if move.is_en_passant_move:
+            captured_bit = 1 << (move.start_row * 8 + move.end_col)
+            bb[captured] ^= captured_bit
+            occupied[captured[0]] ^= captured_bit
+        elif captured != "--":
+            bb[captured] ^= end
+            occupied[captured[0]] ^= end
+        elif move.is_castle_move:
+            row = move.end_row * 8
+            if move.end_col - move.start_col == 2:
+                rook = (1 << (row + move.end_col + 1)) | (1 << (row + move.end_col - 1))
+            else:
+                rook = (1 << (row + move.end_col - 2)) | (1 << (row + move.end_col + 1))
+            bb[color + 'R'] ^= rook
+            occupied[color] ^= rook
+
+    def make_move(self, move):
+        super().make_move(move)
+        self.__toggle_bitboards(move)
+
+    def undo_move(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            super().undo_move()
+            self.__toggle_bitboards(move)
+
+    # bitboard of pieces of color by_color that attack sq
+    def attackers_to(self, sq, by_color, occupied):
+        bb = self.bitboards
+        own = 'b' if by_color == 'w' else 'w'
+        attackers = KNIGHT_ATTACKS[sq] & bb[by_color + 'N']
+        attackers |= KING_ATTACKS[sq] & bb[by_color + 'K']
+        attackers |= PAWN_ATTACKS[own][sq] & bb[by_color + 'p']
+        attackers |= bishop_attacks(sq, occupied) & (bb[by_color + 'B'] | bb[by_color + 'Q'])
+        attackers |= rook_attacks(sq, occupied) & (bb[by_color + 'R'] | bb[by_color + 'Q'])
+        return attackers
+
+    def square_under_attack(self, r, c):
+        enemy = 'b' if self.white_to_move else 'w'
+        return self.attackers_to(r * 8 + c, enemy, self.occupied['w'] | self.occupied['b']) != 0
+
+    def in_check(self):
+        r, c = self.white_king_location if self.white_to_move else self.black_king_location
+        return self.square_under_attack(r, c)
+
+    # own pieces that are the only blocker between the king and an enemy slider
+    def __pinned_pieces(self, king_sq, us, enemy, occupied):
+        bb = self.bitboards
+        pinned = 0
+        snipers = (rook_attacks(king_sq, 0) & (bb[enemy + 'R'] | bb[enemy + 'Q'])) | \
+                  (bishop_attacks(king_sq, 0) & (bb[enemy + 'B'] | bb[enemy + 'Q']))
+        for sq in _squares(snipers):
+            blockers = BETWEEN[king_sq][sq] & occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & self.occupied[us]:
+                pinned |= blockers
+        return pinned
+
+    # moves considering checks
+    def get_valid_moves(self):
+        board = self.board
+        return [Move.from_code(code, board) for code in self.get_valid_move_codes()]
+
+    # legal moves as packed Move codes. with a buffer (list, array or numpy array with room for 256 moves)
+    # the codes are written into it and their count is returned, otherwise a new list is returned
+    def get_valid_move_codes(self, buffer=None):
+        moves = []
+        bb = self.bitboards
+        us, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        own = self.occupied[us]
+        them = self.occupied[enemy]
+        occupied = own | them
+        king_r, king_c = self.white_king_location if self.white_to_move else self.black_king_location
+        king_sq = king_r * 8 + king_c
+        checkers = self.attackers_to(king_sq, enemy, occupied)
+
+        self.__get_king_moves(king_sq, enemy, occupied, ~own, moves)
+
+        if checkers & (checkers - 1) == 0:  # not in double check
+            # non king moves must capture the checker or block it
+            targets = FULL
+            if checkers:
+                checker_sq = checkers.bit_length() - 1
+                targets = checkers | BETWEEN[king_sq][checker_sq]
+            pinned = self.__pinned_pieces(king_sq, us, enemy, occupied)
+            self.__get_piece_moves(us, own, them, occupied, targets, pinned, king_sq, moves)
+            self.__get_pawn_moves(us, enemy, them, occupied, targets, pinned, king_sq, moves)
+            if not checkers:
+                self.__get_castle_moves(king_sq, king_c, enemy, occupied, moves)
+
+        if len(moves) == 0:  # checkmate or stalemate
+            if checkers:
+                self.check_mate = True
+            else:
+                self.stale_mate = True
+        else:
+            self.check_mate = False
+            self.stale_mate = False
+        if buffer is None:
+            return moves
+        buffer[:len(moves)] = moves
+        return len(moves)
+
+    # check state of the side to move for get_staged_moves
+    def staged_context(self):
+        us, enemy = ('w', 'b') if self.white_to_move else ('b', 'w')
+        own = self.occupied[us]
+        occupied = own | self.occupied[enemy]
+        king_r, king_c = self.white_king_location if self.white_to_move else self.black_king_location
+        king_sq = king_r * 8 + king_c
+        checkers = self.attackers_to(king_sq, enemy, occupied)
+        targets = FULL
+        if checkers and checkers & (checkers - 1) == 0:
+            targets = checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+        return {'in_check': checkers != 0, 'us': us, 'enemy': enemy, 'own': own, 'occupied': occupied,
+                'king_sq': king_sq, 'king_c': king_c, 'checkers': checkers, 'targets': targets,
+                'pinned': self.__pinned_pieces(king_sq, us, enemy, occupied)}
+
+    # legal move codes of the pieces on sources: captures and promotions (captures True), quiet moves (False)
+    # or both (None), in the order get_valid_move_codes makes them
+    def __staged_codes(self, context, captures, sources=FULL):
+        us, enemy, own, occupied = context['us'], context['enemy'], context['own'], context['occupied']
+        king_sq, checkers = context['king_sq'], context['checkers']
+        them = occupied ^ own
+        kinds = them if captures else (FULL & ~occupied if captures is not None else FULL & ~own)
+        moves = []
+        if sources & (1 << king_sq):
+            self.__get_king_moves(king_sq, enemy, occupied, kinds, moves)
+        if checkers & (checkers - 1) == 0:  # not in double check
+            targets, pinned = context['targets'], context['pinned']
+            self.__get_piece_moves(us, own, them, occupied, targets & kinds, pinned, king_sq, moves, sources)
+            self.__get_pawn_moves(us, enemy, them, occupied, targets, pinned, king_sq, moves, sources, captures)
+            if captures is not True and not checkers and sources & (1 << king_sq):
+                self.__get_castle_moves(king_sq, context['king_c'], enemy, occupied, moves)
+        return moves
+
+    def staged_candidates(self, context, captures):
+        board = self.board
+        return [Move.from_code(code, board) for code in self.__staged_codes(context, captures)]
+
+    # the bitboard generator only makes legal moves
+    def staged_is_legal(self, context, move):
+        return True
+
+    # legal move of the position with the squares of move (a hash or killer move from another node), or None
+    def staged_legal_move(self, context, move):
+        start = move.start_row * 8 + move.start_col
+        if not context['own'] & (1 << start) or self.board[move.start_row][move.start_col] != move.piece_moved:
+            return None
+        squares = move.code & 0xfff
+        for code in self.__staged_codes(context, None, 1 << start):
+            if code & 0xfff == squares:
+                return Move.from_code(code, self.board)
+        return None
+
+    # king moves to targets (never own pieces): a target must not be attacked once the king has left its square
+    def __get_king_moves(self, king_sq, enemy, occupied, targets, moves):
+        without_king = occupied ^ (1 << king_sq)
+        for to in _squares(KING_ATTACKS[king_sq] & targets):
+            if not self.attackers_to(to, enemy, without_king):
+                moves.append(king_sq | to << 6)
+
+    def __get_piece_moves(self, us, own, them, occupied, targets, pinned, king_sq, moves, sources=FULL):
+        bb = self.bitboards
+        for piece in ('N', 'B', 'R', 'Q'):
+            for sq in _squares(bb[us + piece] & sources):
+                if piece == 'N':
+                    if pinned & (1 << sq):
+                        continue  # a pinned knight can never move
+                    attacks = KNIGHT_ATTACKS[sq]
+                elif piece == 'B':
+                    attacks = bishop_attacks(sq, occupied)
+                elif piece == 'R':
+                    attacks = rook_attacks(sq, occupied)
+                else:
+                    attacks = bishop_attacks(sq, occupied) | rook_attacks(sq, occupied)
+                attacks &= ~own & targets
+                if pinned & (1 << sq):
+                    attacks &= LINE[king_sq][sq]
+                for to in _squares(attacks):
+                    moves.append(sq | to << 6)
+
+    # captures: only captures and promotions (True), only the other pushes (False) or all moves (None)
+    def __get_pawn_moves(self, us, enemy, them, occupied, targets, pinned, king_sq, moves, sources=FULL,
+                         captures=None):
+        direction = -1 if us == 'w' else 1
+        start_row = 6 if us == 'w' else 1
+        promotion_row = 0 if us == 'w' else 7
+        for sq in _squares(self.bitboards[us + 'p'] & sources):
+            r = sq >> 3
+            # pawns one step before the last row promote on every move
+            flags = Move.PROMOTE_QUEEN if r + direction == promotion_row else 0
+            allowed = targets
+            if pinned & (1 << sq):
+                allowed &= LINE[king_sq][sq]
+            one = sq + 8 * direction
+            if not occupied & (1 << one):
+                if allowed & (1 << one) and (captures is None or captures == (flags != 0)):
+                    moves.append(sq | one << 6 | flags)
+                two = one + 8 * direction
+                if r == start_row and not occupied & (1 << two) and allowed & (1 << two) and captures is not True:
+                    moves.append(sq | two << 6)
+            if captures is False:
+                continue
+            for to in _squares(PAWN_ATTACKS[us][sq] & them & allowed):
+                moves.append(sq | to << 6 | flags)
+            if self.en_passant_possible != ():
+                ep_sq = self.en_passant_possible[0] * 8 + self.en_passant_possible[1]
+                if PAWN_ATTACKS[us][sq] & (1 << ep_sq) and self.__en_passant_is_legal(sq, ep_sq, king_sq, enemy):
+                    moves.append(sq | ep_sq << 6 | Move.EN_PASSANT)
+
+    # en passant removes two pawns from a row, so test the resulting occupancy directly
+    def __en_passant_is_legal(self, sq, ep_sq, king_sq, enemy):
+        captured_sq = ep_sq + 8 if enemy == 'b' else ep_sq - 8
+        occupied = (self.occupied['w'] | self.occupied['b']) ^ (1 << sq) ^ (1 << captured_sq) | (1 << ep_sq)
+        return self.attackers_to(king_sq, enemy, occupied) & ~(1 << captured_sq) == 0
+
+    def __get_castle_moves(self, king_sq, c, enemy, occupied, moves):
+        r = king_sq >> 3
+        if self.castling & (CASTLE_WKS if self.white_to_move else CASTLE_BKS):
+            if c + 2 < 8 and not occupied & ((1 << (r * 8 + c + 1)) | (1 << (r * 8 + c + 2))):
+                if not self.attackers_to(r * 8 + c + 1, enemy, occupied) and \
+                        not self.attackers_to(r * 8 + c + 2, enemy, occupied):
+                    moves.append(king_sq | (king_sq + 2) << 6 | Move.CASTLE)
+        if self.castling & (CASTLE_WQS if self.white_to_move else CASTLE_BQS):
+            if c - 3 >= 0 and not occupied & ((1 << (r * 8 + c - 1)) | (1 << (r * 8 + c - 2)) | (1 << (r * 8 + c - 3))):
+                if not self.attackers_to(r * 8 + c - 1, enemy, occupied) and \
+                        not self.attackers_to(r * 8 + c - 2, enemy, occupied):
+                    moves.append(king_sq | (king_sq - 2) << 6 | Move.CASTLE)
@@ -0,0 +1,152 @@
+"""
+ Rendering layer of ChessMain. The board background, piece images, highlight surfaces, font and texts are prepared
+ once, every frame only the squares whose piece or highlight changed are redrawn and passed to p.display.update,
+ so an idle window costs next to nothing. Animations redraw only the squares the moving piece passes.
+
+ renderer = BoardRenderer(screen, SQ_SIZE)
+ renderer.draw(gs, valid_moves, sq_selected, text)   once per frame, text over the board or None
+ renderer.animate_move(move, gs.board, clock)       after gs.make_move(move)
+ renderer.invalidate()                              the window was covered, redraw everything on the next draw
+"""
+
+import pygame as p
+
+DIMENSION = 8  # chessboard is 8x8
+COLORS = ("papayawhip", "saddlebrown")  # light and dark squares
+HIGHLIGHT_COLORS = ("blue", "yellow")  # selected square, squares the selected piece can move to
+HIGHLIGHT_ALPHA = 100  # [0, 255]
+NO_HIGHLIGHT, SELECTED, TARGET = 0, 1, 2
+ANIMATION_FPS = 60
+FRAMES_PER_SQUARE = 10
+
+
+class BoardRenderer():
+    def __init__(self, screen, sq_size, image_directory='images'):
+        self.screen = screen
+        self.sq_size = sq_size
+        self.size = sq_size * DIMENSION
+        self.images = {}
+        for piece in ('wp', 'bp', 'wR', 'bR', 'wN', 'bN', 'wB', 'bB', 'wQ', 'bQ', 'wK', 'bK'):
+            # resize once, convert to the display format so blits need no conversion
+            image = p.transform.scale(p.image.load(image_directory + "/" + piece + ".png"), (sq_size, sq_size))
+            self.images[piece] = image.convert_alpha()
+        # empty board, drawn once and copied from square by square
+        self.background = p.Surface((self.size, self.size)).convert()
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                self.background.fill(p.Color(COLORS[(row + col) % 2]), self.square_rect(row, col))
+        self.highlights = [None]
+        for color in HIGHLIGHT_COLORS:
+            highlight = p.Surface((sq_size, sq_size)).convert()
+            highlight.set_alpha(HIGHLIGHT_ALPHA)
+            highlight.fill(p.Color(color))
+            self.highlights.append(highlight)
+        self.font = None  # created the first time a text is shown
+        self.texts = {}  # text: (surfaces, rect)
+        # what each square (row * 8 + col) shows on the screen: (piece, highlight), None when unknown
+        self.shown = [None] * (DIMENSION * DIMENSION)
+        self.text = None
+
+    def square_rect(self, row, col):
+        return p.Rect(col * self.sq_size, row * self.sq_size, self.sq_size, self.sq_size)
+
+    # the screen was changed behind the renderer's back, redraw everything on the next draw
+    def invalidate(self):
+        self.shown = [None] * (DIMENSION * DIMENSION)
+
+    # piece and highlight of every square for the current game state
+    def square_states(self, gs, valid_moves, sq_selected):
+        highlights = [NO_HIGHLIGHT] * (DIMENSION * DIMENSION)
+        if sq_selected != ():
+            r, c = sq_selected
+            if gs.board[r][c][0] == ('w' if gs.white_to_move else 'b'):  # sq_selected is piece that can be moved
+                highlights[r * DIMENSION + c] = SELECTED
+                for move in valid_moves:
+                    if move.start_row == r and move.start_col == c:
+                        highlights[move.end_row * DIMENSION + move.end_col] = TARGET
+        return [(piece, highlights[i]) for i, piece in enumerate(piece for row in gs.board for piece in row)]
+
+    # rendered text centered on the board, black with a gray shadow
+    def text_surfaces(self, text):
+        if text not in self.texts:
+            if self.font is None:
+                self.font = p.font.SysFont('Comic Sans', 32, True, False)
+            front = self.font.render(text, 0, p.Color('Black'))
+            shadow = self.font.render(text, 0, p.Color('Gray'))
+            location = (self.size // 2 - front.get_width() // 2, self.size // 2 - front.get_height() // 2)
+            shadow_location = (location[0] + 2, location[1] + 2)
+            rect = front.get_rect(topleft=location).union(shadow.get_rect(topleft=shadow_location))
+            self.texts[text] = ((front, location), (shadow, shadow_location)), rect
+        return self.texts[text]
+
+    # redraws the squares that changed since the last frame and updates only their part of the display
+    def draw(self, gs, valid_moves, sq_selected, text=None):
+        states = self.square_states(gs, valid_moves, sq_selected)
+        text_rect = self.text_surfaces(text)[1] if text is not None else None
+        changed = [i for i in range(DIMENSION * DIMENSION) if states[i] != self.shown[i]]
+        if text != self.text:
+            # squares under the old text lose it, squares under the new one are redrawn below it
+            for old_or_new in (self.text, text):
+                if old_or_new is not None:
+                    rect = self.text_surfaces(old_or_new)[1]
+                    changed += [i for i in range(DIMENSION * DIMENSION) if i not in changed and
+                                rect.colliderect(self.square_rect(i // DIMENSION, i % DIMENSION))]
+            self.text = text
+        if not changed:
+            return
+        dirty = []
+        for i in changed:
+            rect = self.square_rect(i // DIMENSION, i % DIMENSION)
+            piece, highlight = states[i]
+            self.screen.blit(self.background, rect, rect)
+            if highlight != NO_HIGHLIGHT:
+                self.screen.blit(self.highlights[highlight], rect)
+            if piece != "--":
+                self.screen.blit(self.images[piece], rect)
+            self.shown[i] = states[i]
+            dirty.append(rect)
+        if text_rect is not None and text_rect.collidelist(dirty) != -1:
+            # text is drawn over the redrawn squares, where it already was on the others it is drawn again unchanged
+            for surface, location in self.text_surfaces(text)[0]:
+                self.screen.blit(surface, location)
+            dirty.append(text_rect)
+        p.display.update(dirty)
+
+    # slides the moved piece from its start to its end square, board is the board after the move
+    def animate_move(self, move, board, clock):
+        # board without the moving piece: the captured piece stays on the end square until it is covered
+        still = self.background.copy()
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                piece = board[row][col]
+                if (row, col) == (move.end_row, move.end_col):
+                    piece = move.piece_captured
+                if piece != "--":
+                    still.blit(self.images[piece], self.square_rect(row, col))
+        # squares other than start and end only change here if highlights were shown, those are redrawn once
+        dirty = []
+        for i in range(DIMENSION * DIMENSION):
+            row, col = i // DIMENSION, i % DIMENSION
+            if self.shown[i] != (board[row][col], NO_HIGHLIGHT) or \
+                    (row, col) in ((move.start_row, move.start_col), (move.end_row, move.end_col)):
+                dirty.append(self.square_rect(row, col))
+        for rect in dirty:
+            self.screen.blit(still, rect, rect)
+        dR = move.end_row - move.start_row
+        dC = move.end_col - move.start_col
+        frame_count = (abs(dR) + abs(dC)) * FRAMES_PER_SQUARE
+        previous = None
+        for frame in range(frame_count + 1):
+            r, c = (move.start_row + dR * frame / frame_count, move.start_col + dC * frame / frame_count)
+            rect = p.Rect(int(c * self.sq_size), int(r * self.sq_size), self.sq_size, self.sq_size)
+            if previous is not None:
+                self.screen.blit(still, previous, previous)
+            self.screen.blit(self.images[move.piece_moved], rect)
+            p.display.update(dirty + ([previous, rect] if previous is not None else [rect]))
+            dirty = []
+            previous = rect
+            clock.tick(ANIMATION_FPS)
+        # the end square shows the moved piece, which may differ from the board after a promotion
+        for i in range(DIMENSION * DIMENSION):
+            self.shown[i] = (board[i // DIMENSION][i % DIMENSION], NO_HIGHLIGHT)
+        self.shown[move.end_row * DIMENSION + move.end_col] = None
@@ -1,10 +1,83 @@
 """
     Responsible for storing all data for current state of chess game. Executing chess rules and logging moves.
 """
+import random
+import numpy as np
+
+# zobrist keys, fixed seed so position hashes are the same in every run and process
+zobrist_random = random.Random(20210101)
+ZOBRIST_PIECES = {piece: [[zobrist_random.getrandbits(64) for c in range(8)] for r in range(8)]
+                  for piece in ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')}
+ZOBRIST_BLACK_TO_MOVE = zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [zobrist_random.getrandbits(64) for i in range(4)]  # wks, bks, wqs, bqs
+ZOBRIST_EN_PASSANT = [zobrist_random.getrandbits(64) for c in range(8)]  # file of en passant square
+
+# castling rights as a 4 bit mask, bit order matches ZOBRIST_CASTLING
+CASTLE_WKS, CASTLE_BKS, CASTLE_WQS, CASTLE_BQS = 1, 2, 4, 8
+ZOBRIST_CASTLING_MASKS = [0] * 16
+for mask in range(16):
+    for i in range(4):
+        if mask & (1 << i):
+            ZOBRIST_CASTLING_MASKS[mask] ^= ZOBRIST_CASTLING[i]
+# rights kept when a piece moves from or to a square (row * 8 + col): a rook leaving or captured on its corner
+CASTLE_KEEP = [15] * 64
+CASTLE_KEEP[0], CASTLE_KEEP[7] = 15 ^ CASTLE_BQS, 15 ^ CASTLE_BKS
+CASTLE_KEEP[56], CASTLE_KEEP[63] = 15 ^ CASTLE_WQS, 15 ^ CASTLE_WKS
+# (row, col) of each square index, shared so en passant squares are never allocated
+SQUARE_COORDS = [(sq // 8, sq % 8) for sq in range(64)]
+UNDO_STACK_SIZE = 512  # plies the undo stack holds before it is grown
+
+# channel of each piece in the one hot encoding the value network expects
+ONE_HOT_CHANNELS = {'bp': 0, 'bN': 1, 'bB': 2, 'bR': 3, 'bQ': 4, 'bK': 5,
+                    'wp': 6, 'wN': 7, 'wB': 8, 'wR': 9, 'wQ': 10, 'wK': 11}
+ONE_HOT_SQUARES = {piece: np.eye(12, dtype=np.float32)[channel] for piece, channel in ONE_HOT_CHANNELS.items()}
+ONE_HOT_SQUARES['--'] = np.zeros(12, dtype=np.float32)
+
+# handcrafted static evaluation in centipawns: material plus piece-square tables ("simplified evaluation function"),
+# tables seen from white with rank 8 first like the board
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+PIECE_SQUARE_TABLES = {
+    'p': [[0, 0, 0, 0, 0, 0, 0, 0], [50, 50, 50, 50, 50, 50, 50, 50], [10, 10, 20, 30, 30, 20, 10, 10],
+          [5, 5, 10, 25, 25, 10, 5, 5], [0, 0, 0, 20, 20, 0, 0, 0], [5, -5, -10, 0, 0, -10, -5, 5],
+          [5, 10, 10, -20, -20, 10, 10, 5], [0, 0, 0, 0, 0, 0, 0, 0]],
+    'N': [[-50, -40, -30, -30, -30, -30, -40, -50], [-40, -20, 0, 0, 0, 0, -20, -40],
+          [-30, 0, 10, 15, 15, 10, 0, -30], [-30, 5, 15, 20, 20, 15, 5, -30], [-30, 0, 15, 20, 20, 15, 0, -30],
+          [-30, 5, 10, 15, 15, 10, 5, -30], [-40, -20, 0, 5, 5, 0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    'B': [[-20, -10, -10, -10, -10, -10, -10, -20], [-10, 0, 0, 0, 0, 0, 0, -10], [-10, 0, 5, 10, 10, 5, 0, -10],
+          [-10, 5, 5, 10, 10, 5, 5, -10], [-10, 0, 10, 10, 10, 10, 0, -10], [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10, 5, 0, 0, 0, 0, 5, -10], [-20, -10, -10, -10, -10, -10, -10, -20]],
+    'R': [[0, 0, 0, 0, 0, 0, 0, 0], [5, 10, 10, 10, 10, 10, 10, 5], [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5], [-5, 0, 0, 0, 0, 0, 0, -5], [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5], [0, 0, 0, 5, 5, 0, 0, 0]],
+    'Q': [[-20, -10, -10, -5, -5, -10, -10, -20], [-10, 0, 0, 0, 0, 0, 0, -10], [-10, 0, 5, 5, 5, 5, 0, -10],
+          [-5, 0, 5, 5, 5, 5, 0, -5], [0, 0, 5, 5, 5, 5, 0, -5], [-10, 5, 5, 5, 5, 5, 0, -10],
+          [-10, 0, 5, 0, 0, 0, 0, -10], [-20, -10, -10, -5, -5, -10, -10, -20]],
+    'K': [[-30, -40, -40, -50, -50, -40, -40, -30], [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30], [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20], [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20, 0, 0, 0, 0, 20, 20], [20, 30, 10, 0, 0, 10, 30, 20]],
+}
+# value of each piece on each square from white's point of view: black pieces count negative, on the mirrored table
+PIECE_SQUARE_VALUES = {'--': [[0] * 8 for r in range(8)]}
+for kind, table in PIECE_SQUARE_TABLES.items():
+    PIECE_SQUARE_VALUES['w' + kind] = [[PIECE_VALUES[kind] + table[r][c] for c in range(8)] for r in range(8)]
+    PIECE_SQUARE_VALUES['b' + kind] = [[-PIECE_VALUES[kind] - table[7 - r][c] for c in range(8)] for r in range(8)]
 
 
 class GameState():
-    def __init__(self):
+    # rook directions first, then bishop directions
+    ray_directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+    knight_directions = ((2, 1), (-2, 1), (-2, -1), (2, -1), (1, 2), (-1, 2), (-1, -2), (1, -2))
+
+    # GameState(bitboards=True) creates the bitboard backend of BitboardEngine with the same api
+    def __new__(cls, track_one_hot=False, bitboards=False):
+        if bitboards and cls is GameState:
+            from BitboardEngine import BitboardGameState
+            cls = BitboardGameState
+        return super().__new__(cls)
+
+    def __init__(self, track_one_hot=False, bitboards=False):
         # 2d-list -> each element has 2 chars
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -27,25 +100,230 @@ class GameState():
         self.black_king_location = (0, 4)
         self.check_mate = False
         self.stale_mate = False
+        self.is_in_check = False
+        self.pins = []  # filled by get_valid_moves
+        self.checks = []
         self.en_passant_possible = ()  # coordinates for en passant sqaure
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        # log for undo moves!
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.castling = CASTLE_WKS | CASTLE_BKS | CASTLE_WQS | CASTLE_BQS
+        # undo stack, one record per ply of moveLog: castling mask | (en passant square + 1) << 4 and the
+        # position key before the move. preallocated, make_move only overwrites entries
+        self.undo_state = [0] * UNDO_STACK_SIZE
+        self.undo_keys = [0] * UNDO_STACK_SIZE
+        self.undo_evals = [0] * UNDO_STACK_SIZE
+        # position key, updated incrementally by make_move and restored from the undo stack by undo_move
+        self.zobrist_key = self.compute_zobrist_key()
+        # material and piece-square score in centipawns for white, kept up to date the same way
+        self.static_eval = self.compute_static_eval()
+        # optional (8, 8, 12) encoding for the value network, rows in model order (rank 1 first)
+        self.one_hot = None
+        if track_one_hot:
+            self.one_hot = np.zeros((8, 8, 12), dtype=np.float32)
+            self.reset_one_hot()
+
+    # set up a position from a FEN string, halfmove clock and move number are checked but ignored.
+    # raises ValueError for anything that isn't a legal position, castling rights without king and rook on their
+    # squares are dropped
+    def load_fen(self, fen):
+        fields = fen.split()
+        if not 2 <= len(fields) <= 6 or len(fields[0].split('/')) != 8:
+            raise ValueError("invalid FEN: " + fen)
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char in "12345678":
+                    row += ["--"] * int(char)
+                elif char.upper() in "PNBRQK":
+                    row.append(('w' if char.isupper() else 'b') + (char.upper() if char.upper() != 'P' else 'p'))
+                else:
+                    raise ValueError("invalid FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("invalid FEN: " + fen)
+            board.append(row)
+        pieces = [piece for row in board for piece in row]
+        if pieces.count("wK") != 1 or pieces.count("bK") != 1:
+            raise ValueError("invalid FEN, each side needs one king: " + fen)
+        if any(piece[1] == 'p' for piece in board[0] + board[7]):
+            raise ValueError("invalid FEN, pawn on the first or last rank: " + fen)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("invalid FEN, side to move: " + fen)
+        white_to_move = fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        if castling != '-' and (not castling or set(castling) - set('KQkq') or len(set(castling)) != len(castling)):
+            raise ValueError("invalid FEN, castling rights: " + fen)
+        # a right only counts while its king and rook are on their starting squares
+        king_home = {'w': board[7][4] == "wK", 'b': board[0][4] == "bK"}
+        rights = CastleRights('K' in castling and king_home['w'] and board[7][7] == "wR",
+                              'k' in castling and king_home['b'] and board[0][7] == "bR",
+                              'Q' in castling and king_home['w'] and board[7][0] == "wR",
+                              'q' in castling and king_home['b'] and board[0][0] == "bR")
+        en_passant = fields[3] if len(fields) > 3 else '-'
+        if en_passant == '-':
+            en_passant_square = ()
+        else:
+            # the square behind a pawn of the side not to move that has just moved two squares
+            if len(en_passant) != 2 or en_passant[0] not in Move.files_to_cols or \
+                    en_passant[1] != ('6' if white_to_move else '3'):
+                raise ValueError("invalid FEN, en passant square: " + fen)
+            row, col = Move.ranks_to_rows[en_passant[1]], Move.files_to_cols[en_passant[0]]
+            pawn_row, start_row = (row + 1, row - 1) if white_to_move else (row - 1, row + 1)
+            if board[pawn_row][col] != ('b' if white_to_move else 'w') + 'p' or board[row][col] != "--" or \
+                    board[start_row][col] != "--":
+                raise ValueError("invalid FEN, no pawn passed the en passant square: " + fen)
+            en_passant_square = (row, col)
+        if any(not field.isdigit() for field in fields[4:]):
+            raise ValueError("invalid FEN, move counters: " + fen)
+        # the side that just moved can't have left its king in check
+        opponent = GameState()
+        opponent.set_position([row[:] for row in board], not white_to_move, CastleRights.from_mask(0), ())
+        if opponent.in_check():
+            raise ValueError("invalid FEN, the side not to move is in check: " + fen)
+        self.set_position(board, white_to_move, rights, en_passant_square)
+
+    # FEN of the position. the halfmove clock is not tracked, the move number counts from the last set position
+    def get_fen(self, halfmove_clock=0, fullmove_number=None):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ''))
+        castling = ''.join(letter for letter, bit in (('K', CASTLE_WKS), ('Q', CASTLE_WQS), ('k', CASTLE_BKS),
+                                                      ('q', CASTLE_BQS)) if self.castling & bit) or '-'
+        en_passant = Move.cols_to_files[self.en_passant_possible[1]] + \
+            Move.rows_to_ranks[self.en_passant_possible[0]] if self.en_passant_possible != () else '-'
+        if fullmove_number is None:
+            fullmove_number = 1 + len(self.moveLog) // 2
+        return '%s %s %s %s %d %d' % ('/'.join(ranks), 'w' if self.white_to_move else 'b', castling, en_passant,
+                                      halfmove_clock, fullmove_number)
+
+    # castling rights as an object, the position keeps them in the castling mask
+    @property
+    def current_castling_rights(self):
+        return CastleRights.from_mask(self.castling)
+
+    # compact picklable copy of the position, without move history: used to send positions to other processes
+    def get_snapshot(self):
+        rights = self.current_castling_rights
+        return ("".join("".join(row) for row in self.board), self.white_to_move,
+                (rights.wks, rights.bks, rights.wqs, rights.bqs), self.en_passant_possible)
+
+    def load_snapshot(self, snapshot):
+        pieces, white_to_move, castling, en_passant = snapshot
+        board = [[pieces[(r * 8 + c) * 2:(r * 8 + c) * 2 + 2] for c in range(8)] for r in range(8)]
+        self.set_position(board, white_to_move, CastleRights(*castling), en_passant)
+
+    # replaces the position, move history is cleared
+    def set_position(self, board, white_to_move, castle_rights, en_passant_possible):
+        self.board = board
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == "wK":
+                    self.white_king_location = (r, c)
+                elif board[r][c] == "bK":
+                    self.black_king_location = (r, c)
+        self.white_to_move = white_to_move
+        self.castling = castle_rights.to_mask()
+        self.en_passant_possible = SQUARE_COORDS[en_passant_possible[0] * 8 + en_passant_possible[1]] \
+            if en_passant_possible != () else ()
+        self.moveLog = []
+        self.check_mate = False
+        self.stale_mate = False
+        self.zobrist_key = self.compute_zobrist_key()
+        self.static_eval = self.compute_static_eval()
+        if self.one_hot is not None:
+            self.reset_one_hot()
+
+    # encode the whole board, needed after the board is set up without make_move
+    def reset_one_hot(self):
+        for r in range(8):
+            for c in range(8):
+                self.one_hot[7 - r, c] = ONE_HOT_SQUARES[self.board[r][c]]
+
+    # encode only the squares changed by move
+    def update_one_hot(self, move):
+        one_hot = self.one_hot
+        board = self.board
+        one_hot[7 - move.start_row, move.start_col] = ONE_HOT_SQUARES[board[move.start_row][move.start_col]]
+        one_hot[7 - move.end_row, move.end_col] = ONE_HOT_SQUARES[board[move.end_row][move.end_col]]
+        if move.is_en_passant_move:
+            one_hot[7 - move.start_row, move.end_col] = ONE_HOT_SQUARES[board[move.start_row][move.end_col]]
+        elif move.is_castle_move:
+            if move.end_col - move.start_col == 2:
+                rook_cols = (move.end_col - 1, move.end_col + 1)
+            else:
+                rook_cols = (move.end_col + 1, move.end_col - 2)
+            for c in rook_cols:
+                one_hot[7 - move.end_row, c] = ONE_HOT_SQUARES[board[move.end_row][c]]
+
+    # full zobrist hash of the current position
+    def compute_zobrist_key(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r][c]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING_MASKS[self.castling]
+        if self.en_passant_possible != ():
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_possible[1]]
+        return key
+
+    def compute_static_eval(self):
+        return sum(PIECE_SQUARE_VALUES[piece][r][c] for r, row in enumerate(self.board) for c, piece in enumerate(row))
 
     # takes move and executes it, doesnt work for castling, pawn promo and en passant
     def make_move(self, move):
+        # undo record: castling, en passant square and key from before the move
+        ply = len(self.moveLog)
+        if ply == len(self.undo_state):
+            self.undo_state.extend([0] * ply)
+            self.undo_keys.extend([0] * ply)
+            self.undo_evals.extend([0] * ply)
+        ep = self.en_passant_possible
+        self.undo_state[ply] = self.castling | ((ep[0] * 8 + ep[1] + 1) << 4 if ep != () else 0)
+        self.undo_keys[ply] = self.zobrist_key
+        self.undo_evals[ply] = self.static_eval
+        # update hash and static evaluation: moved piece, captured piece, side to move
+        key = self.zobrist_key
+        key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row][move.start_col] ^ ZOBRIST_BLACK_TO_MOVE
+        evaluation = self.static_eval - PIECE_SQUARE_VALUES[move.piece_moved][move.start_row][move.start_col]
+        if move.is_en_passant_move:
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.start_row][move.end_col]
+            evaluation -= PIECE_SQUARE_VALUES[move.piece_captured][move.start_row][move.end_col]
+        elif move.piece_captured != "--":
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.end_row][move.end_col]
+            evaluation -= PIECE_SQUARE_VALUES[move.piece_captured][move.end_row][move.end_col]
+        if move.is_pawn_promotion:
+            key ^= ZOBRIST_PIECES[move.piece_moved[0] + 'Q'][move.end_row][move.end_col]
+            evaluation += PIECE_SQUARE_VALUES[move.piece_moved[0] + 'Q'][move.end_row][move.end_col]
+        else:
+            key ^= ZOBRIST_PIECES[move.piece_moved][move.end_row][move.end_col]
+            evaluation += PIECE_SQUARE_VALUES[move.piece_moved][move.end_row][move.end_col]
+        if ep != ():
+            key ^= ZOBRIST_EN_PASSANT[ep[1]]
+        key ^= ZOBRIST_CASTLING_MASKS[self.castling]
+
         # start position cleared from piece
         self.board[move.start_row][move.start_col] = "--"
         # end position holds new piece
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.moveLog.append(move)  # log move to undo or watch later
         self.white_to_move = not self.white_to_move  # switch turns
-        # update king location
+        # update king location, the square tuples are shared so no new one is built
         if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
+            self.white_king_location = SQUARE_COORDS[move.end_row * 8 + move.end_col]
         elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+            self.black_king_location = SQUARE_COORDS[move.end_row * 8 + move.end_col]
 
         # if pawn promotion
         if move.is_pawn_promotion:
@@ -56,23 +334,33 @@ class GameState():
         if move.is_en_passant_move:
             self.board[move.start_row][move.end_col] = '--'  # capture pawn
         if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:  # check for 2 square pawn advance
-            self.en_passant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+            self.en_passant_possible = SQUARE_COORDS[(move.start_row + move.end_row) // 2 * 8 + move.start_col]
+            key ^= ZOBRIST_EN_PASSANT[move.start_col]
         else:
             self.en_passant_possible = ()
 
         # castle move
         if move.is_castle_move:
+            rook = move.piece_moved[0] + 'R'
             if move.end_col - move.start_col == 2: # king side castle
                 self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1] # place rook next to king
                 self.board[move.end_row][move.end_col+1] = '--' # remove old rook
+                key ^= ZOBRIST_PIECES[rook][move.end_row][move.end_col+1] ^ ZOBRIST_PIECES[rook][move.end_row][move.end_col-1]
+                evaluation += PIECE_SQUARE_VALUES[rook][move.end_row][move.end_col-1] - \
+                    PIECE_SQUARE_VALUES[rook][move.end_row][move.end_col+1]
             else: # queen side castle
                 self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]  # place rook next to king
                 self.board[move.end_row][move.end_col - 2] = '--'  # remove old rook
+                key ^= ZOBRIST_PIECES[rook][move.end_row][move.end_col-2] ^ ZOBRIST_PIECES[rook][move.end_row][move.end_col+1]
+                evaluation += PIECE_SQUARE_VALUES[rook][move.end_row][move.end_col+1] - \
+                    PIECE_SQUARE_VALUES[rook][move.end_row][move.end_col-2]
 
         # update castling rights -> rook or king move
         self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+        self.zobrist_key = key ^ ZOBRIST_CASTLING_MASKS[self.castling]
+        self.static_eval = evaluation
+        if self.one_hot is not None:
+            self.update_one_hot(move)
 
     def undo_move(self):
         # if there is a move to undo
@@ -82,20 +370,20 @@ class GameState():
             self.board[move.end_row][move.end_col] = move.piece_captured
             self.white_to_move = not self.white_to_move  # switch turns again
             if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
+                self.white_king_location = SQUARE_COORDS[move.start_row * 8 + move.start_col]
             elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+                self.black_king_location = SQUARE_COORDS[move.start_row * 8 + move.start_col]
             # undo en passant
             if move.is_en_passant_move:
                 self.board[move.end_row][move.end_col] = '--'
                 self.board[move.start_row][move.end_col] = move.piece_captured
-                self.en_passant_possible = (move.end_row, move.end_col)  # update en passant possible
-            # undo a 2 square pawn advance:
-            if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-                self.en_passant_possible = ()
-            # undo castling rights
-            self.castle_rights_log.pop()
-            self.current_castling_rights = self.castle_rights_log[-1]
+            # restore castling rights, en passant square, key and static evaluation from before the move
+            ply = len(self.moveLog)
+            state = self.undo_state[ply]
+            self.castling = state & 15
+            self.en_passant_possible = SQUARE_COORDS[(state >> 4) - 1] if state >> 4 else ()
+            self.zobrist_key = self.undo_keys[ply]
+            self.static_eval = self.undo_evals[ply]
             # undo castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2: # kingside
@@ -104,93 +392,249 @@ class GameState():
                 else:
                     self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
                     self.board[move.end_row][move.end_col + 1] = '--'
+            if self.one_hot is not None:
+                self.update_one_hot(move)
 
             self.check_mate = False
             self.stale_mate = False
 
     def update_castle_rights(self, move):
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wqs = False
-            self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bqs = False
-            self.current_castling_rights.bks = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.wqs = False
-                if move.start_col == 7:
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.bqs = False
-                if move.start_col == 7:
-                    self.current_castling_rights.bks = False
-
-        # fix bug that doesn't allow castling if rook is already captured
-        if move.piece_captured == 'wR':
-            if move.end_row == 7:
-                if move.end_col == 0:
-                    self.current_castling_rights.wqs = False
-                elif move.end_col == 7:
-                    self.current_castling_rights.wks = False
-        elif move.piece_captured == 'bR':
-            if move.end_row == 0:
-                if move.end_col == 0:
-                    self.current_castling_rights.bqs = False
-                elif move.end_col == 7:
-                    self.current_castling_rights.bks = False
-
-    # moves considering checks
+        if move.piece_moved[1] == 'K':
+            self.castling &= ~(CASTLE_WKS | CASTLE_WQS) if move.piece_moved[0] == 'w' else ~(CASTLE_BKS | CASTLE_BQS)
+        # rook moved away or captured on its start square
+        self.castling &= CASTLE_KEEP[move.start_row * 8 + move.start_col] & CASTLE_KEEP[move.end_row * 8 + move.end_col]
+
+    # moves considering checks: pins and checks are found from the king, so no move has to be made to test it
     def get_valid_moves(self):
-        temp_en_passant_possible = self.en_passant_possible  # tuple immutable
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                          self.current_castling_rights.wqs, self.current_castling_rights.bqs)
-        # generate all possible moves
-        moves = self.get_all_possible_moves()
+        moves = []
+        self.is_in_check, self.pins, self.checks = self.check_for_pins_and_checks()
         if self.white_to_move:
-            self.get_castle_moves(self.white_king_location[0], self.white_king_location[1], moves)
+            king_row, king_col = self.white_king_location
         else:
-            self.get_castle_moves(self.black_king_location[0], self.black_king_location[1], moves)
-        # for each move, make move
-        for i in range(len(moves) - 1, -1, -1):
-            self.make_move(moves[i])
-            # for each opponent move, check if it attacks your king -> invalid move
-            self.white_to_move = not self.white_to_move  # switch turns because make_moves switches turns
-            if self.in_check():
-                moves.remove(moves[i])  # if enemy attacks king after move made, it is not a valid move
-            self.white_to_move = not self.white_to_move
-            self.undo_move()
-        if (len(moves) == 0):  # checkmate or stalemate
-            if self.in_check():
+            king_row, king_col = self.black_king_location
+        if self.is_in_check:
+            if len(self.checks) == 1:  # block check, capture checking piece or move king
+                moves = self.get_all_possible_moves()
+                check_row, check_col, d_row, d_col = self.checks[0]
+                valid_squares = []  # squares a piece can move to
+                if self.board[check_row][check_col][1] == 'N':  # knight can't be blocked
+                    valid_squares = [(check_row, check_col)]
+                else:
+                    for i in range(1, 8):
+                        valid_square = (king_row + d_row * i, king_col + d_col * i)
+                        valid_squares.append(valid_square)
+                        if valid_square == (check_row, check_col):
+                            break
+                # king moves are already legal, en passant is tested on the board in get_pawn_moves
+                for i in range(len(moves) - 1, -1, -1):
+                    if moves[i].piece_moved[1] != 'K' and not moves[i].is_en_passant_move:
+                        if (moves[i].end_row, moves[i].end_col) not in valid_squares:
+                            moves.remove(moves[i])
+            else:  # double check, king has to move
+                self.get_king_moves(king_row, king_col, moves)
+        else:
+            moves = self.get_all_possible_moves()
+            self.get_castle_moves(king_row, king_col, moves)
+        if len(moves) == 0:  # checkmate or stalemate
+            if self.is_in_check:
                 self.check_mate = True
             else:
                 self.stale_mate = True
         else:
             self.check_mate = False
             self.stale_mate = False
-        self.en_passant_possible = temp_en_passant_possible
-        self.current_castling_rights = temp_castle_rights
         return moves
 
+    # legal moves in the stages the search tries them: the hash move, captures and promotions, killer moves, then
+    # the other quiet moves. capture_key and quiet_key sort their stage, ties keep the generation order.
+    # a stage is only generated when it is reached and every move is checked as it is consumed, so a node that cuts
+    # off early never builds the rest. check_mate and stale_mate are set when the moves run out without one.
+    # the position may change between moves as long as it is restored (make_move ... undo_move)
+    def get_staged_moves(self, hash_move=None, killers=(), capture_key=None, quiet_key=None):
+        context = self.staged_context()
+        skip = set()  # move_id of moves already yielded
+        if hash_move is not None:
+            move = self.staged_legal_move(context, hash_move)
+            if move is not None:
+                skip.add(move.move_id)
+                self.check_mate = self.stale_mate = False
+                yield move
+        for captures in (True, False):
+            moves = self.staged_candidates(context, captures)
+            if captures:
+                if capture_key is not None:
+                    moves.sort(key=capture_key)
+            else:
+                # killers are quiet moves that cut off in a sibling node, tried before the other quiet moves
+                for killer in killers:
+                    if killer is None or killer.move_id in skip:
+                        continue
+                    move = self.staged_legal_move(context, killer)
+                    if move is not None and move.piece_captured == '--' and not move.is_pawn_promotion:
+                        skip.add(move.move_id)
+                        self.check_mate = self.stale_mate = False
+                        yield move
+                if quiet_key is not None:
+                    moves.sort(key=quiet_key)
+            for move in moves:
+                if move.move_id not in skip and self.staged_is_legal(context, move):
+                    skip.add(move.move_id)
+                    self.check_mate = self.stale_mate = False
+                    yield move
+        if not skip:  # checkmate or stalemate
+            self.check_mate = context['in_check']
+            self.stale_mate = not context['in_check']
+
+    # what get_staged_moves needs to know about the position once: pins and checks, squares that stop a check
+    def staged_context(self):
+        in_check, pins, checks = self.check_for_pins_and_checks()
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        block_squares = None
+        if len(checks) == 1:
+            check_row, check_col, d_row, d_col = checks[0]
+            block_squares = {(check_row, check_col)}
+            if self.board[check_row][check_col][1] != 'N':  # knight can't be blocked
+                for i in range(1, 8):
+                    block_squares.add((king_row + d_row * i, king_col + d_col * i))
+                    if (king_row + d_row * i, king_col + d_col * i) == (check_row, check_col):
+                        break
+        return {'in_check': in_check, 'pins': pins, 'checks': checks, 'king': (king_row, king_col),
+                'block_squares': block_squares, 'moves': None}
+
+    # moves of the piece on r, c that respect pins, king moves are already legal
+    def __piece_moves(self, context, r, c):
+        moves = []
+        self.pins, self.checks = context['pins'], context['checks']  # a child position may have replaced them
+        if (r, c) == context['king']:
+            self.get_king_moves(r, c, moves)
+            if not context['in_check']:
+                self.get_castle_moves(r, c, moves)
+        elif len(context['checks']) < 2:
+            self.move_functions[self.board[r][c][1]](r, c, moves)
+        return moves
+
+    # captures and promotions or quiet moves, not yet checked against a check. the 2d-list generator
+    # builds both kinds in one pass, so the first stage keeps the quiet moves for the second
+    def staged_candidates(self, context, captures):
+        if context['moves'] is None:
+            color = 'w' if self.white_to_move else 'b'
+            moves = []
+            for r in range(8):
+                for c in range(8):
+                    if self.board[r][c][0] == color:
+                        moves += self.__piece_moves(context, r, c)
+            context['moves'] = moves
+        return [move for move in context['moves']
+                if (move.piece_captured != '--' or move.is_pawn_promotion) == captures]
+
+    # only a single check restricts moves the generator made: they have to take or block the checker
+    def staged_is_legal(self, context, move):
+        block_squares = context['block_squares']
+        return block_squares is None or move.piece_moved[1] == 'K' or move.is_en_passant_move or \
+            (move.end_row, move.end_col) in block_squares
+
+    # legal move of the position with the squares of move (a hash or killer move from another node), or None
+    def staged_legal_move(self, context, move):
+        r, c = move.start_row, move.start_col
+        if self.board[r][c] != move.piece_moved or move.piece_moved[0] != ('w' if self.white_to_move else 'b'):
+            return None
+        for candidate in self.__piece_moves(context, r, c):
+            if candidate.move_id == move.move_id and self.staged_is_legal(context, candidate):
+                return candidate
+        return None
+
     # current player is in check -> true
     def in_check(self):
-        if (self.white_to_move):
+        if self.white_to_move:
             return self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
         else:
             return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
 
-    # check if opponent can attack r, c
+    # check if opponent can attack r, c: look outward from the square for attacking pieces
     def square_under_attack(self, r, c):
-        self.white_to_move = not self.white_to_move  # switch turns
-        opp_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move
-        for move in opp_moves:
-            if move.end_row == r and move.end_col == c:
+        enemy_color = "b" if self.white_to_move else "w"
+        enemy_pawn_row = r - 1 if enemy_color == "b" else r + 1  # row an attacking pawn stands on
+        for j, d in enumerate(self.ray_directions):
+            for i in range(1, 8):
+                end_row = r + d[0] * i
+                end_col = c + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "--":
+                    continue
+                if end_piece[0] == enemy_color:
+                    piece_type = end_piece[1]
+                    if (j <= 3 and piece_type == 'R') or (j >= 4 and piece_type == 'B') or piece_type == 'Q' or \
+                            (i == 1 and piece_type == 'K') or \
+                            (i == 1 and piece_type == 'p' and j >= 4 and end_row == enemy_pawn_row):
+                        return True
+                break
+        for d in self.knight_directions:
+            end_row = r + d[0]
+            end_col = c + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and self.board[end_row][end_col] == enemy_color + 'N':
                 return True
         return False
 
+    # pins: own pieces that can only move along the line to the king, checks: enemy pieces attacking the king
+    def check_for_pins_and_checks(self):
+        pins = []  # (row, col, direction) of pinned piece
+        checks = []  # (row, col, direction) of checking piece
+        in_check = False
+        if self.white_to_move:
+            enemy_color, ally_color = "b", "w"
+            start_row, start_col = self.white_king_location
+        else:
+            enemy_color, ally_color = "w", "b"
+            start_row, start_col = self.black_king_location
+        enemy_pawn_row = start_row - 1 if enemy_color == "b" else start_row + 1
+        for j, d in enumerate(self.ray_directions):
+            possible_pin = ()
+            for i in range(1, 8):
+                end_row = start_row + d[0] * i
+                end_col = start_col + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "--":
+                    continue
+                if end_piece[0] == ally_color:
+                    if possible_pin == ():  # first own piece could be pinned
+                        possible_pin = (end_row, end_col, d[0], d[1])
+                    else:  # second own piece, no pin or check in this direction
+                        break
+                else:
+                    piece_type = end_piece[1]
+                    if (j <= 3 and piece_type == 'R') or (j >= 4 and piece_type == 'B') or piece_type == 'Q' or \
+                            (i == 1 and piece_type == 'K') or \
+                            (i == 1 and piece_type == 'p' and j >= 4 and end_row == enemy_pawn_row):
+                        if possible_pin == ():
+                            in_check = True
+                            checks.append((end_row, end_col, d[0], d[1]))
+                        else:
+                            pins.append(possible_pin)
+                    break
+        for d in self.knight_directions:
+            end_row = start_row + d[0]
+            end_col = start_col + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and self.board[end_row][end_col] == enemy_color + 'N':
+                in_check = True
+                checks.append((end_row, end_col, d[0], d[1]))
+        return in_check, pins, checks
+
+    # direction a piece is pinned in or None
+    def get_pin_direction(self, r, c):
+        for pin in self.pins:
+            if pin[0] == r and pin[1] == c:
+                return (pin[2], pin[3])
+        return None
+
+    # pinned pieces may only move along the pin line
+    @staticmethod
+    def along_pin(pin_direction, d_row, d_col):
+        return pin_direction is None or pin_direction == (d_row, d_col) or pin_direction == (-d_row, -d_col)
+
     # moves without considering check
     def get_all_possible_moves(self):
         moves = []  # empty list of possible moves
@@ -203,62 +647,50 @@ class GameState():
         return moves
 
     def get_pawn_moves(self, r, c, moves):
+        pin_direction = self.get_pin_direction(r, c)
         if self.white_to_move:
-            if self.board[r - 1][c] == "--":
-                moves.append(Move((r, c), (r - 1, c), self.board))
-                if r == 6 and self.board[r - 2][c] == "--":  # 2 square pawn advance
-                    moves.append(Move((r, c), (r - 2, c), self.board))
-            if c - 1 >= 0:
-                if self.board[r - 1][c - 1][0] == "b":  # enemy piece to capture
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.en_passant_possible:
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board, en_passant_move=True))
-            if c + 1 <= len(self.board) - 1:
-                if self.board[r - 1][c + 1][0] == "b":
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.en_passant_possible:
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board, en_passant_move=True))
+            move_amount, start_row, enemy_color = -1, 6, "b"
         else:
-            if self.board[r + 1][c] == "--":
-                moves.append(Move((r, c), (r + 1, c), self.board))
-                if r == 1 and self.board[r + 2][c] == "--":  # 2 square pawn advance
-                    moves.append(Move((r, c), (r + 2, c), self.board))
-            if c - 1 >= 0:
-                if self.board[r + 1][c - 1][0] == "w":  # enemy piece to capture
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.en_passant_possible:
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board, en_passant_move=True))
-            if c + 1 <= len(self.board) - 1:
-                if self.board[r + 1][c + 1][0] == "w":
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.en_passant_possible:
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board, en_passant_move=True))
+            move_amount, start_row, enemy_color = 1, 1, "w"
+        if self.board[r + move_amount][c] == "--" and self.along_pin(pin_direction, move_amount, 0):
+            moves.append(Move((r, c), (r + move_amount, c), self.board))
+            if r == start_row and self.board[r + 2 * move_amount][c] == "--":  # 2 square pawn advance
+                moves.append(Move((r, c), (r + 2 * move_amount, c), self.board))
+        for d_col in (-1, 1):
+            end_col = c + d_col
+            if 0 <= end_col < 8:
+                if self.board[r + move_amount][end_col][0] == enemy_color:  # enemy piece to capture
+                    if self.along_pin(pin_direction, move_amount, d_col):
+                        moves.append(Move((r, c), (r + move_amount, end_col), self.board))
+                elif (r + move_amount, end_col) == self.en_passant_possible:
+                    if self.en_passant_is_legal(r, c, r + move_amount, end_col):
+                        moves.append(Move((r, c), (r + move_amount, end_col), self.board, en_passant_move=True))
+
+    # en passant removes two pawns at once, so pins can't tell if it is legal: try it on the board
+    def en_passant_is_legal(self, r, c, end_row, end_col):
+        pawn = self.board[r][c]
+        captured = self.board[r][end_col]
+        self.board[r][c] = "--"
+        self.board[r][end_col] = "--"
+        self.board[end_row][end_col] = pawn
+        legal = not self.in_check()
+        self.board[end_row][end_col] = "--"
+        self.board[r][end_col] = captured
+        self.board[r][c] = pawn
+        return legal
 
     def get_rook_moves(self, r, c, moves):
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
-        enemy_color = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        # cant move through enemy piece
-                        break
-                    else:
-                        # friendly piece invalid and cant move through
-                        break
-                else:
-                    break
+        self.get_sliding_moves(r, c, moves, self.ray_directions[:4])
 
     def get_bishop_moves(self, r, c, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        self.get_sliding_moves(r, c, moves, self.ray_directions[4:])
+
+    def get_sliding_moves(self, r, c, moves, directions):
+        pin_direction = self.get_pin_direction(r, c)
         enemy_color = "b" if self.white_to_move else "w"
         for d in directions:
+            if not self.along_pin(pin_direction, d[0], d[1]):
+                continue
             for i in range(1, 8):
                 end_row = r + d[0] * i
                 end_col = c + d[1] * i
@@ -277,37 +709,40 @@ class GameState():
                     break
 
     def get_knight_moves(self, r, c, moves):
-        directions = ((2, 1), (-2, 1), (-2, -1), (2, -1), (1, 2), (-1, 2), (-1, -2), (1, -2))
-        enemy_color = "b" if self.white_to_move else "w"
-        for d in directions:
+        if self.get_pin_direction(r, c) is not None:
+            return  # pinned knight can't move
+        ally_color = "w" if self.white_to_move else "b"
+        for d in self.knight_directions:
             end_row = r + d[0]
             end_col = c + d[1]
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 end_piece = self.board[end_row][end_col]
-                if end_piece == "--":
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
-                elif end_piece[0] == enemy_color:
+                if end_piece[0] != ally_color:
                     moves.append(Move((r, c), (end_row, end_col), self.board))
 
     def get_king_moves(self, r, c, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1), (0, 1), (1, 0), (-1, 0), (0, -1))
-        enemy_color = "b" if self.white_to_move else "w"
-        for d in directions:
+        ally_color = "w" if self.white_to_move else "b"
+        king = self.board[r][c]
+        # lift the king, so squares behind it on a checking line count as attacked
+        self.board[r][c] = "--"
+        safe_squares = []
+        for d in self.ray_directions:
             end_row = r + d[0]
             end_col = c + d[1]
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 end_piece = self.board[end_row][end_col]
-                if end_piece == "--":
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
-                if end_piece[0] == enemy_color:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
+                if end_piece[0] != ally_color and not self.square_under_attack(end_row, end_col):
+                    safe_squares.append((end_row, end_col))
+        self.board[r][c] = king
+        for end_sq in safe_squares:
+            moves.append(Move((r, c), end_sq, self.board))
 
     def get_castle_moves(self, r, c, moves):
         if self.square_under_attack(r, c):
             return # can't castle while in check
-        if (self.white_to_move and self.current_castling_rights.wks) or (not self.white_to_move and self.current_castling_rights.bks):
+        if self.castling & (CASTLE_WKS if self.white_to_move else CASTLE_BKS):
             self.get_king_side_castle_moves(r, c, moves)
-        if(self.white_to_move and self.current_castling_rights.wqs) or (not self.white_to_move and self.current_castling_rights.bqs):
+        if self.castling & (CASTLE_WQS if self.white_to_move else CASTLE_BQS):
             self.get_queen_side_castle_moves(r, c, moves)
 
     def get_king_side_castle_moves(self, r, c, moves):
@@ -332,8 +767,21 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+    def to_mask(self):
+        return (CASTLE_WKS if self.wks else 0) | (CASTLE_BKS if self.bks else 0) | \
+               (CASTLE_WQS if self.wqs else 0) | (CASTLE_BQS if self.bqs else 0)
+
+    @staticmethod
+    def from_mask(mask):
+        return CastleRights(mask & CASTLE_WKS != 0, mask & CASTLE_BKS != 0, mask & CASTLE_WQS != 0,
+                            mask & CASTLE_BQS != 0)
+
 
 class Move():
+    # no instance __dict__: moves are created for every generated move
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'piece_captured', 'is_pawn_promotion',
+                 'is_en_passant_move', 'is_castle_move', 'move_id', 'code')
+
     # maps keys to values
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
                      "5": 3, "6": 2, "7": 1, "8": 0}
@@ -342,6 +790,15 @@ class Move():
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
+    # packed move code: bits 0-5 start square, 6-11 end square (square = row * 8 + col), 12-14 flags,
+    # 15-16 promotion piece
+    EN_PASSANT = 1 << 12
+    CASTLE = 1 << 13
+    PROMOTION = 1 << 14
+    PROMOTION_SHIFT = 15
+    promotion_pieces = ('N', 'B', 'R', 'Q')
+    PROMOTE_QUEEN = PROMOTION | 3 << PROMOTION_SHIFT  # the engine always promotes to a queen
+
     def __init__(self, start_sq, end_sq, board, en_passant_move=False, is_castle_move=False):
         self.start_row = start_sq[0]
         self.start_col = start_sq[1]
@@ -361,6 +818,37 @@ class Move():
         self.is_castle_move = is_castle_move
 
         self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col  # 0-7777
+        self.code = self.start_row * 8 + self.start_col | (self.end_row * 8 + self.end_col) << 6
+        if en_passant_move:
+            self.code |= self.EN_PASSANT
+        if is_castle_move:
+            self.code |= self.CASTLE
+        if self.is_pawn_promotion:
+            self.code |= self.PROMOTE_QUEEN
+
+    # packed code of a move, flags: EN_PASSANT, CASTLE, PROMOTE_QUEEN
+    @staticmethod
+    def encode(start_sq, end_sq, flags=0):
+        return start_sq | end_sq << 6 | flags
+
+    # move of a packed code in the position board, skips the work of __init__
+    @classmethod
+    def from_code(cls, code, board):
+        move = cls.__new__(cls)
+        start, end = code & 63, code >> 6 & 63
+        move.start_row, move.start_col = start >> 3, start & 7
+        move.end_row, move.end_col = end >> 3, end & 7
+        move.piece_moved = board[move.start_row][move.start_col]
+        move.is_en_passant_move = code & cls.EN_PASSANT != 0
+        if move.is_en_passant_move:
+            move.piece_captured = 'wp' if move.piece_moved == 'bp' else 'bp'
+        else:
+            move.piece_captured = board[move.end_row][move.end_col]
+        move.is_castle_move = code & cls.CASTLE != 0
+        move.is_pawn_promotion = code & cls.PROMOTION != 0
+        move.move_id = move.start_row * 1000 + move.start_col * 100 + move.end_row * 10 + move.end_col
+        move.code = code
+        return move
 
     def get_chess_notation(self):
         return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
@@ -373,3 +861,6 @@ class Move():
         if isinstance(other, Move):
             return self.move_id == other.move_id
         return False
+
+    def __hash__(self):
+        return self.move_id
@@ -5,49 +5,38 @@
 import pygame as p
 import ChessEngine
 import AiMoveFinder
+from BoardRenderer import BoardRenderer
+import ParallelSearch
+import SearchThread
 
 WIDTH = HEIGHT = 512  # alternatively: 400
 DIMENSION = 8  # chessboard is 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
-IMAGES = {}
-
-'''
-    Initialize global dic of images. Called only one time, to save resources
-'''
-
-
-def load_images():
-    pieces = ['wp', 'bp', 'wR', 'bR', 'wN', 'bN', 'wB', 'bB', 'wQ', 'bQ', 'wK', 'bK']
-    for piece in pieces:
-        # resize and load image
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
-
+BITBOARDS = True  # bitboard move generation, False uses the 2d-list generator
+AI_TIME_LIMIT = 2  # seconds the ai may search per move
+AI_PROCESSES = 1  # more than 1: split the ai search over that many worker processes
+PONDER = True  # search on the human's turn, assuming the human plays the move the ai expects
+OPENING_BOOK = None  # path of an OpeningBook file, book positions are played without searching
+ENDGAME_TABLES = None  # directory of EndgameTables, positions with few pieces are scored exactly
+AI_PRECISION = 'float32'  # network weights in 'float32', 'float16' or 'int8'
 
 '''
     Main driver handles user input and updating graphics
 '''
 
 
-def draw_text(screen, text):
-    font = p.font.SysFont('Comic Sans',32, True, False)
-    text_object = font.render(text, 0, p.Color('Black'))
-    text_location = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 -text_object.get_width()/2, HEIGHT/2 - text_object.get_height()/2)
-    screen.blit(text_object, text_location)
-    text_object = font.render(text, 0, p.Color("Gray"))
-    screen.blit(text_object, text_location.move(2, 2))
-
-
 def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
+    # images, board and fonts are prepared once, frames only redraw squares that changed
+    renderer = BoardRenderer(screen, SQ_SIZE)
+    gs = ChessEngine.GameState(track_one_hot=True, bitboards=BITBOARDS)
     valid_moves = gs.get_valid_moves()
     move_made = False # flag variable for when move is made -> for generating new valid moves
     animate = False # flag variable for enabling animation
-    load_images()
     running = True
     sq_selected = () # no square selected initially, keeps track of last click of user (tuple: (row, col))
     player_clicks = [] # keep track of player clicks (two tuples: [(6, 4), (4, 4)])
@@ -55,7 +44,15 @@ def main():
     # player vs player, player vs ai
     player_one = True # true if player is white, false if ai is white
     player_two = False
-    ai = AiMoveFinder.AiMoveFinder()
+    if AI_PROCESSES > 1:
+        ai = ParallelSearch.ParallelMoveFinder(AI_PROCESSES, bitboards=BITBOARDS, book=OPENING_BOOK,
+                                               endgame_tables=ENDGAME_TABLES, precision=AI_PRECISION)
+    else:
+        ai = AiMoveFinder.AiMoveFinder(book=OPENING_BOOK, endgame_tables=ENDGAME_TABLES, precision=AI_PRECISION)
+    # ai searches on a background thread, so the window keeps drawing and handling events
+    search = SearchThread.SearchThread(ai, bitboards=BITBOARDS)
+    ai_job = None # search for the ai's next move
+    ponder_job = None # search of the position after the human move the ai expects
     while running:
         # determine if ai needs to play a move
         human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
@@ -63,6 +60,9 @@ def main():
             # close on clicking X
             if e.type == p.QUIT:
                 running = False
+            # window was covered or restored: its contents are lost
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):
+                renderer.invalidate()
             # mouse click event
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not game_over and human_turn:
@@ -91,12 +91,18 @@ def main():
             # key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: # undo when z pressed
+                    search.cancel(ai_job)
+                    search.cancel(ponder_job)
+                    ai_job = ponder_job = None
                     gs.undo_move()
                     move_made = True
                     animate = False # animation cancelled when move is undone
                     game_over = False
                 if e.key == p.K_r: # reset board with r
-                    gs = ChessEngine.GameState()
+                    search.cancel(ai_job)
+                    search.cancel(ponder_job)
+                    ai_job = ponder_job = None
+                    gs = ChessEngine.GameState(track_one_hot=True, bitboards=BITBOARDS)
                     valid_moves = gs.get_valid_moves()
                     sq_selected = ()
                     player_clicks = []
@@ -104,106 +110,56 @@ def main():
                     animate = False
                     game_over = False
 
-        # ai move finder
-        if not game_over and not human_turn:
-            move = ai.find_best_move_minmax(gs, valid_moves)
-            gs.make_move(move)
-            move_made = True
-            animate = True
+        # ai move finder: start a search or poll the running one
+        if not game_over and not human_turn and not move_made:
+            if ai_job is None:
+                if ponder_job is not None and ponder_job.ponder_move == (gs.moveLog[-1] if gs.moveLog else None) \
+                        and not ponder_job.cancelled:
+                    ai_job = ponder_job # human played the expected move, ponder search becomes the real one
+                    search.ponder_hit(ai_job, AI_TIME_LIMIT)
+                else:
+                    search.cancel(ponder_job)
+                    ai_job = search.start(gs, time_limit=AI_TIME_LIMIT)
+                ponder_job = None
+            elif ai_job.done.is_set():
+                finished_job = ai_job
+                ai_job = None
+                move = None
+                if finished_job.matches(gs):
+                    move = next((valid for valid in valid_moves if valid == finished_job.move), None)
+                if move is not None:
+                    expected_reply = finished_job.principal_variation[1:2]
+                    gs.make_move(move)
+                    move_made = True
+                    animate = True
+                    human_next = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
+                    if PONDER and human_next and len(expected_reply) == 1:
+                        ponder_job = search.start(gs, max_depth=AiMoveFinder.AiMoveFinder.MAX_DEPTH,
+                                                  moves=expected_reply, ponder_move=expected_reply[0])
 
         if move_made:
             if animate:
-                animate_move(gs.moveLog[-1], screen, gs.board, clock)
+                renderer.animate_move(gs.moveLog[-1], gs.board, clock)
             valid_moves = gs.get_valid_moves()
             move_made = False
             animate = False
 
-        draw_game_state(screen, gs, valid_moves,sq_selected)
-
+        text = None
         if gs.check_mate:
             game_over = True
             if gs.white_to_move:
-                draw_text(screen, 'Black wins by checkmate')
+                text = 'Black wins by checkmate'
             else:
-                draw_text(screen, 'White wins by checkmate')
+                text = 'White wins by checkmate'
         elif gs.stale_mate:
             game_over = True
-            draw_text(screen, 'Stalemate')
+            text = 'Stalemate'
+        renderer.draw(gs, valid_moves, sq_selected, text)
+        if game_over and ponder_job is not None:
+            search.cancel(ponder_job)
+            ponder_job = None
 
         clock.tick(MAX_FPS)
-        p.display.flip()
-
-'''
-    Move highlighting
-'''
-def highlight_squares(screen, gs, valid_moves, sq_selected):
-    if sq_selected != ():
-        r, c = sq_selected
-        if gs.board[r][c][0] == ('w' if gs.white_to_move else 'b'): # sq_selected is piece that can be moved
-            # highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100) # [0, 255]
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-            # highlight moves from that square
-            s.fill(p.Color('yellow'))
-            for move in valid_moves:
-                if move.start_row == r and move.start_col == c:
-                    screen.blit(s, (SQ_SIZE*move.end_col, SQ_SIZE*move.end_row))
-
-
-'''
-    responsible for graphics within current game state
-'''
-def draw_game_state(screen, gs, valid_moves, sq_selected):
-    draw_board(screen) # draws squares on board
-    highlight_squares(screen, gs, valid_moves, sq_selected)
-    draw_pieces(screen, gs.board) # draw pieces on top of board
-
-
-def draw_board(screen):
-    global colors
-    colors = [p.Color("papayawhip"), p.Color("saddlebrown")]
-
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            color = colors[((row+col)%2)]
-            # Rect(top, left, dim1, dim2)
-            p.draw.rect(screen, color, p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-def draw_pieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = board[row][col]
-            if(piece != "--"):
-                screen.blit(IMAGES[piece], p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-'''
-    Animation for moves
-'''
-def animate_move(move, screen, board, clock):
-    global colors
-    dR = move.end_row - move.start_row
-    dC = move.end_col - move.start_col
-    frames_per_square = 10
-    frame_count = (abs(dR) + abs(dC)) * frames_per_square
-    for frame in range(frame_count + 1):
-        r, c = (move.start_row + dR * frame/frame_count, move.start_col + dC * frame/frame_count)
-        draw_board(screen)
-        draw_pieces(screen, board)
-        # erase the piece moved from ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col*SQ_SIZE, move.end_row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # draw captured piece onto rectangle
-        if move.piece_captured != '--':
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        # draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
 
 # convention for using main
 if __name__ == "__main__":
@@ -0,0 +1,584 @@
+"""
+ Endgame tables: exact win/draw/loss and distance to mate of every position with up to 4 pieces (kings included),
+ generated by retrograde analysis and probed by the search from memory-mapped .npy files.
+
+ There is one table per material signature ('KQvK', 'KRvKP', ...) with the stronger side as white, positions of the
+ other colour are probed mirrored. An entry is an int16 for the side to move: 0 a draw, MATE - plies a win,
+ plies - MATE a loss, ILLEGAL an impossible position. Positions are stored once per symmetry: the white king is
+ mirrored (and without pawns rotated) into a fixed part of the board.
+ Like the rest of the engine the tables promote to queens only, and they assume no castling rights and ignore
+ en passant captures and the fifty-move rule.
+
+ Generation repeats passes over all positions until no value changes: a position is worth the best of its children,
+ children after a capture or a promotion are read from the smaller tables, which are generated first. A pass is
+ split into chunks over a process pool and every finished pass is recorded, a stopped run continues from there.
+
+ python EndgameTables.py --generate KQvK KRvK KPvK          these tables and the tables they depend on
+ python EndgameTables.py --generate-all 4 --processes 8      every signature with up to 4 pieces
+ python EndgameTables.py --fen "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+import ChessEngine
+from BitboardEngine import BETWEEN, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, bishop_attacks, rook_attacks
+
+MAX_PIECES = 4
+TABLE_DIRECTORY = 'tables'
+PIECE_ORDER = 'KQRBNP'  # order of a side's pieces in a signature, king first
+MATE = 32000
+ILLEGAL = -32768
+NO_MOVE = -32767  # below every value: best child of a position without legal moves
+WIN_STEP = 1e-6  # score given up per ply to mate, so the search prefers faster wins
+CHUNK = 1 << 16  # positions per generation task
+
+BITS = np.array([1 << sq for sq in range(64)], dtype=np.uint64)
+BETWEEN_BITS = np.array(BETWEEN, dtype=np.uint64)
+
+# the 8 symmetries of the board as square -> square tables, pawns only allow the first two
+TRANSFORMS = np.array([[(f(sq // 8, sq % 8)[0] * 8 + f(sq // 8, sq % 8)[1]) for sq in range(64)] for f in (
+    lambda r, c: (r, c), lambda r, c: (r, 7 - c), lambda r, c: (7 - r, c), lambda r, c: (7 - r, 7 - c),
+    lambda r, c: (c, r), lambda r, c: (c, 7 - r), lambda r, c: (7 - c, r), lambda r, c: (7 - c, 7 - r))])
+
+
+# per square the symmetry that moves it to its smallest image, the squares the white king is stored on, and the
+# slot of each of those squares
+def _king_symmetry(transforms):
+    images = TRANSFORMS[:transforms]
+    slots = np.unique(images.min(axis=0))
+    slot_of = np.full(64, -1, dtype=np.int64)
+    slot_of[slots] = np.arange(len(slots))
+    return images.argmin(axis=0), slots, slot_of
+
+
+KING_SYMMETRY = {False: _king_symmetry(8), True: _king_symmetry(2)}  # by whether the table has pawns
+
+
+def _bit_matrix(bitboards):
+    return np.array([[bool(bits >> sq & 1) for sq in range(64)] for bits in bitboards])
+
+
+# squares each piece attacks on an empty board, by square and target square
+ATTACKS = {
+    'N': _bit_matrix(KNIGHT_ATTACKS),
+    'B': _bit_matrix([bishop_attacks(sq, 0) for sq in range(64)]),
+    'R': _bit_matrix([rook_attacks(sq, 0) for sq in range(64)]),
+    'Q': _bit_matrix([bishop_attacks(sq, 0) | rook_attacks(sq, 0) for sq in range(64)]),
+    'K': _bit_matrix(KING_ATTACKS),
+    'wP': _bit_matrix(PAWN_ATTACKS['w']),
+    'bP': _bit_matrix(PAWN_ATTACKS['b']),
+}
+SLIDERS = 'QRB'
+
+
+# target squares by square padded with -1, shape (64, most targets of a square)
+def _destinations(attacks):
+    targets = [np.flatnonzero(row) for row in attacks]
+    table = np.full((64, max(len(row) for row in targets)), -1, dtype=np.int64)
+    for sq, row in enumerate(targets):
+        table[sq, :len(row)] = row
+    return table
+
+
+DESTINATIONS = {piece: _destinations(attacks) for piece, attacks in ATTACKS.items()}
+
+
+# 'KQRBNP' order of one side's pieces, e.g. 'KPQ' -> 'KQP'
+def _sort_side(pieces):
+    return ''.join(sorted(pieces, key=PIECE_ORDER.index))
+
+
+def _strength(side):
+    return len(side), tuple(-PIECE_ORDER.index(piece) for piece in side)
+
+
+# table name of the pieces of white and black (letters with the king) and whether the colours are swapped in it
+def canonical_name(white, black):
+    white, black = _sort_side(white), _sort_side(black)
+    if _strength(black) > _strength(white):
+        return black + 'v' + white, True
+    return white + 'v' + black, False
+
+
+# material signature of one table: piece order, index layout and the tables its captures and promotions lead to
+class Signature():
+    def __init__(self, name):
+        white, black = name.split('v')
+        self.name = name
+        self.pieces = [('w', piece) for piece in white] + [('b', piece) for piece in black]
+        self.king = {'w': 0, 'b': len(white)}
+        self.symmetry, self.slots, self.slot_of = KING_SYMMETRY['P' in name]
+        self.half = len(self.slots) * 64 ** (len(self.pieces) - 1)  # positions per side to move
+        self.size = 2 * self.half
+        self.__children = {}
+
+    # table index of positions given by the squares of the pieces in table order, stm 0 for white to move.
+    # works on numbers and on arrays of positions
+    def index(self, stm, squares):
+        symmetry = self.symmetry[squares[0]]
+        index = self.slot_of[TRANSFORMS[symmetry, squares[0]]]
+        for sq in squares[1:]:
+            index = index * 64 + TRANSFORMS[symmetry, sq]
+        return index + stm * self.half
+
+    # piece squares of the positions start..end, which have the same side to move
+    def decode(self, start, end):
+        index = np.arange(start, end, dtype=np.int64) % self.half
+        squares = []
+        for i in range(len(self.pieces) - 1):
+            squares.append(index % 64)
+            index //= 64
+        squares.append(self.slots[index])
+        return squares[::-1]
+
+    # table after piece mover moves, capturing piece captured (or None) and promoting or not: (name, colours
+    # swapped, for each piece of that table the piece of this one)
+    def child(self, mover, captured=None, promotion=False):
+        key = (mover, captured, promotion)
+        if key not in self.__children:
+            pieces = [(color, 'Q' if i == mover and promotion else piece, i)
+                      for i, (color, piece) in enumerate(self.pieces) if i != captured]
+            name, flip = canonical_name(''.join(piece for color, piece, i in pieces if color == 'w'),
+                                        ''.join(piece for color, piece, i in pieces if color == 'b'))
+            if flip:
+                pieces = [('b' if color == 'w' else 'w', piece, i) for color, piece, i in pieces]
+            pieces.sort(key=lambda item: (item[0] != 'w', PIECE_ORDER.index(item[1])))
+            self.__children[key] = (name, flip, [i for color, piece, i in pieces])
+        return self.__children[key]
+
+    # names of the other tables the positions of this one can move into
+    def dependencies(self):
+        names = set()
+        for mover, (color, piece) in enumerate(self.pieces):
+            captures = [None] + [i for i, (other, kind) in enumerate(self.pieces) if other != color and kind != 'K']
+            for captured in captures:
+                for promotion in ((False, True) if piece == 'P' else (False,)):
+                    if captured is not None or promotion:
+                        names.add(self.child(mover, captured, promotion)[0])
+        return sorted(names, key=lambda name: (len(name), name))
+
+
+_signatures = {}
+
+
+def signature(name):
+    if name not in _signatures:
+        _signatures[name] = Signature(name)
+    return _signatures[name]
+
+
+# names of all tables with up to pieces pieces
+def all_names(pieces=MAX_PIECES):
+    names = set()
+    for count in range(2, pieces + 1):
+        for extra in itertools.combinations_with_replacement(PIECE_ORDER[1:], count - 2):
+            for white_count in range(len(extra) + 1):
+                for white in itertools.combinations(extra, white_count):
+                    black = list(extra)
+                    for piece in white:
+                        black.remove(piece)
+                    names.add(canonical_name('K' + ''.join(white), 'K' + ''.join(black))[0])
+    return sorted(names, key=lambda name: (len(name), name))
+
+
+# whether the square target of each position is attacked by one of attackers, a list of (color, piece, squares)
+def _attacked(target, attackers, occupied):
+    attacked = np.zeros(len(target), dtype=bool)
+    for color, piece, squares in attackers:
+        hits = ATTACKS[color + piece if piece == 'P' else piece][squares, target]
+        if piece in SLIDERS:
+            hits &= (BETWEEN_BITS[squares, target] & occupied) == 0
+        attacked |= hits
+    return attacked
+
+
+def _occupied(squares):
+    return np.bitwise_or.reduce([BITS[sq] for sq in squares]) if squares else 0
+
+
+# positions that can't occur: pieces on one square, pawns on the first or last rank, or the side that just moved
+# left its king in check
+def _illegal(sig, stm, squares):
+    illegal = np.zeros(len(squares[0]), dtype=bool)
+    for a, b in itertools.combinations(range(len(squares)), 2):
+        illegal |= squares[a] == squares[b]
+    for (color, piece), sq in zip(sig.pieces, squares):
+        if piece == 'P':
+            illegal |= (sq < 8) | (sq >= 56)
+    us = 'wb'[stm]
+    attackers = [(color, piece, sq) for (color, piece), sq in zip(sig.pieces, squares) if color == us]
+    return illegal | _attacked(squares[sig.king['b' if us == 'w' else 'w']], attackers, _occupied(squares))
+
+
+# candidate moves of one piece in every position: yields (valid, target square) arrays, one pair per direction.
+# checks are left to the child positions, which are ILLEGAL when the mover's king is attacked
+def _candidate_moves(color, piece, sq, own, occupied):
+    if piece == 'P':
+        step = -8 if color == 'w' else 8
+        empty = (occupied & BITS[sq + step]) == 0
+        yield empty, sq + step
+        double = empty & ((sq >> 3) == (6 if color == 'w' else 1))
+        target = np.where(double, sq + 2 * step, sq + step)
+        yield double & ((occupied & BITS[target]) == 0), target
+        enemy = occupied & ~own
+        for column in DESTINATIONS[color + piece][sq].T:
+            target = np.maximum(column, 0)
+            yield (column >= 0) & ((enemy & BITS[target]) != 0), target
+        return
+    for column in DESTINATIONS[piece][sq].T:
+        target = np.maximum(column, 0)
+        valid = (column >= 0) & ((own & BITS[target]) == 0)
+        if piece in SLIDERS:
+            valid &= (BETWEEN_BITS[sq, target] & occupied) == 0
+        yield valid, target
+
+
+# new value of every position from its children: the best of sign(child) - child, mate or stalemate without
+# legal moves. table(name) gives the values of a table
+def _solve(sig, stm, squares, table):
+    us = 'wb'[stm]
+    ours = [i for i, (color, piece) in enumerate(sig.pieces) if color == us]
+    theirs = [i for i, (color, piece) in enumerate(sig.pieces) if color != us]
+    occupied = _occupied(squares)
+    own = _occupied([squares[i] for i in ours])
+    best = np.full(len(squares[0]), NO_MOVE, dtype=np.int32)
+    for mover in ours:
+        piece = sig.pieces[mover][1]
+        for valid, target in _candidate_moves(us, piece, squares[mover], own, occupied):
+            rows = np.flatnonzero(valid)
+            if len(rows) == 0:
+                continue
+            target = target[rows]
+            captured = np.full(len(rows), -1)
+            for i in theirs:
+                if sig.pieces[i][1] != 'K':
+                    captured[squares[i][rows] == target] = i
+            promoted = (target >> 3) == (0 if us == 'w' else 7) if piece == 'P' else np.zeros(len(rows), dtype=bool)
+            for capture in np.unique(captured):
+                for promotion in np.unique(promoted):
+                    group = (captured == capture) & (promoted == promotion)
+                    name, flip, order = sig.child(mover, None if capture < 0 else int(capture), bool(promotion))
+                    child_squares = [target[group] if i == mover else squares[i][rows[group]] for i in order]
+                    if flip:
+                        child_squares = [sq ^ 56 for sq in child_squares]
+                    values = table(name)[signature(name).index(stm if flip else 1 - stm, child_squares)]
+                    values = values.astype(np.int32)
+                    legal = values != ILLEGAL
+                    parents = rows[group][legal]
+                    values = values[legal]
+                    best[parents] = np.maximum(best[parents], -values + np.sign(values))
+    stuck = np.flatnonzero(best == NO_MOVE)
+    if len(stuck) > 0:
+        attackers = [(sig.pieces[i][0], sig.pieces[i][1], squares[i][stuck]) for i in theirs]
+        check = _attacked(squares[sig.king[us]][stuck], attackers, occupied[stuck])
+        best[stuck] = np.where(check, -MATE, 0)
+    return best.astype(np.int16)
+
+
+def _table_path(directory, name):
+    return os.path.join(directory, name + '.npy')
+
+
+def _part_path(directory, name):
+    return os.path.join(directory, name + '.part.npy')
+
+
+def _state_path(directory, name):
+    return os.path.join(directory, name + '.json')
+
+
+_finished_tables = {}  # finished tables a worker has mapped, by path
+
+
+def _finished_table(directory, name):
+    path = _table_path(directory, name)
+    if path not in _finished_tables:
+        _finished_tables[path] = np.load(path, mmap_mode='r')
+    return _finished_tables[path]
+
+
+# one task of a pass: marks the illegal positions of start..end (initial) or updates their values in place,
+# returns how many values changed
+def _solve_chunk(task):
+    name, directory, start, end, initial = task
+    sig = signature(name)
+    table = np.load(_part_path(directory, name), mmap_mode='r+')
+    stm = start // sig.half
+    squares = sig.decode(start, end)
+    if initial:
+        table[start:end] = np.where(_illegal(sig, stm, squares), ILLEGAL, 0)
+        table.flush()
+        return 0
+    values = np.array(table[start:end])
+    legal = np.flatnonzero(values != ILLEGAL)
+    new = _solve(sig, stm, [sq[legal] for sq in squares],
+                 lambda child: table if child == name else _finished_table(directory, child))
+    changed = np.flatnonzero(new != values[legal])
+    if len(changed) > 0:
+        table[start + legal[changed]] = new[changed]
+        table.flush()
+    return len(changed)
+
+
+def _run_pass(name, directory, pool, initial):
+    sig = signature(name)
+    tasks = []
+    for stm in range(2):
+        for start in range(stm * sig.half, (stm + 1) * sig.half, CHUNK):
+            tasks.append((name, directory, start, min(start + CHUNK, (stm + 1) * sig.half), initial))
+    results = pool.imap_unordered(_solve_chunk, tasks) if pool is not None else map(_solve_chunk, tasks)
+    return sum(results)
+
+
+def _write_state(path, state):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(temporary, path)
+
+
+# counts of the finished table for the state file
+def _table_stats(table):
+    legal = table[table != ILLEGAL]
+    wins = legal[legal > 0]
+    losses = legal[legal < 0]
+    return {'positions': int(len(legal)), 'wins': int(len(wins)), 'draws': int(np.count_nonzero(legal == 0)),
+            'losses': int(len(losses)), 'longest_win': int(MATE - wins.min()) if len(wins) else 0,
+            'longest_loss': int(losses.max() + MATE) if len(losses) else 0}
+
+
+def _generate_table(name, directory, pool, verbose):
+    part_path, state_path = _part_path(directory, name), _state_path(directory, name)
+    state = None
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if verbose:
+            print('%s: resuming after pass %d' % (name, state['passes']))
+    if state is None:
+        start = time.perf_counter()
+        np.lib.format.open_memmap(part_path, mode='w+', dtype=np.int16, shape=(signature(name).size,)).flush()
+        _run_pass(name, directory, pool, True)
+        state = {'name': name, 'passes': 0, 'changed': [], 'seconds': time.perf_counter() - start}
+        _write_state(state_path, state)
+    # in place: a pass already sees the values it changed, and a stopped pass only has to be repeated
+    while not state['changed'] or state['changed'][-1] > 0:
+        start = time.perf_counter()
+        changed = _run_pass(name, directory, pool, False)
+        state['passes'] += 1
+        state['changed'].append(changed)
+        state['seconds'] += time.perf_counter() - start
+        _write_state(state_path, state)
+        if verbose:
+            print('%s: pass %d, %d values changed, %.1fs' % (name, state['passes'], changed,
+                                                            time.perf_counter() - start))
+    os.replace(part_path, _table_path(directory, name))
+    state.update(_table_stats(np.load(_table_path(directory, name), mmap_mode='r')))
+    state['complete'] = True
+    _write_state(state_path, state)
+    if verbose:
+        print('%s: %d positions, longest win %d plies, %.1fs' % (name, state['positions'], state['longest_win'],
+                                                                state['seconds']))
+
+
+# generates the tables and every table they depend on, finished tables are kept
+def generate(names, directory=TABLE_DIRECTORY, processes=None, verbose=True):
+    order = []
+
+    def visit(name):
+        if name not in order:
+            for child in signature(name).dependencies():
+                visit(child)
+            order.append(name)
+
+    for name in names:
+        white, black = name.upper().split('V')
+        name = canonical_name(white, black)[0]
+        if len(name) - 1 > MAX_PIECES:
+            raise ValueError('more than %d pieces: %s' % (MAX_PIECES, name))
+        visit(name)
+    os.makedirs(directory, exist_ok=True)
+    processes = processes or os.cpu_count() or 1
+    pool = multiprocessing.get_context('spawn').Pool(processes) if processes > 1 else None
+    try:
+        for name in order:
+            if not os.path.exists(_table_path(directory, name)):
+                _generate_table(name, directory, pool, verbose)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return order
+
+
+class EndgameTables():
+    def __init__(self, directory=TABLE_DIRECTORY):
+        self.directory = directory
+        self.tables = {}
+        for file_name in sorted(os.listdir(directory)):
+            name = file_name[:-len('.npy')]
+            if file_name.endswith('.npy') and 'v' in name and '.' not in name:
+                self.tables[name] = np.load(os.path.join(directory, file_name), mmap_mode='r')
+        self.max_pieces = max((len(name) - 1 for name in self.tables), default=0)
+        self.hits = 0
+
+    # (color, piece, square) of every piece, None when there are more than max_pieces
+    def __pieces(self, gs):
+        pieces = []
+        if hasattr(gs, 'bitboards'):
+            if bin(gs.occupied['w'] | gs.occupied['b']).count('1') > self.max_pieces:
+                return None
+            for piece, bits in gs.bitboards.items():
+                while bits:
+                    low = bits & -bits
+                    pieces.append((piece[0], piece[1].upper(), low.bit_length() - 1))
+                    bits ^= low
+            return pieces
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece != '--':
+                    if len(pieces) == self.max_pieces:
+                        return None
+                    pieces.append((piece[0], piece[1].upper(), r * 8 + c))
+        return pieces
+
+    # (wdl, plies to mate) for the side to move, wdl 1 win, 0 draw, -1 loss. None when no table has the position
+    # or it has castling rights or an en passant capture
+    def probe(self, gs):
+        if gs.castling or self.max_pieces == 0:
+            return None
+        if gs.en_passant_possible != ():
+            r, c = gs.en_passant_possible
+            row, pawn = (r + 1, 'wp') if gs.white_to_move else (r - 1, 'bp')
+            if any(0 <= col < 8 and gs.board[row][col] == pawn for col in (c - 1, c + 1)):
+                return None
+        pieces = self.__pieces(gs)
+        if pieces is None:
+            return None
+        name, flip = canonical_name(''.join(piece for color, piece, sq in pieces if color == 'w'),
+                                    ''.join(piece for color, piece, sq in pieces if color == 'b'))
+        table = self.tables.get(name)
+        if table is None:
+            return None
+        if flip:
+            pieces = [('b' if color == 'w' else 'w', piece, sq ^ 56) for color, piece, sq in pieces]
+        pieces.sort(key=lambda item: (item[0] != 'w', PIECE_ORDER.index(item[1])))
+        stm = int(gs.white_to_move == flip)
+        value = int(table[signature(name).index(stm, [sq for color, piece, sq in pieces])])
+        if value == ILLEGAL:
+            return None
+        self.hits += 1
+        if value > 0:
+            return 1, MATE - value
+        if value < 0:
+            return -1, value + MATE
+        return 0, 0
+
+    # score in [0, 1] from white's point of view like the network's, or None. wins lose WIN_STEP per ply to mate
+    def probe_score(self, gs):
+        result = self.probe(gs)
+        if result is None:
+            return None
+        wdl, plies = result
+        if not gs.white_to_move:
+            wdl = -wdl
+        return 0.5 + wdl * (0.5 - plies * WIN_STEP)
+
+
+# FEN of a table position, stm 0 for white to move
+def position_fen(name, stm, squares):
+    board = [['1'] * 8 for r in range(8)]
+    for (color, piece), sq in zip(signature(name).pieces, squares):
+        board[sq // 8][sq % 8] = piece if color == 'w' else piece.lower()
+    rows = [''.join(row) for row in board]
+    for run in range(8, 1, -1):
+        rows = [row.replace('1' * run, str(run)) for row in rows]
+    return '/'.join(rows) + (' w' if stm == 0 else ' b') + ' - - 0 1'
+
+
+# checks random positions of a table against the move generator of GameState: every value has to be the best of
+# its children, and positions without moves mate or stalemate. returns the number of mismatches
+def verify(name, directory=TABLE_DIRECTORY, samples=1000, seed=0, verbose=True):
+    tables = EndgameTables(directory)
+    table = tables.tables[name]
+    rng = random.Random(seed)
+    mismatches = 0
+    checked = 0
+    while checked < samples:
+        index = rng.randrange(len(table))
+        if table[index] == ILLEGAL:
+            continue
+        stm = index // signature(name).half
+        fen = position_fen(name, stm, [int(sq[0]) for sq in signature(name).decode(index, index + 1)])
+        gs = ChessEngine.GameState(bitboards=True)
+        gs.load_fen(fen)
+        expected = tables.probe(gs)
+        best = None
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            child = tables.probe(gs)
+            gs.undo_move()
+            if child is None:
+                best = 'unknown'
+                break
+            wdl, plies = child
+            value = (-wdl, plies + 1) if wdl != 0 else (0, 0)
+            if best is None or _better(value, best):
+                best = value
+        if best == 'unknown':
+            continue  # an en passant capture the table doesn't know
+        if best is None:
+            best = (-1, 0) if gs.in_check() else (0, 0)
+        checked += 1
+        if best != expected:
+            mismatches += 1
+            if verbose:
+                print('%s: table %s, children %s' % (fen, expected, best))
+    return mismatches
+
+
+def _better(a, b):
+    # win beats draw beats loss, faster wins and slower losses first
+    return (a[0], -a[1] if a[0] > 0 else a[1]) > (b[0], -b[1] if b[0] > 0 else b[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='endgame tables')
+    parser.add_argument('--directory', default=TABLE_DIRECTORY, help='where the tables are written and read')
+    parser.add_argument('--generate', nargs='+', metavar='TABLE', help='generate tables, e.g. KQvK KRvKP')
+    parser.add_argument('--generate-all', type=int, metavar='PIECES', help='generate every table up to PIECES')
+    parser.add_argument('--processes', type=int, help='worker processes, default: number of cpus')
+    parser.add_argument('--verify', nargs='+', metavar='TABLE', help='check random positions of tables')
+    parser.add_argument('--samples', type=int, default=1000, help='positions checked by --verify')
+    parser.add_argument('--fen', help='probe a position and its moves')
+    args = parser.parse_args()
+    if args.generate or args.generate_all:
+        names = args.generate or all_names(min(args.generate_all, MAX_PIECES))
+        generate(names, args.directory, args.processes)
+    if args.verify:
+        for name in args.verify:
+            print('%s: %d mismatches' % (name, verify(name, args.directory, args.samples)))
+    if args.fen:
+        tables = EndgameTables(args.directory)
+        gs = ChessEngine.GameState(bitboards=True)
+        gs.load_fen(args.fen)
+        print('position:', tables.probe(gs))
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            print(move.get_chess_notation(), tables.probe(gs))
+            gs.undo_move()
+    if not (args.generate or args.generate_all or args.verify or args.fen):
+        parser.print_help()
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
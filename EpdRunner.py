@@ -0,0 +1,239 @@
+"""
+ EPD test-suite runner: streams the positions of an EPD file through a pool of engine processes, searches each
+ with the same time, depth or node budget and checks the move against its bm (best move) and am (avoid move)
+ operations. Results are written as EPD lines in suite order while the run goes on, with the standard analysis
+ operations added: pm (predicted move), acd (depth), acn (nodes), acs (seconds), ce (centipawns), pv.
+
+ python EpdRunner.py suite.epd --time 1 --processes 4 --output results.epd
+ python EpdRunner.py suite.epd --depth 3 --limit 100
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import ChessEngine
+import Pgn
+import UciEngine
+from ScoreScale import reported_centipawns
+from SelfPlay import engine_limits
+
+worker_ai = None  # one AiMoveFinder per worker process, loaded once
+
+
+def _init_worker(ai_options):
+    global worker_ai
+    import AiMoveFinder
+    worker_ai = AiMoveFinder.AiMoveFinder(**ai_options)
+
+
+# operations of an EPD line after the four position fields: [(opcode, [operand, ...])], quotes removed
+def _split_operations(text):
+    operations = []
+    tokens = []
+    token = None
+    quoted = False
+    for char in text + ';':
+        if quoted:
+            if char == '"':
+                quoted = False
+            else:
+                token += char
+        elif char == '"':
+            quoted = True
+            token = token or ''
+        elif char.isspace() or char == ';':
+            if token is not None:
+                tokens.append(token)
+                token = None
+            if char == ';' and tokens:
+                operations.append((tokens[0], tokens[1:]))
+                tokens = []
+        else:
+            token = (token or '') + char
+    return operations
+
+
+# EPD line -> (FEN, {opcode: [operands]}), hmvc and fmvn operations become the move counters of the FEN
+def parse_epd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError('invalid EPD: ' + line)
+    operations = dict(_split_operations(fields[4] if len(fields) > 4 else ''))
+    counters = (operations.get('hmvc', ['0'])[0], operations.get('fmvn', ['1'])[0])
+    return ' '.join(fields[:4]) + ' %s %s' % counters, operations
+
+
+# string operations of the standard (id and the comments c0..c9) are always quoted
+def format_epd(fen, operations):
+    text = ' '.join(fen.split()[:4])
+    for opcode, operands in operations.items():
+        quote = opcode == 'id' or (len(opcode) == 2 and opcode[0] == 'c' and opcode[1].isdigit())
+        operands = ['"%s"' % operand if quote or not operand or ' ' in operand or ';' in operand else operand
+                    for operand in operands]
+        text += ' ' + ' '.join([opcode] + operands) + ';'
+    return text
+
+
+# valid moves named by an operation, SAN as the EPD standard asks or uci
+def _operation_moves(gs, operands, valid_moves):
+    moves = []
+    for text in operands:
+        try:
+            moves.append(Pgn.san_to_move(gs, text, valid_moves))
+        except ValueError:
+            move = UciEngine.uci_to_move(gs, text)
+            if move is None:
+                raise ValueError('illegal move %s' % text)
+            moves.append(move)
+    return moves
+
+
+# searches one position in the worker, returns a result dict. task = (number, EPD line, limits, bitboards)
+def analyse(task):
+    number, line, limits, bitboards = task
+    result = {'number': number, 'id': str(number + 1), 'epd': line, 'move': None, 'solved': None, 'nodes': 0,
+              'seconds': 0.0, 'depth': 0, 'error': None}
+    try:
+        fen, operations = parse_epd(line)
+        result['id'] = operations.get('id', [result['id']])[0]
+        gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+        gs.load_fen(fen)
+        valid_moves = gs.get_valid_moves()
+        best_moves = _operation_moves(gs, operations.get('bm', []), valid_moves)
+        avoid_moves = _operation_moves(gs, operations.get('am', []), valid_moves)
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    if not valid_moves:
+        result['error'] = 'no legal moves'
+        return result
+    ai = worker_ai
+    # positions are unrelated, results of the last one would only fill the table
+    ai.transposition_table.clear()
+    ai.history = {}
+    start = time.perf_counter()
+    move = ai.find_best_move_iterative(gs, valid_moves, **limits)
+    result['seconds'] = time.perf_counter() - start
+    result['nodes'] = ai.nodes
+    result['depth'] = ai.completed_depth
+    result['move'] = Pgn.move_to_san(gs, move, valid_moves)
+    if best_moves or avoid_moves:
+        result['solved'] = (not best_moves or move in best_moves) and move not in avoid_moves
+    operations['pm'] = [result['move']]
+    operations['acd'] = [str(ai.completed_depth)]
+    operations['acn'] = [str(ai.nodes)]
+    operations['acs'] = ['%.3f' % result['seconds']]
+    if ai.best_score is not None:
+        operations['ce'] = [str(reported_centipawns(ai.best_score, gs.white_to_move))]
+    pv = []
+    for pv_move in ai.get_principal_variation(gs):
+        pv.append(Pgn.move_to_san(gs, pv_move))
+        gs.make_move(pv_move)
+    operations['pv'] = pv or [result['move']]
+    result['epd'] = format_epd(fen, operations)
+    return result
+
+
+# non-empty, non-comment lines of an EPD file, read as they are needed
+def read_epd(path, limit=None):
+    with open(path) as f:
+        count = 0
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if limit is not None and count >= limit:
+                break
+            count += 1
+            yield line
+
+
+def run_suite(path, limits, processes=None, output_path=None, bitboards=True, ai_options=None, limit=None,
+              verbose=True):
+    tasks = ((number, line, limits, bitboards) for number, line in enumerate(read_epd(path, limit)))
+    processes = processes or os.cpu_count() or 1
+    # spawn: workers start clean instead of forking a parent that may already run keras
+    context = multiprocessing.get_context('spawn')
+    results = []
+    start = time.perf_counter()
+    output = open(output_path, 'w') if output_path else None
+    try:
+        with context.Pool(processes, initializer=_init_worker, initargs=(ai_options or {},)) as pool:
+            # in suite order, so result files of two builds can be compared line by line
+            for result in pool.imap(analyse, tasks):
+                results.append(result)
+                if output is not None:
+                    output.write(result['epd'] + '\n')
+                    output.flush()
+                if verbose:
+                    print_result(result)
+    finally:
+        if output is not None:
+            output.close()
+    return summarize(results, time.perf_counter() - start)
+
+
+def print_result(result):
+    if result['error'] is not None:
+        print('%4d %-16s error: %s' % (result['number'] + 1, result['id'], result['error']))
+        return
+    status = {True: 'solved', False: 'failed', None: ''}[result['solved']]
+    print('%4d %-16s %-8s %-6s depth %2d %9d nodes %7.2fs' % (result['number'] + 1, result['id'], result['move'],
+                                                              status, result['depth'], result['nodes'],
+                                                              result['seconds']))
+
+
+def summarize(results, seconds):
+    searched = [result for result in results if result['error'] is None]
+    tested = [result for result in searched if result['solved'] is not None]
+    solved = sum(1 for result in tested if result['solved'])
+    nodes = sum(result['nodes'] for result in searched)
+    search_seconds = sum(result['seconds'] for result in searched)
+    return {'positions': len(results), 'errors': len(results) - len(searched), 'tested': len(tested),
+            'solved': solved, 'solve_rate': solved / len(tested) if tested else 0.0, 'nodes': nodes,
+            'nodes_per_second': nodes / search_seconds if search_seconds > 0 else 0.0,
+            'average_seconds': search_seconds / len(searched) if searched else 0.0,
+            'average_depth': sum(result['depth'] for result in searched) / len(searched) if searched else 0.0,
+            'seconds': seconds}
+
+
+def print_summary(summary):
+    print('positions %d  errors %d  wall time %.1fs' % (summary['positions'], summary['errors'], summary['seconds']))
+    print('solved %d/%d  %.1f%%' % (summary['solved'], summary['tested'], summary['solve_rate'] * 100))
+    print('nodes %d  %.0f nodes/s per process  average %.2fs and depth %.1f per position' % (
+        summary['nodes'], summary['nodes_per_second'], summary['average_seconds'], summary['average_depth']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EPD test-suite runner')
+    parser.add_argument('epd', help='EPD file, one position per line')
+    parser.add_argument('--output', help='write the analysed positions to this EPD file')
+    parser.add_argument('--processes', type=int, help='worker processes, default: number of cpus')
+    parser.add_argument('--time', type=float, help='seconds per position')
+    parser.add_argument('--depth', type=int, help='search depth per position')
+    parser.add_argument('--nodes', type=int, help='nodes per position')
+    parser.add_argument('--limit', type=int, help='only the first positions of the file')
+    parser.add_argument('--no-bitboards', action='store_true', help='use the 2d-list move generator')
+    parser.add_argument('--eval-cache', help='evaluation cache file shared by the workers')
+    parser.add_argument('--tables', help='endgame table directory')
+    parser.add_argument('--precision', choices=('float32', 'float16', 'int8'), default='float32',
+                        help='precision of the network weights')
+    args = parser.parse_args()
+
+    ai_options = {}
+    if args.eval_cache:
+        ai_options['eval_cache'] = args.eval_cache
+    if args.tables:
+        ai_options['endgame_tables'] = args.tables
+    if args.precision != 'float32':
+        ai_options['precision'] = args.precision
+    summary = run_suite(args.epd, engine_limits(args.time, args.nodes, args.depth), args.processes, args.output,
+                        not args.no_bitboards, ai_options, args.limit)
+    print_summary(summary)
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
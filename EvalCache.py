@@ -0,0 +1,250 @@
+"""
+ Evaluation cache on disk: network scores by zobrist key in a memory-mapped open-addressing table, so positions
+ evaluated once are reused across games, engine restarts and worker processes sharing the file.
+
+ Every key has a window of PROBE slots. A full window evicts its oldest entry. Each open of the file starts a new
+ generation, and hits refresh an entry's generation, so positions nobody looked at recently go first.
+ Writers don't lock: a torn entry can at worst give one wrong score for one position, and the key is written last.
+
+ python EvalCache.py --cache eval_cache.bin --pgn games.pgn            pre-warm from games
+ python EvalCache.py --cache eval_cache.bin --fens positions.txt --children
+ python EvalCache.py --cache eval_cache.bin --stats
+"""
+
+import argparse
+import os
+import zlib
+
+import numpy as np
+
+import ChessEngine
+import NumpyModel
+import Pgn
+
+MAGIC = b'EVALCACH'
+VERSION = 1
+PROBE = 8  # slots searched per key
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('probe', '<u4'), ('slots', '<u8'), ('model_id', '<u8'),
+                   ('generation', '<u8'), ('reserved', '<u8', (3,))])  # 64 bytes
+ENTRY = np.dtype([('key', '<u8'), ('score', '<f4'), ('age', '<u4')])  # key 0 marks an empty slot
+
+
+# identifies the network and precision the scores came from, a cache of another network is cleared on open
+def model_fingerprint(path=NumpyModel.MODEL_PATH, precision='float32'):
+    fingerprint = 0
+    for extension in ('.json', '.h5'):
+        with open(path + extension, 'rb') as f:
+            fingerprint = (fingerprint << 32) | zlib.crc32(f.read())
+    if precision != 'float32':
+        fingerprint ^= zlib.crc32(precision.encode())
+    return fingerprint
+
+
+class EvalCache():
+    # slots is rounded down to a power of two, an existing file keeps its own size.
+    # model_id None keeps whatever network the file was filled by
+    def __init__(self, path, slots=2 ** 20, model_id=None):
+        self.path = path
+        if not os.path.exists(path):
+            self.__create(path, 1 << max(int(slots).bit_length() - 1, 3), model_id or 0)
+        self.header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+        if self.header['magic'][0] != MAGIC or self.header['version'][0] != VERSION \
+                or self.header['probe'][0] != PROBE:
+            raise ValueError('not an evaluation cache: ' + path)
+        self.slots = int(self.header['slots'][0])
+        self.mask = self.slots - 1
+        self.entries = np.memmap(path, dtype=ENTRY, mode='r+', offset=HEADER.itemsize, shape=(self.slots,))
+        self.keys, self.scores, self.ages = self.entries['key'], self.entries['score'], self.entries['age']
+        if model_id is not None and int(self.header['model_id'][0]) != model_id:
+            self.clear()
+            self.header['model_id'] = model_id
+        self.header['generation'] += 1
+        self.generation = np.uint32(self.header['generation'][0] & 0xffffffff)
+        self.offsets = np.arange(PROBE, dtype=np.uint64)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # written to a temporary file and linked into place, so processes opening the cache together never see
+    # a half written header
+    @staticmethod
+    def __create(path, slots, model_id):
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        header = np.zeros(1, dtype=HEADER)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['probe'] = PROBE
+        header['slots'] = slots
+        header['model_id'] = model_id
+        with open(temporary, 'wb') as f:
+            f.write(header.tobytes())
+            f.truncate(HEADER.itemsize + slots * ENTRY.itemsize)
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass  # another process was first
+        finally:
+            os.remove(temporary)
+
+    def clear(self):
+        self.entries[:] = 0
+
+    # slot indices of the probe window of each key, shape (n, PROBE)
+    def __windows(self, keys):
+        return ((keys & np.uint64(self.mask))[:, np.newaxis] + self.offsets) & np.uint64(self.mask)
+
+    @staticmethod
+    def __as_keys(keys):
+        keys = np.array(keys, dtype=np.uint64).reshape(-1)
+        keys[keys == 0] = 1  # 0 is the empty slot
+        return keys
+
+    # score of one position or None
+    def lookup(self, key):
+        score = self.lookup_many([key])[0]
+        return None if np.isnan(score) else float(score)
+
+    # scores of many positions at once, nan where a position is not cached
+    def lookup_many(self, keys):
+        keys = self.__as_keys(keys)
+        windows = self.__windows(keys)
+        found = self.keys[windows] == keys[:, np.newaxis]
+        hit = found.any(axis=1)
+        slots = windows[np.arange(len(keys)), found.argmax(axis=1)][hit]
+        scores = np.full(len(keys), np.nan, dtype=np.float32)
+        scores[hit] = self.scores[slots]
+        # refresh entries last used in an older generation, most hits then don't write
+        stale = slots[self.ages[slots] != self.generation]
+        if len(stale) > 0:
+            self.ages[stale] = self.generation
+        hits = int(hit.sum())
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return scores
+
+    def store(self, key, score):
+        self.store_many([key], [score])
+
+    def store_many(self, keys, scores):
+        keys = self.__as_keys(keys)
+        for key, score, window in zip(keys, scores, self.__windows(keys)):
+            window_keys = self.keys[window]
+            matches = np.flatnonzero(window_keys == key)
+            if len(matches) == 0:
+                matches = np.flatnonzero(window_keys == 0)
+            if len(matches) > 0:
+                slot = window[matches[0]]
+            else:
+                slot = window[np.argmin(self.ages[window])]
+                self.evictions += 1
+            # key last: a reader never matches a half written entry of this key
+            self.entries[slot] = (0, score, self.generation)
+            self.keys[slot] = key
+            self.stores += 1
+
+    def flush(self):
+        self.entries.flush()
+        self.header.flush()
+
+    def close(self):
+        self.flush()
+        del self.keys, self.scores, self.ages, self.entries, self.header
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'slots': self.slots, 'used': int(np.count_nonzero(self.keys)), 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0, 'stores': self.stores,
+                'evictions': self.evictions}
+
+
+# positions of a PGN file: yields GameStates along every game's moves
+def pgn_positions(path, bitboards=True):
+    with open(path) as f:
+        for headers, san_moves, result in Pgn.read_games(f):
+            gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+            if 'FEN' in headers:
+                gs.load_fen(headers['FEN'])
+            yield gs
+            for san in san_moves:
+                try:
+                    gs.make_move(Pgn.san_to_move(gs, san))
+                except ValueError:
+                    break  # rest of the game can't be followed
+                yield gs
+
+
+# positions of a file with one FEN per line
+def fen_positions(path, bitboards=True):
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+                gs.load_fen(line.strip())
+                yield gs
+
+
+# evaluates the positions (and with children every position one move later) that are not cached yet,
+# returns how many were added
+def warm(cache, positions, model, children=False, batch_size=1024):
+    batch = np.empty((batch_size, 8, 8, 12), dtype=np.float32)
+    keys = []
+    stores = cache.stores
+
+    def evaluate():
+        scores = model.predict(batch[:len(keys)])[:, 0]
+        cache.store_many(keys, scores)
+        keys.clear()
+
+    def add(gs):
+        if gs.zobrist_key in seen:
+            return
+        seen.add(gs.zobrist_key)
+        if cache.lookup(gs.zobrist_key) is None:
+            batch[len(keys)] = gs.one_hot
+            keys.append(gs.zobrist_key)
+            if len(keys) == batch_size:
+                evaluate()
+
+    seen = set()
+    for gs in positions:
+        add(gs)
+        if children:
+            for move in gs.get_valid_moves():
+                gs.make_move(move)
+                add(gs)
+                gs.undo_move()
+    if keys:
+        evaluate()
+    cache.flush()
+    return cache.stores - stores
+
+
+def main():
+    parser = argparse.ArgumentParser(description='persistent evaluation cache')
+    parser.add_argument('--cache', required=True, help='cache file, created when missing')
+    parser.add_argument('--slots', type=int, default=2 ** 20, help='entries of a new cache, 16 bytes each')
+    parser.add_argument('--model', default=NumpyModel.MODEL_PATH, help='model path without extension')
+    parser.add_argument('--pgn', action='append', default=[], help='pre-warm with the positions of the games')
+    parser.add_argument('--fens', action='append', default=[], help='pre-warm with a file of FENs, one per line')
+    parser.add_argument('--children', action='store_true', help='also the positions one move after each')
+    parser.add_argument('--precision', choices=NumpyModel.PRECISIONS, default='float32', help='network precision')
+    parser.add_argument('--stats', action='store_true', help='print cache statistics')
+    args = parser.parse_args()
+
+    cache = EvalCache(args.cache, args.slots, model_fingerprint(args.model, args.precision))
+    if args.pgn or args.fens:
+        model = NumpyModel.load_model(args.model, precision=args.precision)
+        for path in args.pgn:
+            print('%s: %d positions added' % (path, warm(cache, pgn_positions(path), model, args.children)))
+        for path in args.fens:
+            print('%s: %d positions added' % (path, warm(cache, fen_positions(path), model, args.children)))
+    if args.stats or not (args.pgn or args.fens):
+        for name, value in cache.stats().items():
+            print(name, value)
+    cache.close()
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
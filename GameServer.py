@@ -0,0 +1,434 @@
+"""
+ Game server: an asyncio front end that hosts many games at once. Every connection is one game session with its
+ own GameState and search (transposition table, killers, history), but all sessions share a single network through
+ an InferenceBatcher: leaf positions submitted by the searches of all games are coalesced into one predict call,
+ which runs once no running search can add more, the batch is full or the oldest request has waited max latency.
+ Searches run on a thread pool, so the event loop keeps serving other games while they think.
+
+ One command per line, one reply line per command:
+   new [fen]                 start a game from the start position or a FEN
+   moves e2e4 e7e5 ...       play moves (uci) in the game
+   go [time s] [depth d] [nodes n]
+                             the engine searches and plays its move:
+                             bestmove <uci> score <cp> depth <d> nodes <n> ms <ms>
+   fen                       position of the game
+   stats                     move latencies of this game (json)
+   metrics                   server metrics: games, batch sizes, move latencies (json)
+   quit
+
+ python GameServer.py --port 8765 --metrics-port 9100       serve, prometheus metrics over http
+ python GameServer.py --bench 16 --moves 10 --depth 2       16 simulated games in this process, then the metrics
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+
+import numpy as np
+
+import ChessEngine
+import NumpyModel
+from EvalCache import EvalCache, model_fingerprint
+from ScoreScale import reported_centipawns
+from SelfPlay import engine_limits
+from UciEngine import move_to_uci, uci_to_move
+
+DEFAULT_PORT = 8765
+MAX_BATCH = 512  # positions per predict call
+MAX_LATENCY = 0.002  # seconds the oldest request may wait for more
+MAX_SEARCHES = 32  # searches running at the same time, more wait for a thread
+TT_SIZE = 2 ** 16  # transposition table slots per game
+
+
+# power of two bucket of a value, for histograms
+def _bucket(value):
+    return 1 << max(int(value), 1).bit_length() - 1
+
+
+# counters and histograms of the server, updated by the event loop and the batcher thread
+class ServerMetrics():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # name: {power of two bucket: count}
+        self.started = time.perf_counter()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {})
+            bucket = _bucket(value)
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def to_dict(self, gauges=None):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: dict(sorted(histogram.items())) for name, histogram in self.histograms.items()}
+        batches = counters.get('batches', 0)
+        moves = counters.get('moves', 0)
+        summary = {'uptime_seconds': time.perf_counter() - self.started,
+                   'mean_batch_size': counters.get('batched_positions', 0) / batches if batches else 0.0,
+                   'requests_per_batch': counters.get('requests', 0) / batches if batches else 0.0,
+                   'mean_move_ms': counters.get('move_ms', 0) / moves if moves else 0.0}
+        summary.update(gauges or {})
+        return {'summary': summary, 'counters': counters, 'histograms': histograms}
+
+    # Prometheus text exposition format, histograms as cumulative buckets
+    def to_prometheus(self, gauges=None, prefix='chess_server'):
+        data = self.to_dict(gauges)
+        lines = []
+        for name, value in sorted(data['summary'].items()):
+            lines += ['# TYPE %s_%s gauge' % (prefix, name), '%s_%s %s' % (prefix, name, repr(value))]
+        for name, value in sorted(data['counters'].items()):
+            lines += ['# TYPE %s_%s_total counter' % (prefix, name), '%s_%s_total %s' % (prefix, name, value)]
+        for name, histogram in sorted(data['histograms'].items()):
+            lines.append('# TYPE %s_%s histogram' % (prefix, name))
+            total = 0
+            for bucket, count in histogram.items():
+                total += count
+                lines.append('%s_%s_bucket{le="%d"} %d' % (prefix, name, bucket * 2 - 1, total))
+            lines += ['%s_%s_bucket{le="+Inf"} %d' % (prefix, name, total), '%s_%s_count %d' % (prefix, name, total)]
+        return '\n'.join(lines) + '\n'
+
+
+# network shared by the searches of all games, with NumpyModel's predict so AiMoveFinder takes it as its model.
+# predict blocks the calling search until its rows were evaluated as part of a batch
+class InferenceBatcher():
+    def __init__(self, model, max_batch=MAX_BATCH, max_latency=MAX_LATENCY, metrics=None):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.metrics = metrics or ServerMetrics()
+        self.condition = threading.Condition()
+        self.pending = []  # [inputs, arrival time, done event, outputs or exception]
+        self.pending_rows = 0
+        self.searching = 0  # searches that may still submit requests
+        self.stopped = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def predict(self, x, batch_size=None, verbose=0):
+        request = [np.asarray(x, dtype=np.float32), time.perf_counter(), threading.Event(), None]
+        with self.condition:
+            self.pending.append(request)
+            self.pending_rows += len(request[0])
+            self.condition.notify()
+        request[2].wait()
+        if isinstance(request[3], BaseException):
+            raise request[3]
+        return request[3]
+
+    # a search starts or ends: when every running search waits for its result there is nothing more to wait for
+    def begin_search(self):
+        with self.condition:
+            self.searching += 1
+
+    def end_search(self):
+        with self.condition:
+            self.searching -= 1
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    # requests of the next batch, called with the condition held
+    def __next_batch(self):
+        while not self.pending and not self.stopped:
+            self.condition.wait()
+        deadline = self.pending[0][1] + self.max_latency if self.pending else 0
+        while not self.stopped and self.pending_rows < self.max_batch and len(self.pending) < self.searching:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+        batch, rows = [], 0
+        while self.pending and (not batch or rows + len(self.pending[0][0]) <= self.max_batch):
+            request = self.pending.pop(0)
+            batch.append(request)
+            rows += len(request[0])
+        self.pending_rows -= rows
+        return batch
+
+    def __run(self):
+        while True:
+            with self.condition:
+                batch = self.__next_batch()
+            if not batch:
+                return  # stopped
+            inputs = np.concatenate([request[0] for request in batch])
+            try:
+                outputs = self.model.predict(inputs, batch_size=len(inputs))
+            except Exception as e:
+                outputs = e
+            self.metrics.count('batches')
+            self.metrics.count('requests', len(batch))
+            self.metrics.count('batched_positions', len(inputs))
+            self.metrics.observe('batch_size', len(inputs))
+            start = 0
+            for request in batch:
+                if isinstance(outputs, Exception):
+                    request[3] = outputs
+                else:
+                    request[3] = outputs[start:start + len(request[0])]
+                start += len(request[0])
+                request[2].set()
+
+
+# one hosted game
+class GameSession():
+    def __init__(self, number, ai, bitboards=True):
+        self.number = number
+        self.ai = ai
+        self.bitboards = bitboards
+        self.gs = None
+        self.move_ms = []
+        self.new_game()
+
+    def new_game(self, fen=None):
+        gs = ChessEngine.GameState(track_one_hot=True, bitboards=self.bitboards)
+        if fen:
+            gs.load_fen(fen)  # an invalid fen leaves the game as it was
+        self.gs = gs
+        self.ai.transposition_table.clear()
+        self.ai.history = {}
+
+    def stats(self):
+        latencies = np.array(self.move_ms) if self.move_ms else np.zeros(1)
+        return {'game': self.number, 'moves': len(self.move_ms), 'mean_ms': float(latencies.mean()),
+                'p50_ms': float(np.percentile(latencies, 50)), 'p95_ms': float(np.percentile(latencies, 95)),
+                'max_ms': float(latencies.max())}
+
+
+class GameServer():
+    def __init__(self, batcher, max_searches=MAX_SEARCHES, bitboards=True, tt_size=TT_SIZE, eval_cache=None,
+                 endgame_tables=None, futility_margin=300, precision='float32'):
+        self.batcher = batcher
+        self.metrics = batcher.metrics
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_searches)
+        self.bitboards = bitboards
+        self.ai_options = {'tt_size': tt_size, 'futility_margin': futility_margin, 'precision': precision}
+        # one cache for all games, its scores come from the batcher's network at this precision
+        self.eval_cache = None
+        if eval_cache is not None:
+            self.eval_cache = EvalCache(eval_cache, model_id=model_fingerprint(NumpyModel.MODEL_PATH, precision))
+        # tables are read-only, one copy for all games
+        self.endgame_tables = None
+        if endgame_tables is not None:
+            from EndgameTables import EndgameTables
+            self.endgame_tables = EndgameTables(endgame_tables)
+        self.sessions = {}
+        self.games_started = 0
+
+    def new_session(self):
+        import AiMoveFinder
+        ai = AiMoveFinder.AiMoveFinder(model=self.batcher, **self.ai_options)
+        ai.eval_cache = self.eval_cache
+        ai.endgame_tables = self.endgame_tables
+        self.games_started += 1
+        session = GameSession(self.games_started, ai, self.bitboards)
+        self.sessions[session.number] = session
+        self.metrics.count('games')
+        return session
+
+    def close_session(self, session):
+        self.sessions.pop(session.number, None)
+
+    # the shared eval cache is written back and unmapped, the sessions must be done searching
+    def close(self):
+        if self.eval_cache is not None:
+            self.eval_cache.close()
+            self.eval_cache = None
+
+    def gauges(self):
+        return {'active_games': len(self.sessions), 'searching': self.batcher.searching,
+                'pending_requests': len(self.batcher.pending)}
+
+    # runs on an executor thread
+    def __search(self, session, limits):
+        self.batcher.begin_search()
+        try:
+            gs = session.gs
+            return session.ai.find_best_move_iterative(gs, gs.get_valid_moves(), **limits)
+        finally:
+            self.batcher.end_search()
+
+    # engine move of the session's game, played on its board: reply line
+    async def engine_move(self, session, limits):
+        gs = session.gs
+        if not gs.get_valid_moves():
+            return 'error game over'
+        start = time.perf_counter()
+        ply = len(gs.moveLog)
+        try:
+            move = await asyncio.get_running_loop().run_in_executor(self.executor, self.__search, session, limits)
+        except Exception:
+            while len(gs.moveLog) > ply:  # a failed search can leave its moves on the board
+                gs.undo_move()
+            raise
+        ms = (time.perf_counter() - start) * 1000
+        session.move_ms.append(ms)
+        self.metrics.count('moves')
+        self.metrics.count('move_ms', ms)
+        self.metrics.observe('move_latency_ms', ms)
+        ai = session.ai
+        score = reported_centipawns(ai.best_score, gs.white_to_move) if ai.best_score is not None else 0
+        gs.make_move(move)
+        return 'bestmove %s score %d depth %d nodes %d ms %.1f' % (move_to_uci(move), score, ai.completed_depth,
+                                                                    ai.nodes, ms)
+
+    async def command(self, session, line):
+        words = line.split()
+        if not words:
+            return None
+        if words[0] == 'new':
+            try:
+                session.new_game(' '.join(words[1:]) or None)
+            except ValueError as e:
+                return 'error ' + str(e)
+            return 'ok'
+        if words[0] == 'moves':
+            for text in words[1:]:
+                move = uci_to_move(session.gs, text)
+                if move is None:
+                    return 'error illegal move ' + text
+                session.gs.make_move(move)
+            return 'ok'
+        if words[0] == 'go':
+            options = dict(zip(words[1::2], words[2::2]))
+            try:
+                limits = engine_limits(float(options['time']) if 'time' in options else None,
+                                       int(options['nodes']) if 'nodes' in options else None,
+                                       int(options['depth']) if 'depth' in options else None)
+            except ValueError:
+                return 'error invalid limits'
+            return await self.engine_move(session, limits)
+        if words[0] == 'fen':
+            return session.gs.get_fen()
+        if words[0] == 'stats':
+            return json.dumps(session.stats())
+        if words[0] == 'metrics':
+            return json.dumps(self.metrics.to_dict(self.gauges()))
+        return 'error unknown command ' + words[0]
+
+    async def handle_connection(self, reader, writer):
+        session = self.new_session()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line or line.strip() == b'quit':
+                    break
+                try:
+                    reply = await self.command(session, line.decode(errors='replace'))
+                except Exception as e:  # one bad request fails alone, the game goes on
+                    self.metrics.count('errors')
+                    reply = 'error ' + (str(e) or type(e).__name__)
+                if reply is not None:
+                    writer.write(reply.encode() + b'\n')
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.close_session(session)
+            writer.close()
+
+    # any request on the metrics port gets the metrics in Prometheus text format
+    async def handle_metrics(self, reader, writer):
+        try:
+            while (await reader.readline()).strip():
+                pass  # request line and headers
+            body = self.metrics.to_prometheus(self.gauges()).encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: %d\r\n\r\n'
+                         % len(body) + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, metrics_port=None):
+        servers = [await asyncio.start_server(self.handle_connection, host, port)]
+        if metrics_port is not None:
+            servers.append(await asyncio.start_server(self.handle_metrics, host, metrics_port))
+        print('serving games on %s:%d' % (host, port), flush=True)
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    # games played by the engine against itself in this process, for sizing a host
+    async def bench(self, games, moves, limits):
+        async def play():
+            session = self.new_session()
+            for ply in range(moves):
+                if (await self.engine_move(session, limits)).startswith('error'):
+                    break
+            self.close_session(session)
+            return session.stats()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(play() for i in range(games)))
+        return results, time.perf_counter() - start
+
+
+def print_bench(results, seconds, metrics):
+    data = metrics.to_dict()
+    moves = sum(result['moves'] for result in results)
+    print('%d games, %d moves in %.1fs  %.1f moves/s' % (len(results), moves, seconds, moves / seconds))
+    print('move latency mean %.1fms  p95 of games %.1fms  max %.1fms' % (
+        data['summary']['mean_move_ms'], max(result['p95_ms'] for result in results),
+        max(result['max_ms'] for result in results)))
+    print('batches %d  mean batch size %.1f  requests per batch %.1f' % (
+        data['counters'].get('batches', 0), data['summary']['mean_batch_size'], data['summary']['requests_per_batch']))
+    print('batch sizes ' + ' '.join('%d:%d' % item for item in data['histograms'].get('batch_size', {}).items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='game server with a shared inference batcher')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics over http on this port')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='positions per predict call')
+    parser.add_argument('--max-latency', type=float, default=MAX_LATENCY * 1000,
+                        help='ms the oldest request waits for a fuller batch')
+    parser.add_argument('--max-searches', type=int, default=MAX_SEARCHES, help='searches running at once')
+    parser.add_argument('--tt-size', type=int, default=TT_SIZE, help='transposition table slots per game')
+    parser.add_argument('--precision', choices=NumpyModel.PRECISIONS, default='float32',
+                        help='precision of the network weights')
+    parser.add_argument('--no-bitboards', action='store_true', help='use the 2d-list move generator')
+    parser.add_argument('--eval-cache', help='evaluation cache file shared by the games')
+    parser.add_argument('--tables', help='endgame table directory')
+    parser.add_argument('--bench', type=int, metavar='GAMES', help='play this many games in process and exit')
+    parser.add_argument('--moves', type=int, default=10, help='engine moves per bench game')
+    parser.add_argument('--time', type=float, help='seconds per bench move')
+    parser.add_argument('--depth', type=int, help='search depth of bench moves')
+    parser.add_argument('--nodes', type=int, help='nodes per bench move')
+    args = parser.parse_args()
+
+    model = NumpyModel.load_model(precision=args.precision)
+    batcher = InferenceBatcher(model, args.max_batch, args.max_latency / 1000)
+    server = GameServer(batcher, args.max_searches, not args.no_bitboards, args.tt_size, args.eval_cache,
+                        args.tables, precision=args.precision)
+    try:
+        if args.bench:
+            limits = engine_limits(args.time, args.nodes, args.depth)
+            results, seconds = asyncio.run(server.bench(args.bench, args.moves, limits))
+            print_bench(results, seconds, server.metrics)
+        else:
+            asyncio.run(server.serve(args.host, args.port, args.metrics_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.stop()
+        server.executor.shutdown(wait=False)
+        server.close()
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
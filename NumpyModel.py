@@ -0,0 +1,346 @@
+"""
+ Keras-free inference for the value network: reads the architecture from the model .json and the weights from the
+ .h5 file once and runs the forward pass with numpy. Supports the Sequential layers we train with (Conv2D, pooling,
+ Flatten, BatchNormalization, Dense, Dropout, Activation).
+
+ The weights and architecture can be cached in an .npz next to the .h5, reloading from the cache needs neither
+ h5py nor the json file.
+
+ Kernels can be stored at reduced precision: float16, or int8 with one scale per output channel. They stay that
+ small in memory, the matmuls upcast them for each call and the int8 scales are applied to the products. Biases
+ and batch normalization stay float32. QuantizeModel.py measures what a precision costs in accuracy.
+
+ python NumpyModel.py --cache              write models/chess_best_model.npz
+ python NumpyModel.py --compare 1000       compare predictions with keras on random positions
+ python NumpyModel.py --cache --precision int8    write models/chess_best_model.int8.npz
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+MODEL_PATH = 'models/chess_best_model'
+PRECISIONS = ('float32', 'float16', 'int8')
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -80, 80)))
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+activations = {'linear': lambda x: x, 'relu': relu, 'sigmoid': sigmoid, 'tanh': np.tanh, 'softmax': softmax}
+
+
+# padding on both sides of one spatial axis, keras 'same' puts the extra cell at the end
+def _padding(size, kernel, stride, padding):
+    if padding == 'valid':
+        return 0, 0
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+# (n, h, w, c) -> (n, out_h, out_w, kh, kw, c) windows, without copying
+def _windows(x, kernel, strides, padding, pad_value=0.0):
+    pad_h = _padding(x.shape[1], kernel[0], strides[0], padding)
+    pad_w = _padding(x.shape[2], kernel[1], strides[1], padding)
+    if pad_h != (0, 0) or pad_w != (0, 0):
+        x = np.pad(x, ((0, 0), pad_h, pad_w, (0, 0)), constant_values=pad_value)
+    windows = np.lib.stride_tricks.sliding_window_view(x, kernel, axis=(1, 2))
+    windows = windows[:, ::strides[0], ::strides[1]]
+    return windows.transpose(0, 1, 2, 4, 5, 3)
+
+
+# kernel as stored: float32, float16, or int8 with a float32 scale per output channel (None otherwise)
+def _kernel(weights):
+    kernel = weights['kernel']
+    if kernel.dtype not in (np.float16, np.int8):
+        kernel = kernel.astype(np.float32)
+    scale = weights['kernel_scale'].astype(np.float32) if 'kernel_scale' in weights else None
+    return kernel, scale
+
+
+class Conv2D():
+    def __init__(self, config, weights):
+        self.kernel, self.scale = _kernel(weights)  # (kh, kw, in, out)
+        self.bias = weights['bias'].astype(np.float32) if 'bias' in weights else None
+        self.strides = tuple(config.get('strides', (1, 1)))
+        self.padding = config.get('padding', 'valid')
+        self.activation = activations[config.get('activation', 'linear')]
+        if tuple(config.get('dilation_rate', (1, 1))) != (1, 1):
+            raise ValueError('dilated convolutions are not supported')
+
+    def __call__(self, x):
+        kh, kw, channels, filters = self.kernel.shape
+        if (kh, kw) == (1, 1) and self.strides == (1, 1):
+            y = x @ self.kernel[0, 0]  # 1x1 convolution is a matmul over the channels
+        else:
+            windows = _windows(x, (kh, kw), self.strides, self.padding)
+            y = windows.reshape(windows.shape[:3] + (-1,)) @ self.kernel.reshape(-1, filters)
+        if self.scale is not None:
+            y *= self.scale
+        if self.bias is not None:
+            y += self.bias
+        return self.activation(y)
+
+
+class Pooling2D():
+    def __init__(self, config, weights, reduce):
+        self.pool_size = tuple(config.get('pool_size', (2, 2)))
+        self.strides = tuple(config.get('strides') or self.pool_size)
+        self.padding = config.get('padding', 'valid')
+        self.reduce = reduce
+
+    def __call__(self, x):
+        n, h, w, c = x.shape
+        ph, pw = self.pool_size
+        if self.padding == 'valid' and self.strides == self.pool_size and h % ph == 0 and w % pw == 0:
+            return self.reduce(x.reshape(n, h // ph, ph, w // pw, pw, c), axis=(2, 4))
+        windows = _windows(x, self.pool_size, self.strides, self.padding,
+                           -np.inf if self.reduce is np.max else np.nan)
+        if self.reduce is np.max:
+            return windows.max(axis=(3, 4))
+        return np.nanmean(windows, axis=(3, 4))  # keras doesn't count padding cells in the average
+
+
+class Flatten():
+    def __init__(self, config, weights):
+        pass
+
+    def __call__(self, x):
+        return x.reshape(x.shape[0], -1)
+
+
+class BatchNormalization():
+    def __init__(self, config, weights):
+        epsilon = config.get('epsilon', 1e-3)
+        axis = config.get('axis', -1)
+        self.axis = axis[0] if isinstance(axis, list) else axis
+        variance = weights['moving_variance']
+        gamma = weights.get('gamma', np.ones_like(variance))
+        beta = weights.get('beta', np.zeros_like(variance))
+        # inference only: folded into one multiply and add
+        self.scale = (gamma / np.sqrt(variance + epsilon)).astype(np.float32)
+        self.shift = (beta - weights['moving_mean'] * self.scale).astype(np.float32)
+
+    def __call__(self, x):
+        axis = self.axis % x.ndim
+        shape = [1] * x.ndim
+        shape[axis] = x.shape[axis]
+        return x * self.scale.reshape(shape) + self.shift.reshape(shape)
+
+
+class Dense():
+    def __init__(self, config, weights):
+        self.kernel, self.scale = _kernel(weights)
+        self.bias = weights['bias'].astype(np.float32) if 'bias' in weights else None
+        self.activation = activations[config.get('activation', 'linear')]
+
+    def __call__(self, x):
+        y = x @ self.kernel
+        if self.scale is not None:
+            y *= self.scale
+        if self.bias is not None:
+            y += self.bias
+        return self.activation(y)
+
+
+class Activation():
+    def __init__(self, config, weights):
+        self.activation = activations[config['activation']]
+
+    def __call__(self, x):
+        return self.activation(x)
+
+
+class Identity():
+    def __init__(self, config, weights):
+        pass
+
+    def __call__(self, x):
+        return x
+
+
+layer_types = {
+    'Conv2D': Conv2D,
+    'MaxPooling2D': lambda config, weights: Pooling2D(config, weights, np.max),
+    'AveragePooling2D': lambda config, weights: Pooling2D(config, weights, np.mean),
+    'Flatten': Flatten,
+    'BatchNormalization': BatchNormalization,
+    'Dense': Dense,
+    'Activation': Activation,
+    'Dropout': Identity,  # only active in training
+    'InputLayer': Identity,
+}
+
+
+class NumpyModel():
+    def __init__(self, architecture, weights):
+        config = architecture['config']
+        if architecture['class_name'] != 'Sequential':
+            raise ValueError('only Sequential models are supported, got ' + architecture['class_name'])
+        layer_configs = config['layers'] if isinstance(config, dict) else config  # old keras: list of layers
+        self.layers = []
+        for layer in layer_configs:
+            if layer['class_name'] not in layer_types:
+                raise ValueError('unsupported layer ' + layer['class_name'])
+            name = layer['config'].get('name')
+            self.layers.append(layer_types[layer['class_name']](layer['config'], weights.get(name, {})))
+        self.weight_bytes = sum(value.nbytes for layer in weights.values() for value in layer.values())
+
+    # same call as keras Model.predict, returns an (n, outputs) float32 array
+    def predict(self, x, batch_size=None, verbose=0):
+        x = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            x = layer(x)
+        return x
+
+
+# weights per layer name from a keras .h5 file: {layer: {'kernel': array, 'bias': array, ...}}
+def read_h5_weights(path):
+    import h5py
+    weights = {}
+    with h5py.File(path, 'r') as f:
+        group = f['model_weights'] if 'model_weights' in f else f  # model.save or model.save_weights
+        for layer_name in group.attrs['layer_names']:
+            layer_name = layer_name.decode() if isinstance(layer_name, bytes) else layer_name
+            layer = group[layer_name]
+            weights[layer_name] = {}
+            for weight_name in layer.attrs['weight_names']:
+                weight_name = weight_name.decode() if isinstance(weight_name, bytes) else weight_name
+                # 'conv2d_2/kernel:0' -> 'kernel'
+                weights[layer_name][weight_name.split('/')[-1].split(':')[0]] = np.array(layer[weight_name])
+    return weights
+
+
+# kernels of Conv2D and Dense layers at the precision, other weights unchanged. int8 scales each output channel
+# (last kernel axis) so its largest weight becomes 127
+def quantize_weights(weights, precision):
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision ' + precision)
+    quantized = {}
+    for layer_name, layer_weights in weights.items():
+        quantized[layer_name] = dict(layer_weights)
+        kernel = layer_weights.get('kernel')
+        if kernel is None or precision == 'float32':
+            continue
+        if precision == 'float16':
+            quantized[layer_name]['kernel'] = kernel.astype(np.float16)
+        else:
+            peak = np.abs(kernel).reshape(-1, kernel.shape[-1]).max(axis=0)
+            scale = np.where(peak > 0, peak / 127, 1).astype(np.float32)
+            quantized[layer_name]['kernel'] = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+            quantized[layer_name]['kernel_scale'] = scale
+    return quantized
+
+
+def write_cache(path, architecture, weights):
+    arrays = {'architecture': np.array(json.dumps(architecture))}
+    for layer_name, layer_weights in weights.items():
+        for weight_name, value in layer_weights.items():
+            arrays[layer_name + '/' + weight_name] = value
+    np.savez(path, **arrays)
+
+
+def read_cache(path):
+    with np.load(path) as data:
+        architecture = json.loads(str(data['architecture']))
+        weights = {}
+        for key in data.files:
+            if key != 'architecture':
+                layer_name, weight_name = key.split('/')
+                weights.setdefault(layer_name, {})[weight_name] = data[key]
+    return architecture, weights
+
+
+# cache of the weights at a precision: path.npz for float32, path.<precision>.npz otherwise
+def cache_path_of(path, precision='float32'):
+    return path + ('.npz' if precision == 'float32' else '.' + precision + '.npz')
+
+
+# model from path + '.json' and path + '.h5'. with cache the .npz is used when it is newer than both,
+# and written when it is missing or out of date. precision: one of PRECISIONS, the stored kernels
+def load_model(path=MODEL_PATH, cache=True, precision='float32'):
+    json_path, h5_path, cache_path = path + '.json', path + '.h5', cache_path_of(path, precision)
+    if cache and os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) >= max(os.path.getmtime(json_path), os.path.getmtime(h5_path)):
+        return NumpyModel(*read_cache(cache_path))
+    with open(json_path) as f:
+        architecture = json.load(f)
+    weights = quantize_weights(read_h5_weights(h5_path), precision)
+    if cache:
+        try:
+            write_cache(cache_path, architecture, weights)
+        except OSError:
+            pass  # read-only model directory, the cache is optional
+    return NumpyModel(architecture, weights)
+
+
+def load_keras_model(path=MODEL_PATH, loss='mse', optimizer='adam'):
+    from keras.models import model_from_json
+    with open(path + '.json') as f:
+        model = model_from_json(f.read())
+    model.compile(optimizer=optimizer, loss=loss, metrics=None)
+    model.load_weights(path + '.h5')
+    return model
+
+
+# random one-hot positions with 2..32 pieces, enough to exercise every weight
+def random_inputs(count, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.zeros((count, 8, 8, 12), dtype=np.float32)
+    for i in range(count):
+        squares = rng.choice(64, size=rng.integers(2, 33), replace=False)
+        x[i, squares // 8, squares % 8, rng.integers(0, 12, size=len(squares))] = 1
+    return x
+
+
+def compare(count, path=MODEL_PATH):
+    x = random_inputs(count)
+    start = time.perf_counter()
+    keras_model = load_keras_model(path)
+    keras_load = time.perf_counter() - start
+    start = time.perf_counter()
+    numpy_model = load_model(path)
+    numpy_load = time.perf_counter() - start
+    expected = keras_model.predict(x, batch_size=len(x))
+    actual = numpy_model.predict(x)
+    print('load keras %.3fs  numpy %.3fs' % (keras_load, numpy_load))
+    print('max abs difference %.2e over %d positions' % (np.abs(expected - actual).max(), count))
+    for name, model in (('keras', keras_model), ('numpy', numpy_model)):
+        start = time.perf_counter()
+        for i in range(100):
+            model.predict(x[i % count:i % count + 1], batch_size=1)
+        print('%s single position predict %.3fms' % (name, (time.perf_counter() - start) * 10))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='numpy inference for the value network')
+    parser.add_argument('--model', default=MODEL_PATH, help='model path without extension')
+    parser.add_argument('--cache', action='store_true', help='write the .npz weight cache')
+    parser.add_argument('--compare', type=int, metavar='N', help='compare with keras on N random positions')
+    parser.add_argument('--precision', choices=PRECISIONS, default='float32', help='precision of the cached kernels')
+    args = parser.parse_args()
+    if args.cache:
+        path = cache_path_of(args.model, args.precision)
+        with open(args.model + '.json') as f:
+            write_cache(path, json.load(f), quantize_weights(read_h5_weights(args.model + '.h5'), args.precision))
+        print('written to', path)
+    if args.compare:
+        compare(args.compare, args.model)
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+ Opening book: a binary file of 16 byte entries (key, move, weight, learn), big-endian and sorted by key like a
+ Polyglot book, memory-mapped and searched by binary search. Keys are our zobrist keys, not the Polyglot ones, so
+ books are built with this module rather than taken from other engines.
+ The move is the low 12 bits of Move.code (start and end square), promotions are always to a queen.
+
+ python OpeningBook.py --build book.bin games.pgn [more.pgn ...] --plies 16 --min-games 2
+ python OpeningBook.py --book book.bin --fen "<fen>"        list the book moves of a position
+"""
+
+import argparse
+import os
+import random
+
+import numpy as np
+
+import ChessEngine
+import Pgn
+
+ENTRY = np.dtype([('key', '>u8'), ('move', '>u2'), ('weight', '>u2'), ('learn', '>u4')])
+
+
+class OpeningBook():
+    def __init__(self, path, seed=None):
+        self.path = path
+        if os.path.getsize(path) == 0:
+            self.entries = np.zeros(0, dtype=ENTRY)  # memmap can't map an empty file
+        else:
+            self.entries = np.memmap(path, dtype=ENTRY, mode='r')
+        self.keys = self.entries['key']
+        self.random = random.Random(seed)
+
+    # (move, weight) of the position, moves are valid moves of gs
+    def get_moves(self, gs, valid_moves=None):
+        key = np.uint64(gs.zobrist_key)
+        first = int(np.searchsorted(self.keys, key, side='left'))
+        last = int(np.searchsorted(self.keys, key, side='right'))
+        if first == last:
+            return []
+        valid_moves = valid_moves if valid_moves is not None else gs.get_valid_moves()
+        by_squares = {move.code & 0xfff: move for move in valid_moves}
+        moves = []
+        for entry in self.entries[first:last]:
+            move = by_squares.get(int(entry['move']))
+            if move is not None and entry['weight'] > 0:
+                moves.append((move, int(entry['weight'])))
+        return moves
+
+    # book move of the position or None. weighted: random in proportion to the weights, else the heaviest
+    def choose_move(self, gs, valid_moves=None, weighted=True):
+        moves = self.get_moves(gs, valid_moves)
+        if not moves:
+            return None
+        if not weighted:
+            return max(moves, key=lambda item: item[1])[0]
+        return self.random.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# counts every move played in the first plies of the games: weight 2 for a move of the side that won,
+# 1 for a draw, 0 for a loss (Polyglot convention). positions seen in fewer than min_games games are left out
+def build(pgn_paths, path, plies=16, min_games=1, bitboards=True):
+    weights = {}
+    games = {}
+    for pgn_path in pgn_paths:
+        with open(pgn_path) as f:
+            for headers, san_moves, result in Pgn.read_games(f):
+                gs = ChessEngine.GameState(bitboards=bitboards)
+                if 'FEN' in headers:
+                    gs.load_fen(headers['FEN'])
+                for san in san_moves[:plies]:
+                    try:
+                        move = Pgn.san_to_move(gs, san)
+                    except ValueError:
+                        break
+                    if result == '1/2-1/2':
+                        weight = 1
+                    elif result in ('1-0', '0-1'):
+                        weight = 2 if (result == '1-0') == gs.white_to_move else 0
+                    else:
+                        weight = 1  # unknown result
+                    item = (gs.zobrist_key, move.code & 0xfff)
+                    weights[item] = weights.get(item, 0) + weight
+                    games[gs.zobrist_key] = games.get(gs.zobrist_key, 0) + 1
+                    gs.make_move(move)
+    by_key = {}
+    for (key, move), weight in weights.items():
+        if games[key] >= min_games:
+            by_key.setdefault(key, []).append((move, weight))
+    entries = []
+    for key in sorted(by_key):
+        moves = by_key[key]
+        # weights are 16 bit: scale the moves of a position down together
+        scale = max(max(weight for move, weight in moves) / 0xffff, 1)
+        for move, weight in sorted(moves, key=lambda item: -item[1]):
+            entries.append((key, move, int(weight / scale), 0))
+    np.array(entries, dtype=ENTRY).tofile(path)
+    return len(entries), len(by_key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='opening book')
+    parser.add_argument('--build', metavar='BOOK', help='compile the PGN files into this book')
+    parser.add_argument('pgn', nargs='*', help='PGN files for --build')
+    parser.add_argument('--plies', type=int, default=16, help='book depth in plies')
+    parser.add_argument('--min-games', type=int, default=1, help='leave out positions seen in fewer games')
+    parser.add_argument('--book', help='book to look up')
+    parser.add_argument('--fen', help='position to look up, default: start position')
+    args = parser.parse_args()
+    if args.build:
+        if not args.pgn:
+            parser.error('--build needs PGN files')
+        entries, positions = build(args.pgn, args.build, args.plies, args.min_games)
+        print('%d entries for %d positions written to %s' % (entries, positions, args.build))
+    elif args.book:
+        book = OpeningBook(args.book)
+        gs = ChessEngine.GameState(bitboards=True)
+        if args.fen:
+            gs.load_fen(args.fen)
+        for move, weight in book.get_moves(gs):
+            print(Pgn.move_to_san(gs, move), weight)
+    else:
+        parser.print_help()
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+    Parallel root search: the moves of the root position are split over a pool of worker processes.
+    Every worker loads the model once and keeps its own AiMoveFinder (and transposition table) between tasks.
+    Positions are sent as GameState snapshots.
+"""
+
+import multiprocessing
+import os
+import time
+
+import ChessEngine
+from OpeningBook import OpeningBook
+
+# AiMoveFinder of a worker process, created by _init_worker
+worker_ai = None
+worker_bitboards = False
+
+
+def _init_worker(ai_options, bitboards, stop_event):
+    global worker_ai, worker_bitboards
+    import AiMoveFinder  # imported in the worker, so the parent doesn't have to load the model
+    worker_ai = AiMoveFinder.AiMoveFinder(**ai_options)
+    worker_ai.stop_event = stop_event  # set by ParallelMoveFinder.stop, running tasks give up at the next node
+    worker_bitboards = bitboards
+
+
+# task of a worker: score one root move, searched to depth - 1 below it inside the window alpha, beta
+# deadline is a time.time() timestamp so it means the same in every process
+def _search_root_move(task):
+    snapshot, move_index, depth, alpha, beta, deadline, node_limit = task
+    gs = ChessEngine.GameState(track_one_hot=True, bitboards=worker_bitboards)
+    gs.load_snapshot(snapshot)
+    move = gs.get_valid_moves()[move_index]
+    gs.make_move(move)
+    time_limit = None
+    if deadline is not None:
+        time_limit = deadline - time.time()
+        if time_limit <= 0:
+            return move_index, None, 0
+    score = worker_ai.search_position(gs, depth - 1, alpha, beta, time_limit=time_limit, node_limit=node_limit)
+    return move_index, None if score is None else float(score), worker_ai.nodes
+
+
+class ParallelMoveFinder():
+    # book: OpeningBook path, looked up here so book positions never reach the workers
+    def __init__(self, processes=None, bitboards=True, book=None, book_seed=None, **ai_options):
+        self.processes = processes or os.cpu_count() or 1
+        # spawn: workers start clean instead of forking a parent that may already run keras
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.pool = context.Pool(self.processes, initializer=_init_worker,
+                                 initargs=(ai_options, bitboards, self.stop_event))
+        self.bitboards = bitboards
+        self.next_move = None
+        self.best_score = None
+        self.completed_depth = 0
+        self.nodes = 0
+        self.on_iteration = None
+        self.book = OpeningBook(book, book_seed) if book is not None else None
+
+    # set by stop(), cleared by the owner of the search before it starts one (SearchThread), like
+    # AiMoveFinder.stop_requested. kept in the event the workers check, so it reaches searches already running
+    @property
+    def stop_requested(self):
+        return self.stop_event.is_set()
+
+    @stop_requested.setter
+    def stop_requested(self, value):
+        if value:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
+    # ends the search: running worker tasks abort and the last completed iteration is returned
+    def stop(self):
+        self.stop_requested = True
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    # shallow iterations are cheap and give the deeper ones a good first move
+    def find_best_move_minmax(self, gs, valid_moves, depth=2):
+        return self.find_best_move_iterative(gs, valid_moves, max_depth=depth)
+
+    # same interface as AiMoveFinder.find_best_move_iterative, every iteration searches all root moves in parallel
+    def find_best_move_iterative(self, gs, valid_moves, time_limit=None, node_limit=None, max_depth=None):
+        if max_depth is None:
+            max_depth = 64 if time_limit is not None or node_limit is not None else 2
+        if self.book is not None:
+            book_move = self.book.choose_move(gs, valid_moves)
+            if book_move is not None:
+                self.next_move, self.best_score, self.completed_depth, self.nodes = book_move, None, 0, 0
+                return book_move
+        deadline = time.time() + time_limit if time_limit is not None else None
+        snapshot = gs.get_snapshot()
+        # tasks refer to moves by index, so the order has to be the one the workers generate
+        generated = ChessEngine.GameState(bitboards=self.bitboards)
+        generated.load_snapshot(snapshot)
+        root_moves = generated.get_valid_moves()
+        best_move = valid_moves[0] if len(valid_moves) > 0 else None
+        self.completed_depth = 0
+        self.nodes = 0
+        if len(root_moves) <= 1:
+            self.next_move = best_move
+            return best_move
+        best_index = 0
+        for depth in range(1, max_depth + 1):
+            move_node_limit = None
+            if node_limit is not None:
+                move_node_limit = max((node_limit - self.nodes) // len(root_moves), 1)
+            # best move of the last iteration is searched alone first, its score bounds the search of the others:
+            # they only have to prove they are not better, which cuts most of their trees
+            move_index, first_score, nodes = self.pool.apply(
+                _search_root_move, ((snapshot, best_index, depth, 0, 1, deadline, move_node_limit),))
+            self.nodes += nodes
+            if first_score is None or self.stop_requested:
+                break  # budget ran out during this iteration
+            if gs.white_to_move:
+                alpha, beta = first_score, 1
+            else:
+                alpha, beta = 0, first_score
+            tasks = [(snapshot, i, depth, alpha, beta, deadline, move_node_limit)
+                     for i in range(len(root_moves)) if i != best_index]
+            scores = [None] * len(root_moves)
+            scores[best_index] = first_score
+            for move_index, score, nodes in self.pool.imap_unordered(_search_root_move, tasks):
+                scores[move_index] = score
+                self.nodes += nodes
+                if self.stop_requested:
+                    break
+            if any(score is None for score in scores):
+                break
+            # a move that failed low returned a bound no better than first_score, so it never wins here
+            best_index = self.__best_index(scores, gs.white_to_move, best_index)
+            best_move = next(move for move in valid_moves if move == root_moves[best_index])
+            self.best_score = scores[best_index]
+            self.completed_depth = depth
+            if self.on_iteration is not None:
+                self.on_iteration(gs)
+            if node_limit is not None and self.nodes >= node_limit:
+                break
+        self.next_move = best_move
+        return best_move
+
+    # ties keep the first searched move
+    @staticmethod
+    def __best_index(scores, white_to_move, first_index):
+        best_index = first_index
+        for i, score in enumerate(scores):
+            if (white_to_move and score > scores[best_index]) or (not white_to_move and score < scores[best_index]):
+                best_index = i
+        return best_index
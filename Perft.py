@@ -0,0 +1,171 @@
+"""
+ Perft: counts the leaf nodes of the move generation tree to a fixed depth. Used to test GameState move generation
+ against known node counts and to benchmark make_move, undo_move and get_valid_moves.
+
+ python Perft.py --depth 4                          start position, divide per root move
+ python Perft.py --fen "<fen>" --depth 3            any position
+ python Perft.py --suite                            check all reference positions
+ python Perft.py --bench results.json --label old   time the reference positions and store the results
+ python Perft.py --compare old.json new.json        compare two benchmark files
+"""
+
+import argparse
+import json
+import platform
+import time
+
+import ChessEngine
+
+# reference positions and their node counts per depth (index 0 -> depth 1).
+# the engine always promotes to a queen, so positions with promotions have lower counts than the published ones
+REFERENCE_POSITIONS = {
+    'startpos': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                 [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 [48, 2039, 97862, 4074224]),
+    'en_passant': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                   [14, 191, 2812, 43238, 674624]),
+    'promotion': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 228, 8087, 320802]),
+    'promotion_check': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                        [41, 1373, 54007, 1806790]),
+}
+
+# depth per position used by --suite and --bench, chosen to run in seconds rather than minutes
+DEFAULT_DEPTHS = {'startpos': 3, 'kiwipete': 3, 'en_passant': 4, 'promotion': 3, 'promotion_check': 3}
+
+
+def new_game_state(fen=None, bitboards=False):
+    gs = ChessEngine.GameState(bitboards=bitboards)
+    if fen is not None:
+        gs.load_fen(fen)
+    return gs
+
+
+# number of leaf nodes depth moves from the current position
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    if depth == 1:  # bulk count, no need to make the last moves
+        if hasattr(gs, 'get_valid_move_codes'):
+            return len(gs.get_valid_move_codes())  # no Move objects needed to count
+        return len(gs.get_valid_moves())
+    moves = gs.get_valid_moves()
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+# leaf nodes below each root move, keyed by move notation
+def divide(gs, depth):
+    counts = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        counts[move.get_chess_notation()] = perft(gs, depth - 1)
+        gs.undo_move()
+    return counts
+
+
+# runs perft and returns (nodes, seconds)
+def timed_perft(gs, depth):
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    return nodes, time.perf_counter() - start
+
+
+# runs every reference position, returns one result dict per position
+def run_suite(depths=None, bitboards=False):
+    depths = depths or DEFAULT_DEPTHS
+    results = []
+    for name, (fen, counts) in REFERENCE_POSITIONS.items():
+        depth = min(depths.get(name, 1), len(counts))
+        nodes, seconds = timed_perft(new_game_state(fen, bitboards), depth)
+        results.append({'position': name, 'depth': depth, 'nodes': nodes, 'expected': counts[depth - 1],
+                        'passed': nodes == counts[depth - 1], 'seconds': seconds,
+                        'nps': nodes / seconds if seconds > 0 else 0.0})
+    return results
+
+
+def benchmark(path, label=None, depths=None, bitboards=False, repeat=1):
+    runs = [run_suite(depths, bitboards) for i in range(repeat)]
+    # fastest of the repeats per position, the others are mostly noise from the machine
+    results = [min(position_runs, key=lambda result: result['seconds']) for position_runs in zip(*runs)]
+    report = {'label': label, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'machine': platform.machine(), 'backend': 'bitboards' if bitboards else 'list',
+              'results': results,
+              'total_nodes': sum(result['nodes'] for result in results),
+              'total_seconds': sum(result['seconds'] for result in results)}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_results = {(result['position'], result['depth']): result for result in old['results']}
+    for result in new['results']:
+        before = old_results.get((result['position'], result['depth']))
+        if before is None:
+            continue
+        print('%-16s depth %d  %10.0f -> %10.0f nps  x%.2f' % (result['position'], result['depth'], before['nps'],
+                                                              result['nps'], result['nps'] / max(before['nps'], 1e-9)))
+    print('total %.3fs -> %.3fs' % (old['total_seconds'], new['total_seconds']))
+
+
+def print_results(results):
+    for result in results:
+        print('%-16s depth %d  nodes %9d  %s  %7.3fs  %9.0f nps' % (
+            result['position'], result['depth'], result['nodes'], 'ok  ' if result['passed'] else 'FAIL',
+            result['seconds'], result['nps']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='perft node counts and move generation benchmark')
+    parser.add_argument('--fen', help='position to search, default: start position')
+    parser.add_argument('--position', choices=REFERENCE_POSITIONS.keys(), help='reference position to search')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--bitboards', action='store_true', help='use the bitboard backend')
+    parser.add_argument('--suite', action='store_true', help='check node counts of all reference positions')
+    parser.add_argument('--bench', metavar='JSON', help='time the reference positions and write results to JSON')
+    parser.add_argument('--label', help='name of the benchmark run')
+    parser.add_argument('--repeat', type=int, default=1, help='benchmark repetitions, the fastest is kept')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two benchmark files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.bench:
+        report = benchmark(args.bench, args.label, bitboards=args.bitboards, repeat=args.repeat)
+        print_results(report['results'])
+        print('written to', args.bench)
+    elif args.suite:
+        results = run_suite(bitboards=args.bitboards)
+        print_results(results)
+        if not all(result['passed'] for result in results):
+            raise SystemExit(1)
+    else:
+        fen = args.fen
+        if args.position:
+            fen = REFERENCE_POSITIONS[args.position][0]
+        try:
+            gs = new_game_state(fen, args.bitboards)
+        except ValueError as e:
+            parser.error(str(e))
+        start = time.perf_counter()
+        counts = divide(gs, args.depth)
+        seconds = time.perf_counter() - start
+        for notation in sorted(counts):
+            print(notation, counts[notation])
+        nodes = sum(counts.values())
+        print('nodes %d  time %.3fs  %.0f nps' % (nodes, seconds, nodes / seconds if seconds > 0 else 0.0))
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
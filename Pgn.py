@@ -0,0 +1,160 @@
+"""
+ PGN reading and writing: standard algebraic notation (SAN) of moves and the PGN text of games.
+"""
+
+import time
+
+from ChessEngine import Move
+
+piece_letters = {'p': '', 'N': 'N', 'B': 'B', 'R': 'R', 'Q': 'Q', 'K': 'K'}
+
+
+# SAN of a valid move of gs, gs has to be in the position before the move
+def move_to_san(gs, move, valid_moves=None):
+    if move.is_castle_move:
+        san = 'O-O' if move.end_col == 6 else 'O-O-O'
+    else:
+        piece = move.piece_moved[1]
+        target = move.get_rank_file(move.end_row, move.end_col)
+        capture = move.piece_captured != '--'
+        if piece == 'p':
+            san = (move.cols_to_files[move.start_col] + 'x' if capture else '') + target
+            if move.is_pawn_promotion:
+                san += '=Q'
+        else:
+            valid_moves = valid_moves if valid_moves is not None else gs.get_valid_moves()
+            san = piece_letters[piece] + _disambiguation(move, valid_moves) + ('x' if capture else '') + target
+    gs.make_move(move)
+    if gs.in_check():
+        san += '#' if len(gs.get_valid_moves()) == 0 else '+'
+    gs.undo_move()
+    return san
+
+
+# file, rank or both of the start square when another piece of the same kind can reach the target square
+def _disambiguation(move, valid_moves):
+    others = [other for other in valid_moves if other.piece_moved == move.piece_moved and other != move
+              and other.end_row == move.end_row and other.end_col == move.end_col]
+    if not others:
+        return ''
+    if all(other.start_col != move.start_col for other in others):
+        return move.cols_to_files[move.start_col]
+    if all(other.start_row != move.start_row for other in others):
+        return move.rows_to_ranks[move.start_row]
+    return move.get_rank_file(move.start_row, move.start_col)
+
+
+# PGN text of one game: headers is a dict (seven tag roster first), san_moves the moves from the start position,
+# white_to_move and move_number describe the start position
+def game_to_pgn(headers, san_moves, result, white_to_move=True, move_number=1, line_length=80):
+    tags = {'Event': '?', 'Site': '?', 'Date': time.strftime('%Y.%m.%d'), 'Round': '?', 'White': '?',
+            'Black': '?', 'Result': result}
+    tags.update(headers)
+    tags['Result'] = result
+    lines = ['[%s "%s"]' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+             for name, value in tags.items()]
+    lines.append('')
+    tokens = []
+    for san in san_moves:
+        if white_to_move:
+            tokens.append('%d.' % move_number)
+        elif not tokens:
+            tokens.append('%d...' % move_number)
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(result)
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > line_length:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
+
+
+# valid move of gs written in SAN, raises ValueError when it matches no move or several. promotions are always
+# to a queen, the promotion piece is not checked
+def san_to_move(gs, san, valid_moves=None):
+    valid_moves = valid_moves if valid_moves is not None else gs.get_valid_moves()
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        end_col = 6 if len(text) == 3 else 2
+        candidates = [move for move in valid_moves if move.is_castle_move and move.end_col == end_col]
+    else:
+        if '=' in text:
+            text = text[:text.index('=')]
+        elif len(text) > 2 and text[0].islower() and text[-1] in 'QRBN':
+            text = text[:-1]  # promotion without '=': e8Q
+        piece = text[0] if text[:1] in piece_letters and text[:1] != 'p' else 'p'
+        if piece != 'p':
+            text = text[1:]
+        target, hint = text[-2:], text[:-2].replace('x', '')
+        if len(target) != 2 or target[0] not in Move.files_to_cols or target[1] not in Move.ranks_to_rows:
+            raise ValueError('invalid SAN: ' + san)
+        end_row, end_col = Move.ranks_to_rows[target[1]], Move.files_to_cols[target[0]]
+        candidates = []
+        for move in valid_moves:
+            if move.piece_moved[1] != piece or move.end_row != end_row or move.end_col != end_col:
+                continue
+            if any((char in Move.files_to_cols and Move.files_to_cols[char] != move.start_col) or
+                   (char in Move.ranks_to_rows and Move.ranks_to_rows[char] != move.start_row) for char in hint):
+                continue
+            candidates.append(move)
+    if len(candidates) != 1:
+        raise ValueError('%s SAN: %s' % ('illegal' if not candidates else 'ambiguous', san))
+    return candidates[0]
+
+
+# games of a PGN file (or any iterable of lines): yields (headers, san moves, result). comments, variations
+# and annotations are skipped
+def read_games(lines):
+    headers, tokens = {}, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            if tokens:
+                yield _finish_game(headers, tokens)
+                headers, tokens = {}, []
+            name, _, value = line[1:-1].partition(' ')
+            headers[name] = value.strip().strip('"').replace('\\"', '"').replace('\\\\', '\\')
+        elif line and not line.startswith('%'):
+            tokens.extend(line.replace('{', ' { ').replace('}', ' } ').replace('(', ' ( ').replace(')', ' ) ')
+                          .replace(';', ' ; ').split() + ['\n'])
+    if tokens or headers:
+        yield _finish_game(headers, tokens)
+
+
+def _finish_game(headers, tokens):
+    moves = []
+    result = headers.get('Result', '*')
+    comment = False
+    line_comment = False
+    variation_depth = 0
+    for token in tokens:
+        if line_comment:
+            line_comment = token != '\n'
+        elif comment:
+            comment = token != '}'
+        elif token == '\n':
+            continue
+        elif token == '{':
+            comment = True
+        elif token == ';':
+            line_comment = True
+        elif token == '(':
+            variation_depth += 1
+        elif token == ')':
+            variation_depth -= 1
+        elif variation_depth > 0 or token.startswith('$'):
+            continue
+        elif token in ('1-0', '0-1', '1/2-1/2', '*'):
+            result = token
+        else:
+            token = token.split('.')[-1]  # "12.e4", "12." and "12..." move numbers
+            if token:
+                moves.append(token)
+    return headers, moves, result
@@ -0,0 +1,163 @@
+"""
+ Validation of reduced-precision networks: runs the float32 network and the float16 / int8 versions of
+ NumpyModel over a position set and reports how far the scores drift, how often the move the network prefers
+ (best child, and optionally the move of a search) stays the same, the size of the weights and the latency.
+
+ python QuantizeModel.py --pgn games.pgn --positions 2000
+ python QuantizeModel.py --fens positions.txt --precision int8 --depth 2
+ python QuantizeModel.py                                   random positions from random games
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+import ChessEngine
+import NumpyModel
+from EvalCache import fen_positions, pgn_positions
+from ScoreScale import reported_centipawns
+
+
+# positions along random games, for a quick check without a position file
+def random_positions(count, seed=0, bitboards=True):
+    rng = random.Random(seed)
+    produced = 0
+    while produced < count:
+        gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+        for ply in range(rng.randint(10, 120)):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+        if gs.get_valid_moves():
+            produced += 1
+            yield gs
+
+
+# encodings of up to count positions and of their children: (positions, children, child ranges, fens, white to move)
+def collect(positions, count):
+    boards, children, ranges, fens, sides = [], [], [], [], []
+    for gs in positions:
+        moves = gs.get_valid_moves()
+        if not moves:
+            continue
+        boards.append(gs.one_hot.copy())
+        start = len(children)
+        for move in moves:
+            gs.make_move(move)
+            children.append(gs.one_hot.copy())
+            gs.undo_move()
+        ranges.append((start, len(children)))
+        fens.append(gs.get_fen())
+        sides.append(gs.white_to_move)
+        if len(boards) >= count:
+            break
+    return np.array(boards), np.array(children), ranges, fens, sides
+
+
+# index of the child each side to move prefers: highest score for white, lowest for black
+def preferred_children(child_scores, ranges, sides):
+    return [int(np.argmax(child_scores[a:b]) if white else np.argmin(child_scores[a:b]))
+            for (a, b), white in zip(ranges, sides)]
+
+
+def predict(model, x, batch_size=1024):
+    return np.concatenate([model.predict(x[i:i + batch_size])[:, 0] for i in range(0, len(x), batch_size)])
+
+
+# mean seconds of a single-position call and per position of a batch_size call
+def latency(model, x, calls=200, batch_size=64):
+    start = time.perf_counter()
+    for i in range(calls):
+        model.predict(x[i % len(x):i % len(x) + 1])
+    single = (time.perf_counter() - start) / calls
+    batch = x[:batch_size]
+    start = time.perf_counter()
+    for i in range(calls // 10 or 1):
+        model.predict(batch)
+    return single, (time.perf_counter() - start) / (calls // 10 or 1) / len(batch)
+
+
+# best moves of a depth limited search of every position
+def search_moves(fens, depth, precision, bitboards=True):
+    import AiMoveFinder
+    ai = AiMoveFinder.AiMoveFinder(precision=precision)
+    moves = []
+    for fen in fens:
+        ai.transposition_table.clear()
+        ai.history = {}
+        gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+        gs.load_fen(fen)
+        moves.append(ai.find_best_move_iterative(gs, gs.get_valid_moves(), max_depth=depth))
+    return moves
+
+
+def validate(boards, children, ranges, fens, sides, precisions, model_path=NumpyModel.MODEL_PATH, depth=None):
+    reference = NumpyModel.load_model(model_path)
+    reference_scores = predict(reference, boards)
+    reference_children = preferred_children(predict(reference, children), ranges, sides)
+    reference_search = search_moves(fens, depth, 'float32') if depth else None
+    centipawns = np.array([reported_centipawns(score, True) for score in reference_scores])
+    report = {}
+    for precision in ('float32',) + tuple(precisions):
+        model = reference if precision == 'float32' else NumpyModel.load_model(model_path, precision=precision)
+        scores = predict(model, boards)
+        drift = np.abs(scores - reference_scores)
+        centipawn_drift = np.abs(np.array([reported_centipawns(score, True) for score in scores]) - centipawns)
+        child_moves = preferred_children(predict(model, children), ranges, sides)
+        single, batched = latency(model, boards)
+        result = {'weight_bytes': model.weight_bytes, 'max_drift': float(drift.max()),
+                  'mean_drift': float(drift.mean()), 'max_centipawn_drift': float(centipawn_drift.max()),
+                  'mean_centipawn_drift': float(centipawn_drift.mean()),
+                  'child_agreement': float(np.mean([a == b for a, b in zip(child_moves, reference_children)])),
+                  'single_ms': single * 1000, 'batched_us': batched * 1e6}
+        if depth:
+            moves = reference_search if precision == 'float32' else search_moves(fens, depth, precision)
+            result['search_agreement'] = float(np.mean([a == b for a, b in zip(moves, reference_search)]))
+        report[precision] = result
+    return report
+
+
+def print_report(report, positions):
+    print('%d positions, drift and agreement against float32' % positions)
+    print('%-8s %8s %10s %10s %9s %9s %7s %7s %9s %10s' % ('', 'weights', 'max drift', 'mean drift', 'max cp',
+                                                           'mean cp', 'child', 'search', 'single', 'batched'))
+    for precision, result in report.items():
+        search = '%6.1f%%' % (result['search_agreement'] * 100) if 'search_agreement' in result else '-'
+        print('%-8s %7dB %10.2e %10.2e %9.1f %9.2f %6.1f%% %7s %7.3fms %8.1fus' % (
+            precision, result['weight_bytes'], result['max_drift'], result['mean_drift'],
+            result['max_centipawn_drift'], result['mean_centipawn_drift'], result['child_agreement'] * 100, search,
+            result['single_ms'], result['batched_us']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='validate reduced-precision networks against float32')
+    parser.add_argument('--model', default=NumpyModel.MODEL_PATH, help='model path without extension')
+    parser.add_argument('--pgn', help='positions of the games in this PGN file')
+    parser.add_argument('--fens', help='file with one FEN per line')
+    parser.add_argument('--positions', type=int, default=1000, help='positions to compare')
+    parser.add_argument('--precision', action='append', choices=NumpyModel.PRECISIONS[1:],
+                        help='precision to validate, default: all')
+    parser.add_argument('--depth', type=int, help='also compare the moves of searches to this depth')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random positions')
+    args = parser.parse_args()
+
+    if args.pgn:
+        positions = pgn_positions(args.pgn)
+    elif args.fens:
+        positions = fen_positions(args.fens)
+    else:
+        positions = random_positions(args.positions, args.seed)
+    boards, children, ranges, fens, sides = collect(positions, args.positions)
+    if len(boards) == 0:
+        parser.error('no positions with legal moves')
+    report = validate(boards, children, ranges, fens, sides, args.precision or NumpyModel.PRECISIONS[1:], args.model,
+                      args.depth)
+    print_report(report, len(boards))
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
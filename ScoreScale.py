@@ -0,0 +1,26 @@
+"""
+    Mapping between search scores in [0, 1] (1 = white wins, the scale of the network) and centipawns, the usual
+    logistic curve: 400 centipawns per factor 10 in the odds of winning.
+"""
+
+import math
+
+# scores this close to 0 or 1 map to +-1600 centipawns instead of infinity
+SCORE_CLAMP = 1e-4
+
+
+# score -> centipawns from white's point of view, not rounded
+def score_to_centipawns(score):
+    score = min(max(score, SCORE_CLAMP), 1 - SCORE_CLAMP)
+    return 400 * math.log10(score / (1 - score))
+
+
+# centipawns from white's point of view -> score
+def centipawns_to_score(centipawns):
+    return 1 / (1 + 10 ** (-centipawns / 400))
+
+
+# score of a search as the engine reports it: whole centipawns from the side to move
+def reported_centipawns(score, white_to_move):
+    centipawns = int(round(score_to_centipawns(score)))
+    return centipawns if white_to_move else -centipawns
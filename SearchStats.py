@@ -0,0 +1,248 @@
+"""
+ Opt-in search statistics: counters, call timers and per-ply histograms filled by AiMoveFinder and by the move
+ generator of the searched GameState, and an optional sampling profiler of the search thread. Exported as JSON,
+ as Prometheus text or, for the profiler, as collapsed stacks for flame graphs.
+
+ The timers wrap methods of the searched objects only while a search runs, the profiler reads the stack of the
+ search thread from another thread: neither changes what the search does, so depth and node limited searches
+ return the same move. A search without statistics only checks that AiMoveFinder.stats is None.
+
+ python SearchStats.py --depth 3                              search the start position, print the statistics
+ python SearchStats.py --fen "<fen>" --time 2 --json stats.json --prometheus stats.prom --profile stacks.txt
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import ChessEngine
+
+# methods timed during a search, by the attribute of AiMoveFinder they belong to ('gs' is the searched position)
+TIMED_METHODS = {
+    'gs': ('get_valid_moves', 'staged_candidates', 'make_move', 'undo_move'),
+    'model': ('predict',),
+    'eval_cache': ('lookup', 'lookup_many', 'store', 'store_many'),
+    'endgame_tables': ('probe_score',),
+}
+
+
+# stands in for an object other searches may share (model, eval cache, endgame tables) in the attribute of one
+# search: the timed methods are its own, everything else is read from the wrapped object
+class TimedProxy():
+    def __init__(self, wrapped):
+        self.__wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self.__wrapped, name)
+
+
+class SearchStats():
+    # sample_interval: seconds between stack samples of the search thread, None for no profiling
+    def __init__(self, sample_interval=None):
+        self.counters = {}
+        self.timers = {}  # name: [calls, seconds]
+        self.histograms = {}  # name: {bucket: count}, buckets are plies unless the name says otherwise
+        self.iterations = []  # per completed iteration: depth, nodes, seconds and score
+        self.samples = {}  # collapsed stack: count
+        self.sample_interval = sample_interval
+        self.seconds = 0.0
+        self.__started = None
+        self.__restore = []  # (object, attribute, value to put back or None to delete it)
+        self.__sampler = None
+        self.__stop_sampling = None
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+
+    def observe(self, name, bucket, amount=1):
+        histogram = self.histograms.setdefault(name, {})
+        histogram[bucket] = histogram.get(bucket, 0) + amount
+
+    # times calls of the methods of obj under prefix.method until stop(), the wrappers shadow the class methods.
+    # only for objects the search owns, everyone calling obj is timed
+    def instrument(self, obj, methods, prefix):
+        for method_name in methods:
+            if method_name in vars(obj):
+                continue  # already wrapped
+            setattr(obj, method_name, self.__timed(prefix + '.' + method_name, getattr(obj, method_name)))
+            self.__restore.append((obj, method_name, None))
+
+    # times calls through owner.attribute until stop() by pointing the attribute at a TimedProxy, other users of
+    # the object it refers to keep calling it untimed
+    def instrument_attribute(self, owner, attribute, methods, prefix):
+        obj = getattr(owner, attribute)
+        if isinstance(obj, TimedProxy):
+            return  # already wrapped
+        proxy = TimedProxy(obj)
+        for method_name in methods:
+            setattr(proxy, method_name, self.__timed(prefix + '.' + method_name, getattr(obj, method_name)))
+        setattr(owner, attribute, proxy)
+        self.__restore.append((owner, attribute, obj))
+
+    def __timed(self, name, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add_time(name, time.perf_counter() - start)
+        return timed
+
+    # called by the searching thread before and after a search
+    def start(self):
+        self.__started = time.perf_counter()
+        if self.sample_interval:
+            self.__stop_sampling = threading.Event()
+            self.__sampler = threading.Thread(target=self.__sample, args=(threading.get_ident(),), daemon=True)
+            self.__sampler.start()
+
+    def stop(self):
+        if self.__sampler is not None:
+            self.__stop_sampling.set()
+            self.__sampler.join()
+            self.__sampler = None
+        for obj, attribute, value in reversed(self.__restore):
+            if value is None:
+                delattr(obj, attribute)
+            else:
+                setattr(obj, attribute, value)
+        self.__restore = []
+        if self.__started is not None:
+            self.seconds += time.perf_counter() - self.__started
+            self.__started = None
+
+    def __sample(self, thread_id):
+        while not self.__stop_sampling.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append('%s:%s' % (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    # rates and ratios derived from the counters
+    def summary(self):
+        # searched nodes plus the children of frontier nodes scored in one batch, as AiMoveFinder.nodes counts them
+        nodes = sum(self.histograms.get('nodes', {}).values()) + self.counters.get('leaf_children', 0)
+        interior = sum(self.histograms.get('interior', {}).values())
+        cutoffs = sum(self.histograms.get('cutoffs', {}).values())
+        probes = self.counters.get('tt_probes', 0)
+        iteration_nodes = [b['nodes'] - a['nodes'] for a, b in zip([{'nodes': 0}] + self.iterations,
+                                                                   self.iterations)]
+        return {
+            'nodes': nodes,
+            'seconds': self.seconds,
+            'nodes_per_second': nodes / self.seconds if self.seconds > 0 else 0.0,
+            'cutoff_rate': cutoffs / interior if interior else 0.0,
+            'first_move_cutoff_rate': self.histograms.get('cutoff_move', {}).get(0, 0) / cutoffs if cutoffs else 0.0,
+            'tt_hit_rate': self.counters.get('tt_hits', 0) / probes if probes else 0.0,
+            'branching_factor': sum(self.histograms.get('moves', {}).values()) / interior if interior else 0.0,
+            # nodes of the last iteration over nodes of the one before
+            'effective_branching_factor': iteration_nodes[-1] / iteration_nodes[-2]
+            if len(iteration_nodes) > 1 and iteration_nodes[-2] > 0 else 0.0,
+        }
+
+    def to_dict(self):
+        return {
+            'summary': self.summary(),
+            'counters': dict(self.counters),
+            'timers': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.timers.items()},
+            'histograms': {name: {str(bucket): count for bucket, count in sorted(histogram.items())}
+                           for name, histogram in self.histograms.items()},
+            'iterations': list(self.iterations),
+            'samples': sum(self.samples.values()),
+        }
+
+    def to_json(self, indent=1):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    # Prometheus text exposition format
+    def to_prometheus(self, prefix='chess_search'):
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % item for item in labels)
+                lines.append('%s_%s%s %s' % (prefix, name, '{%s}' % label_text if label_text else '', repr(value)))
+
+        for name, value in sorted(self.summary().items()):
+            metric(name, 'gauge', [((), value)])
+        for name, value in sorted(self.counters.items()):
+            metric(name + '_total', 'counter', [((), value)])
+        metric('calls_total', 'counter', [((('timer', name),), calls) for name, (calls, seconds) in
+                                          sorted(self.timers.items())])
+        metric('call_seconds_total', 'counter', [((('timer', name),), seconds) for name, (calls, seconds) in
+                                                 sorted(self.timers.items())])
+        metric('histogram_total', 'counter', [((('histogram', name), ('bucket', bucket)), count)
+                                              for name, histogram in sorted(self.histograms.items())
+                                              for bucket, count in sorted(histogram.items())])
+        return '\n'.join(lines) + '\n'
+
+    # profiler samples as 'frame;frame;frame count' lines, the input of flamegraph.pl and speedscope
+    def to_collapsed(self):
+        return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(self.samples.items()))
+
+
+def print_stats(stats):
+    data = stats.to_dict()
+    for name, value in data['summary'].items():
+        print('%-28s %s' % (name, '%.3f' % value if isinstance(value, float) else value))
+    for name, value in sorted(data['counters'].items()):
+        print('%-28s %d' % (name, value))
+    for name, timer in sorted(data['timers'].items(), key=lambda item: -item[1]['seconds']):
+        print('%-28s %8d calls %8.3fs' % (name, timer['calls'], timer['seconds']))
+    for name, histogram in sorted(data['histograms'].items()):
+        print('%-28s %s' % (name, ' '.join('%s:%d' % item for item in histogram.items())))
+    for iteration in data['iterations']:
+        print('depth %(depth)d  nodes %(nodes)d  %(seconds).3fs' % iteration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='search statistics of one position')
+    parser.add_argument('--fen', help='position to search, default: start position')
+    parser.add_argument('--time', type=float, help='seconds to search')
+    parser.add_argument('--depth', type=int, help='depth to search')
+    parser.add_argument('--nodes', type=int, help='nodes to search')
+    parser.add_argument('--no-bitboards', action='store_true', help='use the 2d-list move generator')
+    parser.add_argument('--sample-interval', type=float, default=0.001, help='profiler interval in seconds')
+    parser.add_argument('--json', help='write the statistics as JSON')
+    parser.add_argument('--prometheus', help='write the statistics in Prometheus text format')
+    parser.add_argument('--profile', help='write the profiler samples as collapsed stacks')
+    args = parser.parse_args()
+
+    import AiMoveFinder
+    ai = AiMoveFinder.AiMoveFinder(stats=True, stats_sample_interval=args.sample_interval if args.profile else None)
+    gs = ChessEngine.GameState(track_one_hot=True, bitboards=not args.no_bitboards)
+    if args.fen:
+        gs.load_fen(args.fen)
+    move, stats = ai.find_best_move_with_stats(gs, gs.get_valid_moves(), args.time, args.nodes, args.depth)
+    print('best move', move.get_chess_notation() if move is not None else None)
+    print_stats(stats)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(stats.to_json())
+    if args.prometheus:
+        with open(args.prometheus, 'w') as f:
+            f.write(stats.to_prometheus())
+    if args.profile:
+        with open(args.profile, 'w') as f:
+            f.write(stats.to_collapsed())
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
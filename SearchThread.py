@@ -0,0 +1,110 @@
+"""
+    Runs AiMoveFinder searches on a background thread against a private copy of the GameState,
+    so the caller (pygame loop, UCI loop) stays responsive and can cancel a running search.
+"""
+
+import queue
+import threading
+import time
+
+import ChessEngine
+
+
+class SearchJob():
+    def __init__(self, snapshot, moves, time_limit, node_limit, max_depth, ponder_move=None, on_done=None):
+        self.snapshot = snapshot
+        self.moves = moves  # played on top of the snapshot before searching, e.g. the predicted move when pondering
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.ponder_move = ponder_move
+        self.on_done = on_done  # called with the job on the search thread when it finished and wasn't cancelled
+        self.key = None  # zobrist key of the searched position
+        self.cancelled = False
+        self.stop_requested = False  # stop() may come before the search thread picked the job up
+        self.started = None  # time.perf_counter() when the search began
+        self.done = threading.Event()
+        # results
+        self.move = None
+        self.score = None
+        self.depth = 0
+        self.nodes = 0
+        self.principal_variation = []
+
+    # result is only valid for the position it was searched for
+    def matches(self, gs):
+        return self.key == gs.zobrist_key
+
+
+class SearchThread():
+    def __init__(self, ai, bitboards=True):
+        self.ai = ai
+        self.bitboards = bitboards
+        self.jobs = queue.Queue()
+        self.current = None
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    # queue a search of gs (plus moves played on top of it), returns the job to poll
+    def start(self, gs, time_limit=None, node_limit=None, max_depth=None, moves=(), ponder_move=None, on_done=None):
+        job = SearchJob(gs.get_snapshot(), list(moves), time_limit, node_limit, max_depth, ponder_move, on_done)
+        self.jobs.put(job)
+        return job
+
+    # drops the job, a running search is stopped and its result ignored
+    def cancel(self, job):
+        if job is None:
+            return
+        job.cancelled = True
+        self.stop(job)
+
+    # ends the search of job early, it still delivers the best move found so far
+    def stop(self, job):
+        job.stop_requested = True
+        if self.current is job:
+            self.ai.stop()
+
+    # the predicted move was played: the ponder search gets time_limit seconds counted from its start
+    def ponder_hit(self, job, time_limit):
+        job.time_limit = time_limit  # used if the search hasn't started yet
+        started = job.started if job.started is not None else time.perf_counter()
+        timer = threading.Timer(max(started + time_limit - time.perf_counter(), 0), self.stop, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def __run(self):
+        while True:
+            job = self.jobs.get()
+            # clear the flag before publishing current, a stop() from then on reaches the ai,
+            # one that came earlier is on the job
+            self.ai.stop_requested = False
+            self.current = job
+            if job.stop_requested:
+                self.ai.stop()
+            if not job.cancelled:
+                self.__search(job)
+            self.current = None
+            # before done is set, so whoever waits for the job sees its on_done (e.g. the uci bestmove) finished
+            if job.on_done is not None and not job.cancelled:
+                job.on_done(job)
+            job.done.set()
+
+    def __search(self, job):
+        gs = ChessEngine.GameState(track_one_hot=True, bitboards=self.bitboards)
+        gs.load_snapshot(job.snapshot)
+        for move in job.moves:
+            gs.make_move(next(valid for valid in gs.get_valid_moves() if valid == move))
+        job.key = gs.zobrist_key
+        valid_moves = gs.get_valid_moves()
+        if len(valid_moves) == 0:
+            return
+        job.started = time.perf_counter()
+        job.move = self.ai.find_best_move_iterative(gs, valid_moves, time_limit=job.time_limit,
+                                                    node_limit=job.node_limit, max_depth=job.max_depth)
+        job.score = self.ai.best_score
+        job.depth = self.ai.completed_depth
+        job.nodes = self.ai.nodes
+        if job.depth == 0:
+            job.principal_variation = [job.move]  # book move, nothing was searched
+        elif hasattr(self.ai, 'get_principal_variation'):
+            job.principal_variation = self.ai.get_principal_variation(gs)
@@ -0,0 +1,271 @@
+"""
+ Headless engine-vs-engine matches: plays games in parallel over a process pool, streams them to a PGN file as they
+ finish and prints throughput and win/draw/loss stats. Engine A and B can use different search limits, every
+ opening is played twice with colours swapped.
+
+ python SelfPlay.py --games 100 --processes 4 --time 0.2 --pgn games.pgn
+ python SelfPlay.py --games 20 --depth 2 --depth-b 3 --openings openings.txt
+
+ openings file: one opening per line, uci moves from the start position ("e2e4 e7e5") or a FEN,
+ optionally followed by "moves" and uci moves
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import ChessEngine
+import Pgn
+import UciEngine
+from ScoreScale import reported_centipawns
+
+# opening lines in uci moves from the start position, used when no openings file is given
+DEFAULT_OPENINGS = [
+    'e2e4 e7e5 g1f3 b8c6',
+    'e2e4 c7c5 g1f3 d7d6',
+    'e2e4 e7e6 d2d4 d7d5',
+    'e2e4 c7c6 d2d4 d7d5',
+    'd2d4 d7d5 c2c4 e7e6',
+    'd2d4 g8f6 c2c4 g7g6',
+    'd2d4 g8f6 c2c4 e7e6',
+    'c2c4 e7e5 b1c3 g8f6',
+    'g1f3 d7d5 d2d4 g8f6',
+    'e2e4 d7d5 e4d5 d8d5',
+]
+
+worker_ai = None  # AiMoveFinder of engine A in a worker process, loaded once
+worker_ai_b = None  # engine B: its own table, history and killers, A's network, cache, book and tables
+
+
+def _init_worker(ai_options):
+    global worker_ai, worker_ai_b
+    import AiMoveFinder
+    worker_ai = AiMoveFinder.AiMoveFinder(**ai_options)
+    shared = ('eval_cache', 'book', 'endgame_tables', 'precision', 'backend')
+    options_b = {key: value for key, value in ai_options.items() if key not in shared}
+    worker_ai_b = AiMoveFinder.AiMoveFinder(model=worker_ai.model, **options_b)
+    worker_ai_b.eval_cache = worker_ai.eval_cache
+    worker_ai_b.book = worker_ai.book
+    worker_ai_b.endgame_tables = worker_ai.endgame_tables
+
+
+# opening line -> (fen or None, list of uci moves)
+def parse_opening(line):
+    line = line.strip()
+    if 'moves' in line.split():
+        position, moves = line.split('moves', 1)
+        return position.strip() or None, moves.split()
+    if '/' in line:
+        return line, []
+    return None, line.split()
+
+
+def load_openings(path):
+    with open(path) as f:
+        return [parse_opening(line) for line in f if line.strip() and not line.startswith('#')]
+
+
+# limits of one engine: dict with time_limit, node_limit, max_depth
+def engine_limits(time_limit=None, node_limit=None, max_depth=None):
+    return {'time_limit': time_limit, 'node_limit': node_limit, 'max_depth': max_depth}
+
+
+# adjudication settings, scores in centipawns from white's point of view
+def adjudication_rules(max_plies=300, resign_cp=1000, resign_plies=6, draw_cp=10, draw_plies=12, draw_start=80):
+    return {'max_plies': max_plies, 'resign_cp': resign_cp, 'resign_plies': resign_plies, 'draw_cp': draw_cp,
+            'draw_plies': draw_plies, 'draw_start': draw_start}
+
+
+def insufficient_material(board):
+    pieces = [piece for row in board for piece in row if piece != '--' and piece[1] != 'K']
+    return len(pieces) == 0 or (len(pieces) == 1 and pieces[0][1] in 'NB')
+
+
+# plays one game in the worker, returns a result dict. task = (game number, opening, a plays white,
+# limits of a, limits of b, adjudication rules, bitboards)
+def play_game(task):
+    number, (fen, opening_moves), a_is_white, limits_a, limits_b, rules, bitboards = task
+    # a new game, old positions only fill the tables
+    for ai in (worker_ai, worker_ai_b):
+        ai.transposition_table.clear()
+        ai.history = {}
+    gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+    if fen is not None:
+        gs.load_fen(fen)
+    start_white_to_move = gs.white_to_move
+    san_moves = []
+    scores = []  # score of the search before each move, white's point of view, None for opening and book moves
+    for text in opening_moves:
+        move = UciEngine.uci_to_move(gs, text)
+        if move is None:
+            raise ValueError('illegal opening move %s in game %d' % (text, number))
+        san_moves.append(Pgn.move_to_san(gs, move))
+        scores.append(None)
+        gs.make_move(move)
+    repetitions = {gs.zobrist_key: 1}
+    halfmove_clock = 0
+    resign_count = {'white': 0, 'black': 0}
+    draw_count = 0
+    move_seconds = []
+    nodes = 0
+    result, termination = None, None
+    while result is None:
+        valid_moves = gs.get_valid_moves()
+        if gs.check_mate:
+            result, termination = ('0-1' if gs.white_to_move else '1-0'), 'checkmate'
+            break
+        if gs.stale_mate:
+            result, termination = '1/2-1/2', 'stalemate'
+            break
+        if insufficient_material(gs.board):
+            result, termination = '1/2-1/2', 'insufficient material'
+            break
+        if halfmove_clock >= 100:
+            result, termination = '1/2-1/2', 'fifty move rule'
+            break
+        if len(gs.moveLog) >= rules['max_plies']:
+            result, termination = '1/2-1/2', 'adjudication: move limit'
+            break
+        ai, limits = (worker_ai, limits_a) if gs.white_to_move == a_is_white else (worker_ai_b, limits_b)
+        start = time.perf_counter()
+        move = ai.find_best_move_iterative(gs, valid_moves, **limits)
+        move_seconds.append(time.perf_counter() - start)
+        nodes += ai.nodes
+        san_moves.append(Pgn.move_to_san(gs, move, valid_moves))
+        scores.append(float(ai.best_score) if ai.best_score is not None else None)
+        halfmove_clock = 0 if move.piece_moved[1] == 'p' or move.piece_captured != '--' else halfmove_clock + 1
+        gs.make_move(move)
+        repetitions[gs.zobrist_key] = repetitions.get(gs.zobrist_key, 0) + 1
+        if repetitions[gs.zobrist_key] >= 3:
+            result, termination = '1/2-1/2', 'threefold repetition'
+            break
+        # adjudication on the score of the search, white's point of view
+        if ai.best_score is None:
+            continue
+        centipawns = reported_centipawns(ai.best_score, True)
+        for side, losing in (('white', centipawns <= -rules['resign_cp']), ('black', centipawns >= rules['resign_cp'])):
+            resign_count[side] = resign_count[side] + 1 if losing else 0
+            if resign_count[side] >= rules['resign_plies']:
+                result, termination = ('0-1' if side == 'white' else '1-0'), 'adjudication: resign score'
+        draw_count = draw_count + 1 if abs(centipawns) <= rules['draw_cp'] else 0
+        if result is None and len(gs.moveLog) >= rules['draw_start'] and draw_count >= rules['draw_plies']:
+            result, termination = '1/2-1/2', 'adjudication: draw score'
+    headers = {'Event': 'SelfPlay', 'Round': number + 1, 'White': 'A' if a_is_white else 'B',
+               'Black': 'B' if a_is_white else 'A', 'Termination': termination}
+    if fen is not None:
+        headers['SetUp'] = '1'
+        headers['FEN'] = fen
+    pgn = Pgn.game_to_pgn(headers, san_moves, result, start_white_to_move)
+    if result == '1/2-1/2':
+        score_a = 0.5
+    else:
+        score_a = 1.0 if (result == '1-0') == a_is_white else 0.0
+    return {'number': number, 'pgn': pgn, 'result': result, 'termination': termination, 'score_a': score_a,
+            'plies': len(gs.moveLog), 'move_seconds': move_seconds, 'nodes': nodes, 'san_moves': san_moves,
+            'scores': scores}
+
+
+def run_match(games, openings, limits_a, limits_b, rules, processes=None, pgn_path=None, bitboards=True,
+              ai_options=None, verbose=True):
+    tasks = []
+    for number in range(games):
+        # each opening twice in a row, with colours swapped
+        opening = openings[(number // 2) % len(openings)]
+        tasks.append((number, opening, number % 2 == 0, limits_a, limits_b, rules, bitboards))
+    processes = min(processes or os.cpu_count() or 1, max(games, 1))
+    # spawn: workers start clean instead of forking a parent that may already run keras
+    context = multiprocessing.get_context('spawn')
+    results = []
+    start = time.perf_counter()
+    pgn_file = open(pgn_path, 'a') if pgn_path else None
+    try:
+        with context.Pool(processes, initializer=_init_worker, initargs=(ai_options or {},)) as pool:
+            for result in pool.imap_unordered(play_game, tasks):
+                results.append(result)
+                if pgn_file is not None:
+                    pgn_file.write(result['pgn'])
+                    pgn_file.flush()
+                if verbose:
+                    print('game %d: %s (%s), %d plies' % (result['number'] + 1, result['result'],
+                                                          result['termination'], result['plies']))
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+    return summarize(results, time.perf_counter() - start)
+
+
+def summarize(results, seconds):
+    move_seconds = [t for result in results for t in result['move_seconds']]
+    wins = sum(1 for result in results if result['score_a'] == 1.0)
+    losses = sum(1 for result in results if result['score_a'] == 0.0)
+    nodes = sum(result['nodes'] for result in results)
+    return {'games': len(results), 'seconds': seconds,
+            'games_per_second': len(results) / seconds if seconds > 0 else 0.0,
+            'moves': len(move_seconds),
+            'average_move_seconds': sum(move_seconds) / len(move_seconds) if move_seconds else 0.0,
+            'nodes_per_second': nodes / sum(move_seconds) if move_seconds and sum(move_seconds) > 0 else 0.0,
+            'wins': wins, 'draws': len(results) - wins - losses, 'losses': losses,
+            'score': sum(result['score_a'] for result in results) / len(results) if results else 0.0}
+
+
+def print_summary(summary):
+    print('games %d in %.1fs  %.3f games/s' % (summary['games'], summary['seconds'], summary['games_per_second']))
+    print('moves %d  average move %.1fms  %.0f nodes/s per process' % (
+        summary['moves'], summary['average_move_seconds'] * 1000, summary['nodes_per_second']))
+    print('engine A: +%d =%d -%d  score %.1f%%' % (summary['wins'], summary['draws'], summary['losses'],
+                                                  summary['score'] * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='engine vs engine self-play')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--processes', type=int, help='worker processes, default: number of cpus')
+    parser.add_argument('--openings', help='file with one opening per line, default: built-in openings')
+    parser.add_argument('--pgn', help='append finished games to this PGN file')
+    parser.add_argument('--time', type=float, help='seconds per move of engine A (and B unless --time-b)')
+    parser.add_argument('--depth', type=int, help='search depth of engine A (and B unless --depth-b)')
+    parser.add_argument('--nodes', type=int, help='nodes per move of engine A (and B unless --nodes-b)')
+    parser.add_argument('--time-b', type=float)
+    parser.add_argument('--depth-b', type=int)
+    parser.add_argument('--nodes-b', type=int)
+    parser.add_argument('--max-plies', type=int, default=300, help='draw after this many plies')
+    parser.add_argument('--resign-cp', type=int, default=1000, help='adjudicate a loss beyond this score')
+    parser.add_argument('--resign-plies', type=int, default=6, help='plies the resign score has to hold')
+    parser.add_argument('--draw-cp', type=int, default=10, help='adjudicate a draw within this score')
+    parser.add_argument('--draw-plies', type=int, default=12, help='plies the draw score has to hold')
+    parser.add_argument('--draw-start', type=int, default=80, help='no draw adjudication before this ply')
+    parser.add_argument('--no-bitboards', action='store_true', help='use the 2d-list move generator')
+    parser.add_argument('--eval-cache', help='evaluation cache file shared by the workers')
+    parser.add_argument('--book', help='opening book both engines play from')
+    parser.add_argument('--tables', help='endgame table directory both engines probe')
+    parser.add_argument('--precision', choices=('float32', 'float16', 'int8'), default='float32',
+                        help='precision of the network weights')
+    args = parser.parse_args()
+
+    openings = load_openings(args.openings) if args.openings else [parse_opening(line) for line in DEFAULT_OPENINGS]
+    if not openings:
+        parser.error('no openings')
+    limits_a = engine_limits(args.time, args.nodes, args.depth)
+    limits_b = engine_limits(args.time_b if args.time_b is not None else args.time,
+                             args.nodes_b if args.nodes_b is not None else args.nodes,
+                             args.depth_b if args.depth_b is not None else args.depth)
+    rules = adjudication_rules(args.max_plies, args.resign_cp, args.resign_plies, args.draw_cp, args.draw_plies,
+                               args.draw_start)
+    ai_options = {}
+    if args.eval_cache:
+        ai_options['eval_cache'] = args.eval_cache
+    if args.book:
+        ai_options['book'] = args.book
+    if args.tables:
+        ai_options['endgame_tables'] = args.tables
+    if args.precision != 'float32':
+        ai_options['precision'] = args.precision
+    summary = run_match(args.games, openings, limits_a, limits_b, rules, args.processes, args.pgn,
+                        not args.no_bitboards, ai_options)
+    print_summary(summary)
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
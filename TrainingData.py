@@ -0,0 +1,315 @@
+"""
+ Training data for the value network: positions of self-play games or PGN files, labelled with the score of the
+ engine's search and the result of the game. Positions are encoded like the network input (8, 8, 12, rank 1 first,
+ see ChessEngine.ONE_HOT_CHANNELS), as packed bits or uint8, and appended to fixed-size memory-mapped .npy shards.
+ index.json lists the shards and how many records each holds, so a directory can be extended by later runs.
+
+ Games are played or replayed by a pool of worker processes, at most a few games per process are in flight so
+ memory stays bounded however long the run is. TrainingData reads the shards back without copying them and
+ yields batches for retraining.
+
+ python TrainingData.py data --self-play 200 --time 0.1 --processes 4
+ python TrainingData.py data --pgn games.pgn more.pgn --depth 2
+ python TrainingData.py data --info
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+import ChessEngine
+import Pgn
+import SelfPlay
+
+SHARD_SIZE = 2 ** 16  # records per shard
+INDEX_FILE = 'index.json'
+RESULT_SCORES = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}  # white's point of view
+GAMES_PER_PROCESS = 2  # games in flight per worker process
+
+worker_ai = None  # one AiMoveFinder per worker process, loaded once
+
+
+# one record per position: encoded board, search score and game result from white's point of view (NaN when
+# unknown) and the zobrist key of the position
+def record_dtype(packed=True):
+    planes = ('planes', 'u1', (8 * 8 * 12 // 8,)) if packed else ('planes', 'u1', (8, 8, 12))
+    return np.dtype([planes, ('score', '<f4'), ('result', '<f4'), ('key', '<u8')])
+
+
+# one hot planes as stored in a record
+def encode(one_hot, packed=True):
+    planes = one_hot.astype(np.uint8)
+    return np.packbits(planes.reshape(-1)) if packed else planes
+
+
+# stored planes of one or more records -> network input, shape (n, 8, 8, 12) float32
+def decode(planes, packed=True):
+    if packed:
+        planes = np.unpackbits(planes, axis=-1)
+    return planes.reshape(-1, 8, 8, 12).astype(np.float32)
+
+
+def read_index(directory):
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+# appends records to the shards of a directory, the index is rewritten by flush
+class ShardWriter():
+    def __init__(self, directory, shard_size=SHARD_SIZE, packed=True):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, INDEX_FILE)):
+            self.index = read_index(directory)
+            if self.index['packed'] != packed:
+                raise ValueError('%s holds %s records' % (directory, 'packed' if self.index['packed'] else 'uint8'))
+        else:
+            self.index = {'version': 1, 'packed': packed, 'shard_size': shard_size, 'shards': []}
+        self.dtype = record_dtype(self.index['packed'])
+        self.shard = None
+        shards = self.index['shards']
+        # continue in the last shard when it has room left
+        if shards and shards[-1]['count'] < shards[-1]['size']:
+            self.shard = np.load(os.path.join(directory, shards[-1]['file']), mmap_mode='r+')
+
+    def __len__(self):
+        return sum(shard['count'] for shard in self.index['shards'])
+
+    def __new_shard(self):
+        if self.shard is not None:
+            self.shard.flush()
+        shards = self.index['shards']
+        name = 'shard-%05d.npy' % len(shards)
+        size = self.index['shard_size']
+        self.shard = np.lib.format.open_memmap(os.path.join(self.directory, name), mode='w+', dtype=self.dtype,
+                                               shape=(size,))
+        shards.append({'file': name, 'size': size, 'count': 0})
+
+    # records: structured array of record_dtype
+    def append(self, records):
+        done = 0
+        while done < len(records):
+            if self.shard is None or self.index['shards'][-1]['count'] == len(self.shard):
+                self.__new_shard()
+            info = self.index['shards'][-1]
+            count = min(len(records) - done, len(self.shard) - info['count'])
+            self.shard[info['count']:info['count'] + count] = records[done:done + count]
+            info['count'] += count
+            done += count
+
+    # writes the shards and then the index, a crash leaves an index that only lists flushed records
+    def flush(self):
+        if self.shard is not None:
+            self.shard.flush()
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self.flush()
+        self.shard = None
+
+
+# read-only view of the records of a directory, the shards are memory-mapped and never copied as a whole
+class TrainingData():
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = read_index(directory)
+        self.packed = self.index['packed']
+        self.shards = [np.load(os.path.join(directory, shard['file']), mmap_mode='r')[:shard['count']]
+                       for shard in self.index['shards'] if shard['count'] > 0]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    # label of records: 'score' is the search score where there is one and the game result otherwise,
+    # 'result' is the game result (NaN where it is unknown)
+    @staticmethod
+    def labels(records, label='score'):
+        if label == 'result':
+            return records['result']
+        scores = records['score']
+        return np.where(np.isnan(scores), records['result'], scores)
+
+    # slices of at most batch_size consecutive records, views into the shards. shuffle: in random order
+    def record_batches(self, batch_size=256, shuffle=False, seed=None):
+        slices = [(shard, start) for shard in self.shards for start in range(0, len(shard), batch_size)]
+        if shuffle:
+            np.random.default_rng(seed).shuffle(slices)
+        for shard, start in slices:
+            yield shard[start:start + batch_size]
+
+    # (inputs, labels) batches for model.fit or train_on_batch, inputs shaped like the network input.
+    # only unpacking the bits copies, uint8 records are cast by the consumer
+    def batches(self, batch_size=256, label='score', shuffle=False, seed=None):
+        for records in self.record_batches(batch_size, shuffle, seed):
+            planes = decode(records['planes']) if self.packed else records['planes']
+            yield planes, self.labels(records, label)
+
+
+def _init_worker(ai_options, needs_ai):
+    global worker_ai
+    if needs_ai:
+        SelfPlay._init_worker(ai_options)
+        worker_ai = SelfPlay.worker_ai
+
+
+# replays a game and encodes the position before every move and the final position, scores: search score of the
+# position before each move or None. positions without score and without result are left out
+def game_records(fen, san_moves, scores, result, packed=True, bitboards=True):
+    gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+    if fen is not None:
+        gs.load_fen(fen)
+    result_score = RESULT_SCORES.get(result, np.nan)
+    rows = []
+    for i in range(len(san_moves) + 1):
+        score = scores[i] if i < len(scores) and scores[i] is not None else np.nan
+        if not (np.isnan(score) and np.isnan(result_score)):
+            rows.append((encode(gs.one_hot, packed), score, result_score, gs.zobrist_key))
+        if i == len(san_moves):
+            break
+        try:
+            gs.make_move(Pgn.san_to_move(gs, san_moves[i]))
+        except ValueError:
+            break  # rest of a broken game is skipped
+    return np.array(rows, dtype=record_dtype(packed))
+
+
+# worker: plays one SelfPlay game, task = (SelfPlay task, packed)
+def self_play_records(task):
+    game_task, packed = task
+    game = SelfPlay.play_game(game_task)
+    fen = game_task[1][0]
+    return game_records(fen, game['san_moves'], game['scores'], game['result'], packed, game_task[-1])
+
+
+# worker: one PGN game, task = ((headers, san moves, result), search depth or None, packed, bitboards)
+def pgn_records(task):
+    (headers, san_moves, result), depth, packed, bitboards = task
+    scores = []
+    if depth is not None:
+        ai = worker_ai
+        ai.transposition_table.clear()
+        gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+        if 'FEN' in headers:
+            gs.load_fen(headers['FEN'])
+        for san in san_moves:
+            scores.append(float(ai.search_position(gs, depth)) if gs.get_valid_moves() else None)
+            try:
+                gs.make_move(Pgn.san_to_move(gs, san))
+            except ValueError:
+                break
+    return game_records(headers.get('FEN'), san_moves, scores, result, packed, bitboards)
+
+
+# results of function over tasks in task order, with at most window tasks submitted and not yet consumed
+def _bounded_map(pool, function, tasks, window):
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def generate(directory, function, tasks, processes=None, shard_size=SHARD_SIZE, packed=True, ai_options=None,
+             needs_ai=True, verbose=True):
+    processes = processes or os.cpu_count() or 1
+    writer = ShardWriter(directory, shard_size, packed)
+    # spawn: workers start clean instead of forking a parent that may already run keras
+    context = multiprocessing.get_context('spawn')
+    games = 0
+    try:
+        with context.Pool(processes, initializer=_init_worker, initargs=(ai_options or {}, needs_ai)) as pool:
+            for records in _bounded_map(pool, function, tasks, processes * GAMES_PER_PROCESS):
+                shards = len(writer.index['shards'])
+                writer.append(records)
+                games += 1
+                if len(writer.index['shards']) != shards:
+                    writer.flush()  # a shard was filled
+                if verbose:
+                    print('game %d: %d positions, %d in total' % (games, len(records), len(writer)))
+    finally:
+        writer.close()
+    return games, len(writer)
+
+
+def self_play_tasks(games, limits, openings=None, bitboards=True, packed=True):
+    openings = openings or [SelfPlay.parse_opening(line) for line in SelfPlay.DEFAULT_OPENINGS]
+    rules = SelfPlay.adjudication_rules()
+    for number in range(games):
+        opening = openings[(number // 2) % len(openings)]
+        yield (number, opening, number % 2 == 0, limits, limits, rules, bitboards), packed
+
+
+def pgn_tasks(paths, depth=None, bitboards=True, packed=True):
+    for path in paths:
+        with open(path) as f:
+            for game in Pgn.read_games(f):
+                yield game, depth, packed, bitboards
+
+
+def print_info(directory):
+    data = TrainingData(directory)
+    print('%d records in %d shards, %s' % (len(data), len(data.index['shards']),
+                                           'packed bits' if data.packed else 'uint8'))
+    scored = sum(int(np.count_nonzero(~np.isnan(shard['score']))) for shard in data.shards)
+    results = [int(np.count_nonzero(shard['result'] == value)) for shard in data.shards for value in (1.0, 0.5, 0.0)]
+    print('with search score %d  white wins %d  draws %d  black wins %d' % (scored, sum(results[0::3]),
+                                                                           sum(results[1::3]), sum(results[2::3])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='training data for the value network')
+    parser.add_argument('directory', help='directory of the shards, extended when it exists')
+    parser.add_argument('--self-play', type=int, metavar='GAMES', help='play this many games')
+    parser.add_argument('--pgn', nargs='+', help='positions of the games in these PGN files')
+    parser.add_argument('--info', action='store_true', help='print what the directory holds')
+    parser.add_argument('--time', type=float, help='seconds per self-play move')
+    parser.add_argument('--depth', type=int, help='search depth of self-play moves or of PGN position scores')
+    parser.add_argument('--nodes', type=int, help='nodes per self-play move')
+    parser.add_argument('--openings', help='self-play openings file, default: SelfPlay openings')
+    parser.add_argument('--processes', type=int, help='worker processes, default: number of cpus')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='records per new shard')
+    parser.add_argument('--uint8', action='store_true', help='store one byte per plane instead of packed bits')
+    parser.add_argument('--no-bitboards', action='store_true', help='use the 2d-list move generator')
+    parser.add_argument('--eval-cache', help='evaluation cache file shared by the workers')
+    parser.add_argument('--tables', help='endgame table directory')
+    parser.add_argument('--precision', choices=('float32', 'float16', 'int8'), default='float32',
+                        help='precision of the network weights')
+    args = parser.parse_args()
+
+    ai_options = {}
+    if args.eval_cache:
+        ai_options['eval_cache'] = args.eval_cache
+    if args.tables:
+        ai_options['endgame_tables'] = args.tables
+    if args.precision != 'float32':
+        ai_options['precision'] = args.precision
+    bitboards = not args.no_bitboards
+    packed = not args.uint8
+    if args.self_play:
+        openings = SelfPlay.load_openings(args.openings) if args.openings else None
+        tasks = self_play_tasks(args.self_play, SelfPlay.engine_limits(args.time, args.nodes, args.depth), openings,
+                                bitboards, packed)
+        games, records = generate(args.directory, self_play_records, tasks, args.processes, args.shard_size, packed,
+                                  ai_options)
+        print('%d games, %d records in %s' % (games, records, args.directory))
+    if args.pgn:
+        tasks = pgn_tasks(args.pgn, args.depth, bitboards, packed)
+        games, records = generate(args.directory, pgn_records, tasks, args.processes, args.shard_size, packed,
+                                  ai_options, needs_ai=args.depth is not None)
+        print('%d games, %d records in %s' % (games, records, args.directory))
+    if args.info or not (args.self_play or args.pgn):
+        print_info(args.directory)
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
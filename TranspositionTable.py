@@ -0,0 +1,43 @@
+"""
+    Fixed size hash table for search results, indexed by the zobrist key of GameState.
+"""
+
+
+class TranspositionTable():
+    # bound types of a stored score
+    EXACT = 0
+    LOWER_BOUND = 1  # search failed high, real score >= stored score
+    UPPER_BOUND = 2  # search failed low, real score <= stored score
+
+    def __init__(self, size=2 ** 20):
+        # number of slots is rounded down to a power of two, so the index is key & mask
+        size = 1 << (max(size, 1).bit_length() - 1)
+        self.mask = size - 1
+        # each slot holds one tuple: (key, depth, bound, score, best_move, age)
+        self.entries = [None] * size
+        self.age = 0
+
+    # call once per root search, so entries of earlier searches get replaced first
+    def new_search(self):
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None] * len(self.entries)
+        self.age = 0
+
+    # returns stored tuple for key or None
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    # replacement: empty slot, same position, entry of an older search or not deeper than the new one
+    def store(self, key, depth, bound, score, best_move):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is not None and entry[0] != key and entry[5] == self.age and entry[1] > depth:
+            return
+        if entry is not None and entry[0] == key and best_move is None:
+            best_move = entry[4]  # keep known best move when the new search didn't find one
+        self.entries[index] = (key, depth, bound, score, best_move, self.age)
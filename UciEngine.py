@@ -0,0 +1,193 @@
+"""
+ Headless UCI front end: reads UCI commands on stdin and answers on stdout, so the engine can run under a match
+ manager or in batch jobs without a display. Doesn't import pygame.
+
+ python UciEngine.py
+
+ supported: uci, isready, ucinewgame, position startpos/fen ... moves ..., go wtime/btime/winc/binc/movestogo/
+ movetime/depth/nodes/infinite, stop, quit
+"""
+
+import sys
+import threading
+import time
+
+import ChessEngine
+import AiMoveFinder
+import SearchThread
+from ScoreScale import reported_centipawns
+
+ENGINE_NAME = 'Chess AI'
+ENGINE_AUTHOR = 'Chess AI contributors'
+BITBOARDS = True
+MOVE_OVERHEAD = 0.05  # seconds kept back per move for communication with the gui
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining time is spread over when the gui doesn't send movestogo
+
+
+# uci move string of a move, promotions are always to a queen
+def move_to_uci(move):
+    return move.get_chess_notation() + ('q' if move.is_pawn_promotion else '')
+
+
+# valid move of gs that matches the uci move string, None if there is none. promotion pieces are ignored,
+# the engine only promotes to a queen
+def uci_to_move(gs, text):
+    if len(text) < 4 or text[0] not in ChessEngine.Move.files_to_cols or text[2] not in ChessEngine.Move.files_to_cols \
+            or text[1] not in ChessEngine.Move.ranks_to_rows or text[3] not in ChessEngine.Move.ranks_to_rows:
+        return None
+    start = (ChessEngine.Move.ranks_to_rows[text[1]], ChessEngine.Move.files_to_cols[text[0]])
+    end = (ChessEngine.Move.ranks_to_rows[text[3]], ChessEngine.Move.files_to_cols[text[2]])
+    move = ChessEngine.Move(start, end, gs.board)
+    return next((valid for valid in gs.get_valid_moves() if valid == move), None)
+
+
+class UciEngine():
+    def __init__(self, ai=None, bitboards=BITBOARDS, output=sys.stdout):
+        self.ai = ai if ai is not None else AiMoveFinder.AiMoveFinder()
+        self.ai.on_iteration = self.__send_info
+        self.bitboards = bitboards
+        self.output = output
+        self.output_lock = threading.Lock()  # search thread and input loop both write
+        self.search = SearchThread.SearchThread(self.ai, bitboards=bitboards)
+        self.gs = ChessEngine.GameState(bitboards=bitboards)
+        self.job = None
+        self.search_started = None
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    # handles one line of input, returns False on quit
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send('id name ' + ENGINE_NAME)
+            self.send('id author ' + ENGINE_AUTHOR)
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.__wait_for_search()
+            self.ai.transposition_table.clear()
+            self.ai.history = {}
+            self.gs = ChessEngine.GameState(bitboards=self.bitboards)
+        elif command == 'position':
+            self.__wait_for_search()
+            self.__set_position(args)
+        elif command == 'go':
+            self.__wait_for_search()
+            self.__go(args)
+        elif command == 'stop':
+            self.__wait_for_search()
+        elif command == 'quit':
+            self.__wait_for_search()
+            return False
+        return True
+
+    def run(self, lines=sys.stdin):
+        for line in lines:
+            if not self.handle(line):
+                return
+        # input closed without quit: a running search is stopped and still sends its bestmove, as on quit
+        self.__wait_for_search()
+
+    # stops a running search and waits for its bestmove
+    def __wait_for_search(self):
+        if self.job is not None:
+            self.search.stop(self.job)
+            self.job.done.wait()
+            self.job = None
+
+    def __set_position(self, args):
+        if 'moves' in args:
+            moves = args[args.index('moves') + 1:]
+            args = args[:args.index('moves')]
+        else:
+            moves = []
+        gs = ChessEngine.GameState(bitboards=self.bitboards)
+        if args and args[0] == 'fen':
+            try:
+                gs.load_fen(' '.join(args[1:]))
+            except ValueError as e:
+                self.send('info string invalid fen: ' + str(e))
+                return
+        for text in moves:
+            move = uci_to_move(gs, text)
+            if move is None:
+                self.send('info string illegal move: ' + text)
+                break
+            gs.make_move(move)
+        self.gs = gs
+
+    def __go(self, args):
+        options = {}
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite', 'ponder'):
+                options[args[i]] = True
+                i += 1
+            elif i + 1 < len(args):
+                try:
+                    options[args[i]] = int(args[i + 1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+        node_limit = options.get('nodes')
+        max_depth = options.get('depth')
+        time_limit = None if options.get('infinite') else self.__time_limit(options)
+        if time_limit is None and node_limit is None and max_depth is None:
+            max_depth = AiMoveFinder.AiMoveFinder.MAX_DEPTH  # infinite: searches until stop
+        self.search_started = time.perf_counter()
+        self.job = self.search.start(self.gs, time_limit=time_limit, node_limit=node_limit, max_depth=max_depth,
+                                     on_done=self.__send_best_move)
+
+    # seconds for this move from movetime or the clock, None when neither was sent
+    def __time_limit(self, options):
+        if 'movetime' in options:
+            return max(options['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+        remaining = options.get('wtime' if self.gs.white_to_move else 'btime')
+        if remaining is None:
+            return None
+        increment = options.get('winc' if self.gs.white_to_move else 'binc', 0) / 1000
+        moves_to_go = options.get('movestogo', DEFAULT_MOVES_TO_GO)
+        remaining = remaining / 1000
+        time_limit = remaining / max(moves_to_go, 1) + increment * 0.8
+        # never plan to use more than half of the clock
+        return max(min(time_limit, remaining / 2) - MOVE_OVERHEAD, 0.01)
+
+    # search thread: after every completed iteration
+    def __send_info(self, gs):
+        seconds = max(time.perf_counter() - self.search_started, 1e-6)
+        line = 'info depth %d nodes %d nps %d time %d' % (self.ai.completed_depth, self.ai.nodes,
+                                                          self.ai.nodes / seconds, seconds * 1000)
+        if self.ai.best_score is not None:
+            line += ' score cp %d' % reported_centipawns(self.ai.best_score, gs.white_to_move)
+        if hasattr(self.ai, 'get_principal_variation'):
+            principal_variation = self.ai.get_principal_variation(gs)
+            if principal_variation:
+                line += ' pv ' + ' '.join(move_to_uci(move) for move in principal_variation)
+        self.send(line)
+
+    # search thread: the search finished or was stopped
+    def __send_best_move(self, job):
+        if job.move is None:
+            self.send('bestmove 0000')
+        elif len(job.principal_variation) > 1 and job.principal_variation[0] == job.move:
+            self.send('bestmove %s ponder %s' % (move_to_uci(job.move), move_to_uci(job.principal_variation[1])))
+        else:
+            self.send('bestmove ' + move_to_uci(job.move))
+
+
+def main():
+    UciEngine().run()
+
+
+# convention for using main
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+ pytest setup: the tests import the engine modules from the repository root and, like the programs, find
+ models/ and images/ relative to the working directory.
+
+ python -m pytest tests
+"""
+
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse=True)
+def repository_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
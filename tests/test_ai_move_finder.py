@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import AiMoveFinder
+import ChessEngine
+from ScoreScale import centipawns_to_score
+
+
+# network that scores every position as a white loss, so no move ever improves on white's initial score
+class LosingModel():
+    def predict(self, x, batch_size=None, verbose=0):
+        return np.zeros((len(x), 1), dtype=np.float32)
+
+
+def test_search_position_with_empty_window():
+    ai = AiMoveFinder.AiMoveFinder(model=LosingModel(), futility_margin=None)
+    gs = ChessEngine.GameState(track_one_hot=True)
+    for depth in (1, 2):
+        assert ai.search_position(gs, depth, alpha=0.5, beta=0.5) is not None
+        assert ai.search_position(gs, depth, alpha=0.6, beta=0.4) is not None
+
+
+# network that agrees with the static evaluation, so a leaf kept at its static score has the network's score
+class StaticEvalModel():
+    def __init__(self):
+        self.weights = np.zeros((8, 8, 12))
+        for piece, channel in ChessEngine.ONE_HOT_CHANNELS.items():
+            for r in range(8):
+                for c in range(8):
+                    self.weights[7 - r, c, channel] = ChessEngine.PIECE_SQUARE_VALUES[piece][r][c]
+        self.rows = 0  # positions sent to the network
+
+    def predict(self, x, batch_size=None, verbose=0):
+        self.rows += len(x)
+        centipawns = (np.asarray(x) * self.weights).sum(axis=(1, 2, 3))
+        return np.array([[centipawns_to_score(value)] for value in centipawns])
+
+
+def search(fen, futility_margin, depth, alpha, beta):
+    model = StaticEvalModel()
+    ai = AiMoveFinder.AiMoveFinder(model=model, futility_margin=futility_margin, tt_size=2 ** 10)
+    gs = ChessEngine.GameState(track_one_hot=True)
+    gs.load_fen(fen)
+    return ai.search_position(gs, depth, alpha, beta), model.rows
+
+
+def test_lopsided_position_skips_the_network():
+    fen = '4k3/8/8/8/8/8/8/Q3K3 w - - 0 1'  # a queen up, far above an even window
+    for depth in (0, 1):  # the leaf itself, the batched children of a frontier node
+        score, rows = search(fen, 300, depth, 0.4, 0.6)
+        full_score, full_rows = search(fen, None, depth, 0.4, 0.6)
+        assert rows == 0 and full_rows > 0
+        assert score == pytest.approx(full_score)
+        # a window around the score keeps every leaf
+        assert search(fen, 300, depth, 0.95, 1.0) == (pytest.approx(full_score), full_rows)
+
+
+def test_futility_pruning_keeps_the_best_move():
+    results = []
+    for futility_margin in (300, None):
+        model = StaticEvalModel()
+        ai = AiMoveFinder.AiMoveFinder(model=model, futility_margin=futility_margin, tt_size=2 ** 10)
+        gs = ChessEngine.GameState(track_one_hot=True)
+        gs.load_fen('q3k3/8/8/8/8/8/8/Q3K3 w - - 0 1')  # white takes the queen
+        move = ai.find_best_move_iterative(gs, gs.get_valid_moves(), max_depth=3)
+        results.append((move.get_chess_notation(), ai.best_score, model.rows))
+    (move, score, rows), (full_move, full_score, full_rows) = results
+    assert move == full_move == 'a1a8'
+    assert score == pytest.approx(full_score)
+    assert rows < full_rows
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+import ChessEngine
+import UciEngine
+from Perft import REFERENCE_POSITIONS
+
+BACKENDS = pytest.mark.parametrize('bitboards', [True, False], ids=['bitboards', 'list'])
+INVALID_FENS = [
+    '',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1',  # seven ranks
+    'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',  # rank too long
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq - 0 1',  # unknown piece
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1',  # side to move
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkx - 0 1',  # castling letters
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KKQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e9 0 1',  # en passant off the board
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e3 0 1',  # wrong rank for the side to move
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e6 0 1',  # no pawn passed the square
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1',  # move counters
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1 extra',
+    '8/8/8/8/8/8/8/8 w - - 0 1',  # no kings
+    '4k3/8/8/8/8/8/8/8 w - - 0 1',
+    '4k3/8/8/8/8/8/8/3KK3 w - - 0 1',  # two white kings
+    'P3k3/8/8/8/8/8/8/4K3 w - - 0 1',  # pawn on the last rank
+    '4k3/8/8/8/8/8/4R3/4K3 w - - 0 1',  # the side not to move is in check
+]
+
+
+@BACKENDS
+@pytest.mark.parametrize('fen', INVALID_FENS)
+def test_invalid_fen(fen, bitboards):
+    gs = ChessEngine.GameState(bitboards=bitboards)
+    with pytest.raises(ValueError):
+        gs.load_fen(fen)
+
+
+@BACKENDS
+@pytest.mark.parametrize('fen, castling', [('4k3/8/8/8/8/8/8/6K1 w K - 0 1', '-'),
+                                           ('r3k3/8/8/8/8/8/8/4K2R w KQkq - 0 1', 'Kq'),
+                                           ('r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1', 'KQkq')])
+def test_castling_rights_need_king_and_rook(fen, castling, bitboards):
+    gs = ChessEngine.GameState(bitboards=bitboards)
+    gs.load_fen(fen)
+    assert gs.get_fen().split()[2] == castling
+    gs.get_valid_moves()
+
+
+@BACKENDS
+@pytest.mark.parametrize('fen', [fen for fen, counts in REFERENCE_POSITIONS.values()] +
+                         ['rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2', '4k3/8/8/8/8/8/8/4K3 w - -'])
+def test_valid_fen_round_trip(fen, bitboards):
+    gs = ChessEngine.GameState(bitboards=bitboards)
+    gs.load_fen(fen)
+    assert gs.get_fen().split()[:4] == fen.split()[:4]
+
+
+def test_uci_reports_invalid_fen():
+    output = io.StringIO()
+    engine = UciEngine.UciEngine(output=output)
+    for fen in INVALID_FENS:
+        engine.handle('position fen ' + fen)
+    engine.handle('go depth 1')
+    engine.handle('quit')
+    lines = output.getvalue().splitlines()
+    assert sum(line.startswith('info string invalid fen') for line in lines) == len(INVALID_FENS)
+    assert lines[-1] != 'bestmove 0000'
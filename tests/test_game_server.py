@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import NumpyModel
+from GameServer import GameServer, InferenceBatcher
+
+TIMEOUT = 60  # seconds before a hanging server fails the test
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+# the network, failing once calls_left more predict calls were made
+class FailingModel():
+    def __init__(self):
+        self.model = NumpyModel.load_model()
+        self.calls_left = None
+
+    def predict(self, x, batch_size=None, verbose=0):
+        if self.calls_left is not None:
+            self.calls_left -= 1
+            if self.calls_left < 0:
+                raise RuntimeError('model failed')
+        return self.model.predict(x, batch_size=batch_size, verbose=verbose)
+
+
+@pytest.fixture
+def server():
+    batcher = InferenceBatcher(FailingModel())
+    server = GameServer(batcher, max_searches=2, tt_size=2 ** 10)
+    yield server
+    batcher.stop()
+    server.executor.shutdown(wait=False)
+    server.close()
+
+
+# replies of the server to lines sent one at a time over one connection, fails instead of hanging
+def talk(server, lines):
+    async def client():
+        listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+        replies = []
+        for line in lines:
+            if callable(line):
+                line()
+                continue
+            writer.write(line.encode() + b'\n')
+            await writer.drain()
+            replies.append((await reader.readline()).decode().strip())
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return replies
+
+    return asyncio.run(asyncio.wait_for(client(), TIMEOUT))
+
+
+def test_invalid_fen_keeps_the_session(server):
+    replies = talk(server, ['moves e2e4', 'new 8/8/8/8/8/8/8/8 w - - 0 1', 'fen', 'go depth 1'])
+    assert replies[0] == 'ok'
+    assert replies[1].startswith('error ')
+    assert replies[2].startswith('rnbqkbnr/pppppppp/8/8/4P3')
+    assert replies[3].startswith('bestmove ')
+
+
+def test_failed_search_keeps_the_session(server):
+    def fail(calls_left):
+        return lambda: setattr(server.batcher.model, 'calls_left', calls_left)
+
+    # the root's children are scored first, the failure comes with a root move on the board
+    replies = talk(server, [fail(1), 'go depth 3', 'fen', fail(None), 'go depth 1', 'fen'])
+    assert replies[0] == 'error model failed'
+    assert replies[1] == START_FEN  # the moves of the failed search are taken back
+    assert replies[2].startswith('bestmove ')
+    assert replies[3] != START_FEN
+    assert server.metrics.counters['errors'] == 1
@@ -0,0 +1,79 @@
+import random
+
+import numpy as np
+import pytest
+
+import ChessEngine
+from Perft import REFERENCE_POSITIONS
+
+BACKENDS = pytest.mark.parametrize('bitboards', [True, False], ids=['bitboards', 'list'])
+# castling right: (king square, rook square)
+CASTLING_SQUARES = {ChessEngine.CASTLE_WKS: ((7, 4), (7, 7)), ChessEngine.CASTLE_WQS: ((7, 4), (7, 0)),
+                    ChessEngine.CASTLE_BKS: ((0, 4), (0, 7)), ChessEngine.CASTLE_BQS: ((0, 4), (0, 0))}
+
+
+def new_game_state(fen=None, bitboards=False):
+    gs = ChessEngine.GameState(track_one_hot=True, bitboards=bitboards)
+    if fen is not None:
+        gs.load_fen(fen)
+    return gs
+
+
+# everything make_move changes and undo_move has to restore
+def state(gs):
+    bitboards = dict(gs.bitboards, **gs.occupied) if hasattr(gs, 'bitboards') else None
+    return ([row[:] for row in gs.board], gs.white_to_move, gs.castling, gs.en_passant_possible, gs.zobrist_key,
+            gs.static_eval, gs.one_hot.tobytes(), gs.white_king_location, gs.black_king_location, bitboards)
+
+
+# incrementally kept values match a recomputation, castling rights are only kept with king and rook at home
+def check_incremental(gs):
+    assert gs.zobrist_key == gs.compute_zobrist_key()
+    assert gs.static_eval == gs.compute_static_eval()
+    one_hot = gs.one_hot.copy()
+    gs.reset_one_hot()
+    assert np.array_equal(gs.one_hot, one_hot)
+    for right, (king, rook) in CASTLING_SQUARES.items():
+        if gs.castling & right:
+            color = 'w' if king[0] == 7 else 'b'
+            assert gs.board[king[0]][king[1]] == color + 'K' and gs.board[rook[0]][rook[1]] == color + 'R'
+
+
+def check_round_trips(gs):
+    before = state(gs)
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        check_incremental(gs)
+        gs.undo_move()
+        assert state(gs) == before, move.get_chess_notation()
+
+
+@BACKENDS
+@pytest.mark.parametrize('name', REFERENCE_POSITIONS)
+def test_reference_positions(name, bitboards):
+    gs = new_game_state(REFERENCE_POSITIONS[name][0], bitboards)
+    check_round_trips(gs)
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        check_round_trips(gs)
+        gs.undo_move()
+
+
+@BACKENDS
+def test_random_games(bitboards):
+    rng = random.Random(3)
+    for game in range(10):
+        gs = new_game_state(bitboards=bitboards)
+        states = []
+        for ply in range(150):
+            check_round_trips(gs)
+            valid_moves = gs.get_valid_moves()
+            if not valid_moves:
+                break
+            states.append(state(gs))
+            gs.make_move(rng.choice(valid_moves))
+        # the whole game taken back, including en passant squares of earlier plies
+        while states:
+            gs.undo_move()
+            assert state(gs) == states.pop()
+        check_incremental(gs)
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from Perft import REFERENCE_POSITIONS, new_game_state
+
+BACKENDS = pytest.mark.parametrize('bitboards', [True, False], ids=['bitboards', 'list'])
+
+
+# legal moves the slow way: every pseudo-legal move is made and dropped when it leaves the own king attacked.
+# probes a 2d-list copy of the position, its pseudo-legal generator only knows the board
+def probed_moves(position):
+    gs = new_game_state(position.get_fen())
+    gs.pins, gs.checks = [], []
+    moves = gs.get_all_possible_moves()
+    king_row, king_col = gs.white_king_location if gs.white_to_move else gs.black_king_location
+    gs.get_castle_moves(king_row, king_col, moves)
+    legal = []
+    for move in moves:
+        gs.make_move(move)
+        gs.white_to_move = not gs.white_to_move
+        if not gs.in_check():
+            legal.append(move)
+        gs.white_to_move = not gs.white_to_move
+        gs.undo_move()
+    return legal
+
+
+def check_legal_moves(gs):
+    valid_moves = gs.get_valid_moves()
+    in_check = gs.in_check()
+    assert gs.check_mate == (not valid_moves and in_check)
+    assert gs.stale_mate == (not valid_moves and not in_check)
+    assert sorted(move.code for move in valid_moves) == sorted(move.code for move in probed_moves(gs)), gs.get_fen()
+    return valid_moves
+
+
+@BACKENDS
+@pytest.mark.parametrize('name', REFERENCE_POSITIONS)
+def test_reference_positions(name, bitboards):
+    gs = new_game_state(REFERENCE_POSITIONS[name][0], bitboards)
+    for move in check_legal_moves(gs):
+        gs.make_move(move)
+        check_legal_moves(gs)
+        gs.undo_move()
+
+
+@BACKENDS
+def test_random_games(bitboards):
+    rng = random.Random(2)
+    for game in range(10):
+        gs = new_game_state(bitboards=bitboards)
+        for ply in range(200):
+            valid_moves = check_legal_moves(gs)
+            if not valid_moves:
+                break
+            gs.make_move(rng.choice(valid_moves))
+
+
+@BACKENDS
+@pytest.mark.parametrize('fen', ['7k/5Q2/5K2/8/8/8/8/8 b - - 0 1', '7k/6Q1/6K1/8/8/8/8/8 b - - 0 1',
+                                 'r3k2r/8/8/8/8/8/8/R3K1r1 w Qkq - 0 1', '8/8/8/2k5/3Pp3/8/8/4K2R b K d3 0 1'],
+                         ids=['stalemate', 'checkmate', 'castle_in_check', 'en_passant_pin'])
+def test_special_positions(fen, bitboards):
+    check_legal_moves(new_game_state(fen, bitboards))
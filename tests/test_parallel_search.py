@@ -0,0 +1,58 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import ChessEngine
+import ParallelSearch
+
+
+@pytest.fixture(scope='module')
+def finder():
+    finder = ParallelSearch.ParallelMoveFinder(2, futility_margin=None)
+    yield finder
+    finder.close()
+
+
+# search without any limit on another thread, stopped after seconds: returns how long stopping took
+def stopped_search(finder, seconds):
+    gs = ChessEngine.GameState(bitboards=True)
+    gs.load_fen('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1')
+    result = []
+    finder.stop_requested = False  # the owner clears it before a search, as SearchThread does
+    thread = threading.Thread(target=lambda: result.append(
+        finder.find_best_move_iterative(gs, gs.get_valid_moves(), max_depth=64)), daemon=True)
+    thread.start()
+    time.sleep(seconds)
+    stop = time.perf_counter()
+    finder.stop()
+    thread.join(60)
+    assert not thread.is_alive(), 'workers kept searching'
+    return time.perf_counter() - stop, result[0]
+
+
+def test_stop_reaches_running_workers(finder):
+    for seconds in (0.5, 3):  # during the first lone search and during the parallel part of deeper iterations
+        waited, move = stopped_search(finder, seconds)
+        assert waited < 5
+        assert move is not None
+
+
+def test_search_after_stop(finder):
+    stopped_search(finder, 0.5)
+    gs = ChessEngine.GameState(bitboards=True)
+    finder.stop_requested = False
+    assert finder.find_best_move_iterative(gs, gs.get_valid_moves(), max_depth=2) is not None
+    assert finder.completed_depth == 2
+
+
+# the task a worker runs gives up as soon as the shared event is set, whatever its depth
+def test_worker_task_checks_stop_event():
+    event = multiprocessing.Event()
+    ParallelSearch._init_worker({'futility_margin': None}, True, event)
+    snapshot = ChessEngine.GameState(bitboards=True).get_snapshot()
+    event.set()
+    assert ParallelSearch._search_root_move((snapshot, 0, 12, 0, 1, None, None))[1] is None
+    event.clear()
+    assert ParallelSearch._search_root_move((snapshot, 0, 2, 0, 1, None, None))[1] is not None
@@ -0,0 +1,25 @@
+import pytest
+
+from Perft import DEFAULT_DEPTHS, REFERENCE_POSITIONS, divide, new_game_state, perft
+
+BACKENDS = pytest.mark.parametrize('bitboards', [True, False], ids=['bitboards', 'list'])
+
+
+@BACKENDS
+@pytest.mark.parametrize('name', REFERENCE_POSITIONS)
+def test_reference_counts(name, bitboards):
+    fen, counts = REFERENCE_POSITIONS[name]
+    gs = new_game_state(fen, bitboards)
+    for depth in range(1, DEFAULT_DEPTHS[name] + 1):
+        assert perft(gs, depth) == counts[depth - 1]
+    # every move was taken back
+    assert gs.get_fen() == new_game_state(fen).get_fen()
+    assert gs.zobrist_key == gs.compute_zobrist_key()
+
+
+@pytest.mark.parametrize('name', REFERENCE_POSITIONS)
+def test_divide(name):
+    fen, counts = REFERENCE_POSITIONS[name]
+    by_backend = [divide(new_game_state(fen, bitboards), 2) for bitboards in (True, False)]
+    assert by_backend[0] == by_backend[1]
+    assert sum(by_backend[0].values()) == counts[1]
@@ -0,0 +1,29 @@
+import AiMoveFinder
+import ChessEngine
+import NumpyModel
+
+
+def test_shared_model_is_not_patched():
+    model = NumpyModel.load_model()
+    ai = AiMoveFinder.AiMoveFinder(model=model, stats=True)
+    other = AiMoveFinder.AiMoveFinder(model=model)
+    seen = []
+
+    # another search sharing the model calls it while this one collects statistics
+    def on_iteration(gs):
+        seen.append('predict' in vars(model))
+        other.search_position(ChessEngine.GameState(track_one_hot=True), 1)
+
+    ai.on_iteration = on_iteration
+    gs = ChessEngine.GameState(track_one_hot=True)
+    ai.find_best_move_iterative(gs, gs.get_valid_moves(), max_depth=2)
+    assert seen == [False, False]
+    assert ai.model is model
+    calls = ai.stats.timers['model.predict'][0]
+    assert 0 < calls
+    # only this search's own calls are counted: a search without the other one makes as many
+    ai.on_iteration = None
+    ai.transposition_table.clear()
+    ai.history = {}
+    ai.find_best_move_iterative(gs, gs.get_valid_moves(), max_depth=2)
+    assert ai.stats.timers['model.predict'][0] == calls
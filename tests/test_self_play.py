@@ -0,0 +1,14 @@
+import SelfPlay
+
+
+def test_engines_keep_their_own_tables():
+    SelfPlay._init_worker({'tt_size': 2 ** 10})
+    a, b = SelfPlay.worker_ai, SelfPlay.worker_ai_b
+    assert a is not b and a.model is b.model
+    rules = SelfPlay.adjudication_rules(max_plies=6)
+    task = (0, (None, []), True, SelfPlay.engine_limits(max_depth=1), SelfPlay.engine_limits(max_depth=2), rules, True)
+    game = SelfPlay.play_game(task)
+    assert game['plies'] == 6
+    assert a.transposition_table is not b.transposition_table
+    # A searched white's moves to depth 1, B black's to depth 2
+    assert a.completed_depth == 1 and b.completed_depth == 2
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from Perft import REFERENCE_POSITIONS, new_game_state
+
+BACKENDS = pytest.mark.parametrize('bitboards', [True, False], ids=['bitboards', 'list'])
+
+
+def is_capture(move):
+    return move.piece_captured != '--' or move.is_pawn_promotion
+
+
+# legal move of valid_moves that the staged generator should yield for a hash or killer move, None if it can't
+def matching_move(valid_moves, move):
+    if move is None:
+        return None
+    return next((valid for valid in valid_moves if valid == move and valid.piece_moved == move.piece_moved), None)
+
+
+# get_staged_moves yields the moves of get_valid_moves once each, hash move first, captures before killers before
+# the other quiet moves, and sets check_mate / stale_mate like get_valid_moves
+def check_staged_moves(gs, hash_move=None, killers=()):
+    valid_moves = gs.get_valid_moves()
+    check_mate, stale_mate = gs.check_mate, gs.stale_mate
+    gs.check_mate = gs.stale_mate = None
+    staged = []
+    for move in gs.get_staged_moves(hash_move, killers, capture_key=lambda move: move.piece_captured,
+                                    quiet_key=lambda move: move.end_col):
+        # the search plays and takes back every move before it asks for the next one
+        gs.make_move(move)
+        gs.get_valid_moves()
+        gs.undo_move()
+        staged.append(move)
+    assert sorted(move.code for move in staged) == sorted(move.code for move in valid_moves), gs.get_fen()
+    assert len(set(move.move_id for move in staged)) == len(staged)
+    assert (gs.check_mate, gs.stale_mate) == (check_mate, stale_mate)
+    rest = staged
+    first = matching_move(valid_moves, hash_move)
+    if first is not None:
+        assert staged[0] == first
+        rest = staged[1:]
+    kinds = [0 if is_capture(move) else 1 for move in rest]
+    assert kinds == sorted(kinds), gs.get_fen()
+    quiet_killers = [matching_move(valid_moves, killer) for killer in killers]
+    quiet_killers = [killer for i, killer in enumerate(quiet_killers) if killer is not None and
+                     not is_capture(killer) and killer != first and killer not in quiet_killers[:i]]
+    quiets = [move for move in rest if not is_capture(move)]
+    assert quiets[:len(quiet_killers)] == quiet_killers
+
+
+@BACKENDS
+@pytest.mark.parametrize('name', REFERENCE_POSITIONS)
+def test_reference_positions(name, bitboards):
+    gs = new_game_state(REFERENCE_POSITIONS[name][0], bitboards)
+    # moves of the other positions: mostly illegal here, some with the squares of a legal move but another piece
+    foreign = [move for other in REFERENCE_POSITIONS.values() for move in new_game_state(other[0]).get_valid_moves()]
+    rng = random.Random(name)
+    for move in gs.get_valid_moves():
+        check_staged_moves(gs, move, (rng.choice(foreign), move))
+        gs.make_move(move)
+        replies = gs.get_valid_moves()
+        check_staged_moves(gs)
+        check_staged_moves(gs, move, replies[-1:] + [move])  # the parent's move is stale here
+        check_staged_moves(gs, rng.choice(foreign), [rng.choice(foreign), rng.choice(foreign)])
+        if replies:
+            check_staged_moves(gs, rng.choice(replies), [rng.choice(replies), rng.choice(foreign)])
+        gs.undo_move()
+
+
+@BACKENDS
+def test_random_games(bitboards):
+    rng = random.Random(1)
+    terminal = 0
+    for game in range(12):
+        gs = new_game_state(bitboards=bitboards)
+        previous = None
+        for ply in range(200):
+            valid_moves = gs.get_valid_moves()
+            candidates = [None, previous] + ([rng.choice(valid_moves)] if valid_moves else [])
+            check_staged_moves(gs, rng.choice(candidates), [rng.choice(candidates), rng.choice(candidates)])
+            if not valid_moves:
+                terminal += 1
+                break
+            previous = rng.choice(valid_moves)
+            gs.make_move(previous)
+    assert terminal > 0  # some games end in checkmate or stalemate
+
+
+@BACKENDS
+@pytest.mark.parametrize('fen', ['7k/5Q2/5K2/8/8/8/8/8 b - - 0 1', '7k/6Q1/6K1/8/8/8/8/8 b - - 0 1'],
+                         ids=['stalemate', 'checkmate'])
+def test_no_moves(fen, bitboards):
+    gs = new_game_state(fen, bitboards)
+    check_staged_moves(gs, new_game_state().get_valid_moves()[0])
+    assert list(gs.get_staged_moves()) == []
+    assert gs.stale_mate == (fen.startswith('7k/5Q2'))
+    assert gs.check_mate == (not fen.startswith('7k/5Q2'))
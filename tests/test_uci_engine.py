@@ -0,0 +1,45 @@
+import io
+import threading
+
+import pytest
+
+import UciEngine
+
+TIMEOUT = 60  # seconds before a hanging engine fails the test
+
+
+@pytest.fixture
+def engine():
+    return UciEngine.UciEngine(output=io.StringIO())
+
+
+# lines sent while running lines through engine.run on another thread, fails instead of hanging
+def run(engine, lines):
+    engine.output = io.StringIO()
+    thread = threading.Thread(target=engine.run, args=(lines,), daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert not thread.is_alive(), 'engine hangs'
+    return engine.output.getvalue().splitlines()
+
+
+def best_moves(output):
+    return [line for line in output if line.startswith('bestmove')]
+
+
+def test_stop_right_after_go_infinite(engine):
+    for i in range(20):  # the stop has to win the race against the search thread picking the job up
+        output = run(engine, ['position startpos\n', 'go infinite\n', 'stop\n', 'quit\n'])
+        assert len(best_moves(output)) == 1
+
+
+def test_bestmove_is_sent_when_input_ends_during_go(engine):
+    output = run(engine, ['position startpos moves e2e4\n', 'go infinite\n'])
+    assert len(best_moves(output)) == 1
+    assert best_moves(output)[0] != 'bestmove 0000'
+
+
+def test_depth_limited_go(engine):
+    output = run(engine, ['position startpos\n', 'go depth 2\n', 'isready\n', 'quit\n'])
+    assert 'readyok' in output
+    assert len(best_moves(output)) == 1